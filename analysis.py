@@ -1,6 +1,17 @@
-import duckdb
+import argparse
 import logging
-import matplotlib.pyplot as plt
+
+from approximate import (
+    SAMPLE_METHODS, SAMPLE_ROWS, approx_heavy_light, approx_max_trip, approx_totals, build_sample, sample_info,
+)
+from emissions_api import emissions_table
+from plots import line_plot, render_plots, save_series
+from profiling import connect
+from publish import WORKING_DATABASE, reader_database
+from query_cache import QueryCache
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from rollup import build_cube, cube_is_current, heavy_light, max_trip, totals
+from taxi_config import TAXI_TYPES
 
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
@@ -8,526 +19,207 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def analyze_data():
+# cube grain -> label used in the report
+GRAIN_LABELS = {"hour": "HOUR", "dow": "DOW", "week": "WEEK", "month": "MONTH"}
+
+
+def report(label, message):
+    print(f"[{label}] {message}")
+    logging.info(f"[{label}] {message}")
+
+
+def report_period(con, label, year=None, cache=None):
+    """Print the largest trip and heavy/light hour, day, week and month for one period.
+
+    year None means across all years. Everything is answered from emissions_cube,
+    through cache (a query_cache.QueryCache) when given.
+    """
+    for taxi_type in TAXI_TYPES:
+        value = max_trip(con, taxi_type, year, cache)
+        if value is not None:
+            report(label, f"Largest {taxi_type.upper()} trip CO2: {value:.3f} kg")
+
+    for grain, grain_label in GRAIN_LABELS.items():
+        for taxi_type in TAXI_TYPES:
+            heavy, light = heavy_light(con, taxi_type, grain, year, cache)
+            if heavy is None:
+                continue
+            report(label, f"{taxi_type.upper()} heavy {grain_label}: {heavy[0]} (avg {heavy[1]:.3f} kg)")
+            report(label, f"{taxi_type.upper()} light {grain_label}: {light[0]} (avg {light[1]:.3f} kg)")
+
+
+def month_series(table):
+    """Months and {'Yellow Taxi': totals, ...} from an Arrow table of (taxi_type, month, co2_kgs)."""
+    frame = table.to_pandas().pivot(index="month", columns="taxi_type", values="co2_kgs")
+    frame = frame.reindex(columns=list(TAXI_TYPES)).fillna(0).sort_index()
+    return frame.index.tolist(), {f"{t.capitalize()} Taxi": frame[t].tolist() for t in TAXI_TYPES}
+
+
+def monthly_plot(con, title, filename, year=None, cache=None):
+    filters = None if year is None else {"year": year}
+    months, series = month_series(emissions_table(con, ["taxi_type", "month"], filters, cache=cache))
+    return line_plot(filename, title, 'Month of Year', 'Total CO2 Emissions (kg)', months, series, xticks=True)
+
+
+def report_all(con, years=(2024,), cache=None):
+    """Print every figure and return the plot specs, answered from emissions_cube.
+
+    Drawing is left to plots.render_plots(), so nothing here needs matplotlib.
+    """
+    # SECTION 1: results across ALL years
+    report_period(con, "ALL", cache=cache)
+    specs = [monthly_plot(con, 'Monthly CO2 Emissions - All Years', 'monthly_co2_emissions_all.png', cache=cache)]
+
+    # heaviest and lightest year by TOTAL
+    yearly = {taxi_type: totals(con, taxi_type, "year", cache=cache) for taxi_type in TAXI_TYPES}
+    for taxi_type, rows in yearly.items():
+        if not rows:
+            continue
+        high = max(rows, key=lambda r: r[1])
+        low = min(rows, key=lambda r: r[1])
+        report("ALL", f"{taxi_type.upper()} highest total year: {high[0]} ({high[1]:.3f} kg)")
+        report("ALL", f"{taxi_type.upper()} lowest  total year: {low[0]} ({low[1]:.3f} kg)")
+
+    years_all = sorted({r[0] for rows in yearly.values() for r in rows})
+    by_year = {taxi_type: dict(rows) for taxi_type, rows in yearly.items()}
+    specs.append(line_plot(
+        'yearly_co2_emissions_all.png', 'Yearly CO2 Emissions - All Years', 'Year', 'Total CO2 Emissions (kg)',
+        years_all, {'Yellow Taxi': [by_year["yellow"].get(y) for y in years_all],
+                    'Green Taxi': [by_year["green"].get(y) for y in years_all]},
+    ))
+
+    # SECTION 2: results for single years (2024 by default)
+    for year in years:
+        report_period(con, str(year), year, cache)
+        specs.append(monthly_plot(con, f'Monthly CO2 Emissions - {year}', f'monthly_co2_emissions_{year}.png', year, cache))
+    return specs
+
+
+def report_period_approx(con, label, year=None):
+    """report_period() estimated from emissions_sample, with 95% intervals.
+
+    Heavy/light buckets whose lead over the runner-up is within the sampling
+    error are flagged as uncertain.
+    """
+    for taxi_type in TAXI_TYPES:
+        value = approx_max_trip(con, taxi_type, year)
+        if value is not None:
+            report(label, f"Largest {taxi_type.upper()} trip CO2: >= {value:.3f} kg (sample max)")
+
+    for grain, grain_label in GRAIN_LABELS.items():
+        for taxi_type in TAXI_TYPES:
+            heavy, light = approx_heavy_light(con, taxi_type, grain, year)
+            if heavy is None:
+                continue
+            for name, (bucket, avg, half_width, uncertain) in (("heavy", heavy), ("light", light)):
+                flag = " [ranking uncertain]" if uncertain else ""
+                report(label, f"{taxi_type.upper()} {name} {grain_label}: {bucket} "
+                              f"(avg {avg:.3f} ± {half_width:.3f} kg){flag}")
+
+
+def approx_monthly_plot(con, title, filename, year=None):
+    totals_by_type = {t: dict((m, total) for m, total, _ in approx_totals(con, t, "month", year)) for t in TAXI_TYPES}
+    months = sorted({m for rows in totals_by_type.values() for m in rows})
+    series = {f"{t.capitalize()} Taxi": [rows.get(m, 0) for m in months] for t, rows in totals_by_type.items()}
+    return line_plot(filename, title, 'Month of Year', 'Total CO2 Emissions (kg)', months, series, xticks=True)
+
+
+def report_all_approx(con, years=(2024,)):
+    """report_all() estimated from emissions_sample, plots get an _approx suffix."""
+    report_period_approx(con, "ALL")
+    specs = [approx_monthly_plot(con, 'Monthly CO2 Emissions - All Years (approximate)',
+                                 'monthly_co2_emissions_all_approx.png')]
+
+    yearly = {taxi_type: approx_totals(con, taxi_type, "year") for taxi_type in TAXI_TYPES}
+    for taxi_type, rows in yearly.items():
+        if not rows:
+            continue
+        high = max(rows, key=lambda r: r[1])
+        low = min(rows, key=lambda r: r[1])
+        report("ALL", f"{taxi_type.upper()} highest total year: {high[0]} ({high[1]:.3f} ± {high[2]:.3f} kg)")
+        report("ALL", f"{taxi_type.upper()} lowest  total year: {low[0]} ({low[1]:.3f} ± {low[2]:.3f} kg)")
+
+    for year in years:
+        report_period_approx(con, str(year), year)
+        specs.append(approx_monthly_plot(con, f'Monthly CO2 Emissions - {year} (approximate)',
+                                         f'monthly_co2_emissions_{year}_approx.png', year))
+    return specs
+
+
+def analyze_data(years=(2024,), rebuild_cube=False, parquet_dir=None, resources=None, plots=True, use_cache=True,
+                 approximate=False, sample_rows=SAMPLE_ROWS, sample_method="reservoir", database=None):
+    con = None
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        logging.info("Connected to emissions database")
-        print("Connected to emissions database")
-        con.execute("PRAGMA memory_limit='4GB'") 
-
-        def calculate_month_totals(y_rows, g_rows):
-            # rows are list of (month, total)
-            months_y = [m for m, i in y_rows]
-            months_g = [m for m, i in g_rows]
-            months = sorted(set(months_y) | set(months_g))
-            y_map = dict(y_rows)
-            g_map = dict(g_rows)
-            yellow_totals = [y_map.get(m, 0) for m in months]
-            green_totals  = [g_map.get(m, 0) for m in months]
-            return months, yellow_totals, green_totals
-
-        # SECTION 1: results across ALL years
-
-        # largest trip CO2 values across all years
-        (y_max_co2,) = con.execute("""
-            SELECT MAX(trip_co2_kgs) FROM yellow_transformed
-        """).fetchone()
-        print(f"[ALL] Largest YELLOW trip CO2: {y_max_co2:.3f} kg")
-        logging.info(f"Largest YELLOW trip CO2: {y_max_co2:.3f} kg")
-
-        (g_max_co2,) = con.execute("""
-            SELECT MAX(trip_co2_kgs) FROM green_transformed
-        """).fetchone()
-        print(f"[ALL] Largest GREEN trip CO2:  {g_max_co2:.3f} kg")
-        logging.info(f"Largest GREEN trip CO2:  {g_max_co2:.3f} kg")
-
-        # heavy and light hour across all years
-        y_heavy_hour = con.execute("""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY hour_of_day
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW heavy HOUR: {y_heavy_hour[0]} (avg {y_heavy_hour[1]:.3f} kg)")
-        logging.info(f"YELLOW heavy HOUR: {y_heavy_hour[0]} (avg {y_heavy_hour[1]:.3f} kg)")
-
-        y_light_hour = con.execute("""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY hour_of_day
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW light HOUR: {y_light_hour[0]} (avg {y_light_hour[1]:.3f} kg)")
-        logging.info(f"[ALL] YELLOW light HOUR: {y_light_hour[0]} (avg {y_light_hour[1]:.3f} kg)")
-        g_heavy_hour = con.execute("""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY hour_of_day
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN heavy HOUR:  {g_heavy_hour[0]} (avg {g_heavy_hour[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN heavy HOUR:  {g_heavy_hour[0]} (avg {g_heavy_hour[1]:.3f} kg)")
-        g_light_hour = con.execute("""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY hour_of_day
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN light HOUR:  {g_light_hour[0]} (avg {g_light_hour[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN light HOUR:  {g_light_hour[0]} (avg {g_light_hour[1]:.3f} kg)")
-
-        # heavy and light day across all years
-        y_heavy_day = con.execute("""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY day_of_week
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW heavy DOW:  {y_heavy_day[0]} (avg {y_heavy_day[1]:.3f} kg)")
-        logging.info(f"[ALL] YELLOW heavy DOW:  {y_heavy_day[0]} (avg {y_heavy_day[1]:.3f} kg)")
-
-        y_light_day = con.execute("""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY day_of_week
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW light DOW:  {y_light_day[0]} (avg {y_light_day[1]:.3f} kg)")
-        logging.info(f"[ALL] YELLOW light DOW:  {y_light_day[0]} (avg {y_light_day[1]:.3f} kg)")
-
-        g_heavy_day = con.execute("""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY day_of_week
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN heavy DOW:   {g_heavy_day[0]} (avg {g_heavy_day[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN heavy DOW:   {g_heavy_day[0]} (avg {g_heavy_day[1]:.3f} kg)")
-
-        g_light_day = con.execute("""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY day_of_week
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN light DOW:   {g_light_day[0]} (avg {g_light_day[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN light DOW:   {g_light_day[0]} (avg {g_light_day[1]:.3f} kg)")
-
-        # heavy and light week across all years
-        y_heavy_week = con.execute("""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY week_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW heavy WEEK: {y_heavy_week[0]} (avg {y_heavy_week[1]:.3f} kg)")
-        logging.info(f"[ALL] YELLOW heavy WEEK: {y_heavy_week[0]} (avg {y_heavy_week[1]:.3f} kg)")
-
-        y_light_week = con.execute("""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY week_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW light WEEK: {y_light_week[0]} (avg {y_light_week[1]:.3f} kg)")
-        logging.info(f"[ALL] YELLOW light WEEK: {y_light_week[0]} (avg {y_light_week[1]:.3f} kg)")
-
-        g_heavy_week = con.execute("""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY week_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN heavy WEEK:  {g_heavy_week[0]} (avg {g_heavy_week[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN heavy WEEK:  {g_heavy_week[0]} (avg {g_heavy_week[1]:.3f} kg)")
-
-        g_light_week = con.execute("""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY week_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN light WEEK:  {g_light_week[0]} (avg {g_light_week[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN light WEEK:  {g_light_week[0]} (avg {g_light_week[1]:.3f} kg)")
-
-        # heavy and light month across all years
-        y_heavy_month = con.execute("""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY month_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW heavy MONTH: {y_heavy_month[0]} (avg {y_heavy_month[1]:.3f} kg)")
-        logging.info(f"[ALL] YELLOW heavy MONTH: {y_heavy_month[0]} (avg {y_heavy_month[1]:.3f} kg)")
-
-        y_light_month = con.execute("""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed
-            GROUP BY month_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW light MONTH: {y_light_month[0]} (avg {y_light_month[1]:.3f} kg)")
-        logging.info(f"[ALL] YELLOW light MONTH: {y_light_month[0]} (avg {y_light_month[1]:.3f} kg)")
-
-        g_heavy_month = con.execute("""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY month_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN heavy MONTH:  {g_heavy_month[0]} (avg {g_heavy_month[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN heavy MONTH:  {g_heavy_month[0]} (avg {g_heavy_month[1]:.3f} kg)")
-
-        g_light_month = con.execute("""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed
-            GROUP BY month_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN light MONTH:  {g_light_month[0]} (avg {g_light_month[1]:.3f} kg)")
-        logging.info(f"[ALL] GREEN light MONTH:  {g_light_month[0]} (avg {g_light_month[1]:.3f} kg)")
-
-        # calculate the monthly totals across all years plot
-        y_monthly_all = con.execute("""
-            SELECT month_of_year, SUM(trip_co2_kgs) AS total_co2_kg
-            FROM yellow_transformed
-            GROUP BY month_of_year
-            ORDER BY month_of_year
-        """).fetchall()
-        g_monthly_all = con.execute("""
-            SELECT month_of_year, SUM(trip_co2_kgs) AS total_co2_kg
-            FROM green_transformed
-            GROUP BY month_of_year
-            ORDER BY month_of_year
-        """).fetchall()
-
-        months, yellow_totals, green_totals = calculate_month_totals(y_monthly_all, g_monthly_all)
-
-        plt.figure(figsize=(10, 6))
-        plt.plot(months, yellow_totals, marker='o', label='Yellow Taxi')
-        plt.plot(months, green_totals,  marker='o', label='Green Taxi')
-        plt.xticks(months)
-        plt.xlabel('Month of Year')
-        plt.ylabel('Total CO2 Emissions (kg)')
-        plt.title('Monthly CO2 Emissions - All Years')
-        plt.legend()
-        plt.grid()
-        plt.savefig('monthly_co2_emissions_all.png', dpi=150)
-        print("Saved plot: monthly_co2_emissions_all.png")
-        plt.close()
-
-        # calculate the heaviest and lightest year across all years
-        y_yearly = con.execute("""
-            SELECT EXTRACT(year FROM tpep_pickup_datetime) AS yr,
-                SUM(trip_co2_kgs) AS total_kg
-            FROM yellow_transformed
-            GROUP BY yr
-            ORDER BY yr
-        """).fetchall()
-        years_y   = [r[0] for r in y_yearly]
-        yellow_yr = [r[1] for r in y_yearly]
-
-        g_yearly = con.execute("""
-            SELECT EXTRACT(year FROM lpep_pickup_datetime) AS yr,
-                SUM(trip_co2_kgs) AS total_kg
-            FROM green_transformed
-            GROUP BY yr
-            ORDER BY yr
-        """).fetchall()
-
-        years_g  = [r[0] for r in g_yearly]
-        green_yr = [r[1] for r in g_yearly]
-        
-        # highest / lowest year by TOTAL 
-        y_high = con.execute("""
-            SELECT EXTRACT(year FROM tpep_pickup_datetime) AS yr,
-                SUM(trip_co2_kgs) AS total_kg
-            FROM yellow_transformed
-            GROUP BY yr
-            ORDER BY total_kg DESC
-            LIMIT 1
-        """).fetchone()
-        y_low = con.execute("""
-            SELECT EXTRACT(year FROM tpep_pickup_datetime) AS yr,
-                SUM(trip_co2_kgs) AS total_kg
-            FROM yellow_transformed
-            GROUP BY yr
-            ORDER BY total_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] YELLOW highest total year: {y_high[0]} ({y_high[1]:.3f} kg)")
-        print(f"[ALL] YELLOW lowest  total year: {y_low[0]} ({y_low[1]:.3f} kg)")
-
-        g_high = con.execute("""
-            SELECT EXTRACT(year FROM lpep_pickup_datetime) AS yr,
-                SUM(trip_co2_kgs) AS total_kg
-            FROM green_transformed
-            GROUP BY yr
-            ORDER BY total_kg DESC
-            LIMIT 1
-        """).fetchone()
-        g_low = con.execute("""
-            SELECT EXTRACT(year FROM lpep_pickup_datetime) AS yr,
-                SUM(trip_co2_kgs) AS total_kg
-            FROM green_transformed
-            GROUP BY yr
-            ORDER BY total_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[ALL] GREEN  highest total year: {g_high[0]} ({g_high[1]:.3f} kg)")
-        print(f"[ALL] GREEN  lowest  total year: {g_low[0]} ({g_low[1]:.3f} kg)")
-        plt.figure(figsize=(10, 6))
-        plt.plot(years_y, yellow_yr, marker='o', label='Yellow Taxi')
-        plt.plot(years_g, green_yr,  marker='o', label='Green Taxi')
-        plt.xlabel('Year')
-        plt.ylabel('Total CO2 Emissions (kg)')
-        plt.title('Yearly CO2 Emissions - All Years')
-        plt.legend()
-        plt.grid()
-        plt.tight_layout()
-        plt.savefig('yearly_co2_emissions_all.png', dpi=150)
-        plt.close()
-        print("Saved plot: yearly_co2_emissions_all.png")
-      
-
-       
-
-        
-
-
-        # SECTION 2: Results for the year 2024 only
-
-        # simple filter strings for 2024
-        yt = "WHERE EXTRACT(year FROM tpep_pickup_datetime) = 2024"
-        gt = "WHERE EXTRACT(year FROM lpep_pickup_datetime) = 2024"
-
-        # largest trip CO2 in 2024
-        (y_max_co2_2024,) = con.execute(f"""
-            SELECT MAX(trip_co2_kgs) FROM yellow_transformed {yt}
-        """).fetchone()
-        print(f"[2024] Largest YELLOW trip CO2: {y_max_co2_2024:.3f} kg")
-        logging.info(f"[2024] Largest YELLOW trip CO2: {y_max_co2_2024:.3f} kg")
-
-        (g_max_co2_2024,) = con.execute(f"""
-            SELECT MAX(trip_co2_kgs) FROM green_transformed {gt}
-        """).fetchone()
-        print(f"[2024] Largest GREEN trip CO2:  {g_max_co2_2024:.3f} kg")
-        logging.info(f"[2024] Largest GREEN trip CO2:  {g_max_co2_2024:.3f} kg")
-
-        # heavy and light hour in 2024
-        y_heavy_hour_2024 = con.execute(f"""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY hour_of_day
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW heavy HOUR: {y_heavy_hour_2024[0]} (avg {y_heavy_hour_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW heavy HOUR: {y_heavy_hour_2024[0]} (avg {y_heavy_hour_2024[1]:.3f} kg)")
-
-        y_light_hour_2024 = con.execute(f"""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY hour_of_day
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW light HOUR: {y_light_hour_2024[0]} (avg {y_light_hour_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW light HOUR: {y_light_hour_2024[0]} (avg {y_light_hour_2024[1]:.3f} kg)")
-
-        g_heavy_hour_2024 = con.execute(f"""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY hour_of_day
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN heavy HOUR:  {g_heavy_hour_2024[0]} (avg {g_heavy_hour_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN heavy HOUR:  {g_heavy_hour_2024[0]} (avg {g_heavy_hour_2024[1]:.3f} kg)")
-
-        g_light_hour_2024 = con.execute(f"""
-            SELECT hour_of_day, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY hour_of_day
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN light HOUR:  {g_light_hour_2024[0]} (avg {g_light_hour_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN light HOUR:  {g_light_hour_2024[0]} (avg {g_light_hour_2024[1]:.3f} kg)")
-
-        # heavy and light day in 2024
-        y_heavy_day_2024 = con.execute(f"""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY day_of_week
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW heavy DOW:  {y_heavy_day_2024[0]} (avg {y_heavy_day_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW heavy DOW:  {y_heavy_day_2024[0]} (avg {y_heavy_day_2024[1]:.3f} kg)")
-
-        y_light_day_2024 = con.execute(f"""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY day_of_week
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW light DOW:  {y_light_day_2024[0]} (avg {y_light_day_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW light DOW:  {y_light_day_2024[0]} (avg {y_light_day_2024[1]:.3f} kg)")
-
-        g_heavy_day_2024 = con.execute(f"""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY day_of_week
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN heavy DOW:   {g_heavy_day_2024[0]} (avg {g_heavy_day_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN heavy DOW:   {g_heavy_day_2024[0]} (avg {g_heavy_day_2024[1]:.3f} kg)")
-
-        g_light_day_2024 = con.execute(f"""
-            SELECT day_of_week, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY day_of_week
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN light DOW:   {g_light_day_2024[0]} (avg {g_light_day_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN light DOW:   {g_light_day_2024[0]} (avg {g_light_day_2024[1]:.3f} kg)")
-
-        # heavy and light week in 2024
-        y_heavy_week_2024 = con.execute(f"""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY week_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW heavy WEEK: {y_heavy_week_2024[0]} (avg {y_heavy_week_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW heavy WEEK: {y_heavy_week_2024[0]} (avg {y_heavy_week_2024[1]:.3f} kg)")
-
-        y_light_week_2024 = con.execute(f"""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY week_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW light WEEK: {y_light_week_2024[0]} (avg {y_light_week_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW light WEEK: {y_light_week_2024[0]} (avg {y_light_week_2024[1]:.3f} kg)")
-
-        g_heavy_week_2024 = con.execute(f"""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY week_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN heavy WEEK:  {g_heavy_week_2024[0]} (avg {g_heavy_week_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN heavy WEEK:  {g_heavy_week_2024[0]} (avg {g_heavy_week_2024[1]:.3f} kg)")
-
-        g_light_week_2024 = con.execute(f"""
-            SELECT week_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY week_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN light WEEK:  {g_light_week_2024[0]} (avg {g_light_week_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN light WEEK:  {g_light_week_2024[0]} (avg {g_light_week_2024[1]:.3f} kg)")
-
-        # heavy and light month in 2024
-        y_heavy_month_2024 = con.execute(f"""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY month_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW heavy MONTH: {y_heavy_month_2024[0]} (avg {y_heavy_month_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW heavy MONTH: {y_heavy_month_2024[0]} (avg {y_heavy_month_2024[1]:.3f} kg)")
-
-        y_light_month_2024 = con.execute(f"""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM yellow_transformed {yt}
-            GROUP BY month_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] YELLOW light MONTH: {y_light_month_2024[0]} (avg {y_light_month_2024[1]:.3f} kg)")
-        logging.info(f"[2024] YELLOW light MONTH: {y_light_month_2024[0]} (avg {y_light_month_2024[1]:.3f} kg)")
-
-        g_heavy_month_2024 = con.execute(f"""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY month_of_year
-            ORDER BY avg_kg DESC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN heavy MONTH:  {g_heavy_month_2024[0]} (avg {g_heavy_month_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN heavy MONTH:  {g_heavy_month_2024[0]} (avg {g_heavy_month_2024[1]:.3f} kg)")
-
-        g_light_month_2024 = con.execute(f"""
-            SELECT month_of_year, AVG(trip_co2_kgs) AS avg_kg
-            FROM green_transformed {gt}
-            GROUP BY month_of_year
-            ORDER BY avg_kg ASC
-            LIMIT 1
-        """).fetchone()
-        print(f"[2024] GREEN light MONTH:  {g_light_month_2024[0]} (avg {g_light_month_2024[1]:.3f} kg)")
-        logging.info(f"[2024] GREEN light MONTH:  {g_light_month_2024[0]} (avg {g_light_month_2024[1]:.3f} kg)")
-
-        # monthly totals for 2024 plot
-        y_monthly_2024 = con.execute(f"""
-            SELECT month_of_year, SUM(trip_co2_kgs) AS total_co2_kg
-            FROM yellow_transformed {yt}
-            GROUP BY month_of_year
-            ORDER BY month_of_year
-        """).fetchall()
-        g_monthly_2024 = con.execute(f"""
-            SELECT month_of_year, SUM(trip_co2_kgs) AS total_co2_kg
-            FROM green_transformed {gt}
-            GROUP BY month_of_year
-            ORDER BY month_of_year
-        """).fetchall()
-
-        months24, yellow_totals24, green_totals24 = calculate_month_totals(y_monthly_2024, g_monthly_2024)
-
-        plt.figure(figsize=(10, 6))
-        plt.plot(months24, yellow_totals24, marker='o', label='Yellow Taxi')
-        plt.plot(months24, green_totals24,  marker='o', label='Green Taxi')
-        plt.xticks(months24)
-        plt.xlabel('Month of Year')
-        plt.ylabel('Total CO2 Emissions (kg)')
-        plt.title('Monthly CO2 Emissions - 2024')
-        plt.legend()
-        plt.grid()
-        plt.savefig('monthly_co2_emissions_2024.png', dpi=150)
-        print("Saved plot: monthly_co2_emissions_2024.png")
-
-        # close the connection
-        con.close()
-
+        # the published snapshot, read-only, so a running load doesn't lock us out;
+        # the working database before anything was published or to rebuild the cube
+        database = WORKING_DATABASE if rebuild_cube else reader_database(database)
+        read_only = database != WORKING_DATABASE
+        con = connect(database, read_only=read_only)
+        logging.info(f"Connected to {database}{' (read-only)' if read_only else ''}")
+        print(f"Connected to {database}{' (read-only)' if read_only else ''}")
+        apply_resources(con, "analysis", **(resources or {}))
+
+        if approximate:
+            # estimates from a fixed-size sample, rebuilt only when the sources changed
+            if not read_only:
+                build_sample(con, sample_rows, sample_method, parquet_dir)
+            elif not sample_info(con):
+                raise ValueError(f"{database} has no emissions_sample, run approximate.py before publish.py")
+            specs = report_all_approx(con, years)
+            save_series(specs)
+            if plots:
+                render_plots(specs)
+            return
+
+        # every figure below comes from the small emissions_cube table, built from the
+        # transformed tables or parquet files (see rollup.py) and rebuilt once they changed
+        if rebuild_cube or not cube_is_current(con):
+            if read_only:
+                raise ValueError(f"{database} has no emissions_cube built from its transformed tables, "
+                                 f"run rollup.py before publish.py")
+            build_cube(con, parquet_dir)
+
+        # repeat runs are answered from the query cache until emissions_cube changes
+        cache = QueryCache() if use_cache else None
+        specs = report_all(con, years, cache)
+        if cache is not None:
+            logging.info(f"Query cache: {cache.hits} hits, {cache.misses} misses, {cache.uncached} uncached")
+            print(f"Query cache: {cache.hits} hits, {cache.misses} misses, {cache.uncached} uncached")
+        # the series are kept so plots.py can redraw without touching the database
+        save_series(specs)
+        if plots:
+            render_plots(specs)
     except Exception as e:
         logging.error(f"Error during analysis: {e}")
         print(f"Error during analysis: {e}")
+    finally:
+        if con is not None:
+            con.close()
+
 
 if __name__ == "__main__":
-    analyze_data()
+    parser = argparse.ArgumentParser(description="Report CO2 emission figures for yellow and green taxis")
+    parser.add_argument("--years", type=int, nargs="*", default=[2024],
+                        help="single years to report on besides the all-years figures")
+    parser.add_argument("--rebuild-cube", action="store_true",
+                        help="rebuild emissions_cube from the transformed tables first")
+    parser.add_argument("--parquet-dir", default=None,
+                        help="build the cube from transform.py's hive-partitioned parquet output")
+    parser.add_argument("--no-plots", action="store_true",
+                        help="only write the plot series, render them later with plots.py")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always query the database instead of the query result cache")
+    parser.add_argument("--approximate", action="store_true",
+                        help="estimate every figure from a sample with 95%% intervals (exact is the default)")
+    parser.add_argument("--sample-rows", type=int, default=SAMPLE_ROWS,
+                        help="sampled trips per taxi type for --approximate")
+    parser.add_argument("--sample-method", choices=SAMPLE_METHODS, default="reservoir",
+                        help="row (reservoir) or block (system) sampling for --approximate")
+    parser.add_argument("--database", default=None,
+                        help="database to analyze (default: the current published snapshot, read-only)")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    analyze_data(years=args.years, rebuild_cube=args.rebuild_cube, parquet_dir=args.parquet_dir,
+                 resources=resource_overrides(args), plots=not args.no_plots,
+                 use_cache=not args.no_cache, approximate=args.approximate,
+                 sample_rows=args.sample_rows, sample_method=args.sample_method, database=args.database)
@@ -0,0 +1,207 @@
+import argparse
+import logging
+import math
+
+from profiling import connect
+from query_cache import table_version
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from rollup import CUBE_GRAINS, transformed_source
+from taxi_config import TAXI_TYPES, ensure_taxi_type_enum, trips_select
+
+logger = logging.getLogger(__name__)
+
+# Approximate answers for exploratory runs. A fixed-size sample of every taxi
+# type's transformed trips is kept in emissions_sample (rebuilt when a source's
+# table_versions entry changes), and the analysis metrics are estimated from it with
+# normal-approximation confidence intervals. Every sampled trip of taxi type t
+# stands for weight = population rows / sample rows trips, so:
+#   mean of a bucket   ~ sample mean,           se = sd / sqrt(n) * sqrt(1 - n / N)
+#   total of a bucket  ~ weight * sample sum,   se = sqrt(weight * (weight - 1) * sum of squares)
+# where a bucket's N is estimated as weight * n, so the finite-population
+# correction is sqrt(1 - 1 / weight) and a sample of every trip gives exact,
+# zero-width intervals. The largest trip cannot be estimated from a sample, the
+# sample max is only a lower bound.
+SAMPLE_ROWS = 200_000
+SAMPLE_METHODS = ("reservoir", "system")
+CONFIDENCE_Z = 1.96  # 95% intervals
+
+
+def sample_info(con):
+    # {taxi_type: (population_rows, sample_rows, method)} of the current sample, {} if none
+    if not con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'emissions_sample_info'").fetchone()[0]:
+        return {}
+    rows = con.execute("SELECT taxi_type, population_rows, sample_rows, method FROM emissions_sample_info").fetchall()
+    return {t: (population, sample, method) for t, population, sample, method in rows}
+
+
+def sample_versions(con):
+    # {taxi_type: table_versions entry of its transformed trips} the current sample was drawn from
+    return dict(con.execute("SELECT taxi_type, source_version FROM emissions_sample_info").fetchall())
+
+
+def build_sample(con, sample_rows=SAMPLE_ROWS, method="reservoir", parquet_dir=None, seed=42, force=False):
+    """(Re)build emissions_sample: up to sample_rows trips of every taxi type.
+
+    reservoir is a uniform sample of rows; system samples whole vectors of rows,
+    cheaper on big tables but clustered. Nothing is rebuilt while every source
+    has the table_versions entry recorded for the current sample (transform.py
+    and the dbt models bump it on every build) and the settings match. A source
+    without a version is always resampled.
+    Returns {taxi_type: (population_rows, sample_rows, method)}.
+    """
+    if method not in SAMPLE_METHODS:
+        raise ValueError(f"sample method must be one of {', '.join(SAMPLE_METHODS)}: {method!r}")
+    ensure_taxi_type_enum(con)
+    sources = {t: transformed_source(t, parquet_dir) for t in TAXI_TYPES}
+    versions = {t: table_version(con, f"{t}_transformed") for t in TAXI_TYPES}
+    current = sample_info(con)
+    if not force and current and all(versions.values()) and all(
+        t in current and current[t][2] == method and current[t][1] == min(sample_rows, current[t][0])
+        for t in TAXI_TYPES
+    ) and sample_versions(con) == versions:
+        logger.info("emissions_sample is up to date")
+        return current
+
+    population = {t: con.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0] for t, source in sources.items()}
+
+    selects = []
+    for t, source in sources.items():
+        if method == "reservoir":
+            clause = f"USING SAMPLE {int(sample_rows)} ROWS (reservoir, {int(seed)})"
+        else:
+            percent = min(100.0, 100.0 * sample_rows / max(population[t], 1))
+            clause = f"USING SAMPLE {percent} PERCENT (system, {int(seed)})"
+        selects.append(f"""
+            SELECT taxi_type, pickup_ts, {', '.join(CUBE_GRAINS.values())}, trip_co2_kgs
+            FROM ({trips_select({t: source})})
+            {clause}
+        """)
+    con.execute("CREATE OR REPLACE TABLE emissions_sample AS " + " UNION ALL ".join(selects))
+    counts = dict(con.execute(
+        "SELECT CAST(taxi_type AS VARCHAR), COUNT(*) FROM emissions_sample GROUP BY ALL"
+    ).fetchall())
+    con.execute("""
+        CREATE OR REPLACE TABLE emissions_sample_info (
+            taxi_type VARCHAR, population_rows BIGINT, sample_rows BIGINT, method VARCHAR, source_version VARCHAR
+        )
+    """)
+    con.executemany(
+        "INSERT INTO emissions_sample_info VALUES (?, ?, ?, ?, ?)",
+        [(t, population[t], counts.get(t, 0), method, versions[t]) for t in TAXI_TYPES],
+    )
+    info = sample_info(con)
+    for t, (rows, sampled, _) in info.items():
+        logger.info(f"Sampled {sampled:,} of {rows:,} {t} trips ({method})")
+        print(f"Sampled {sampled:,} of {rows:,} {t} trips ({method})")
+    return info
+
+
+def year_filter(year):
+    return "" if year is None else f"AND year(pickup_ts) = {int(year)}"
+
+
+def weight(con, taxi_type):
+    # trips each sampled trip of taxi_type stands for
+    population, sampled, _ = sample_info(con)[taxi_type]
+    return population / sampled if sampled else 0.0
+
+
+def approx_max_trip(con, taxi_type, year=None):
+    # the sample's largest trip CO2, a lower bound of the true maximum
+    (value,) = con.execute(f"""
+        SELECT MAX(trip_co2_kgs) FROM emissions_sample
+        WHERE taxi_type = ? {year_filter(year)}
+    """, [taxi_type]).fetchone()
+    return value
+
+
+def approx_buckets(con, taxi_type, grain, year=None):
+    """Average trip CO2 per bucket of grain with its confidence half-width.
+
+    Returns rows of (bucket, avg, half_width, sample_trips), heaviest first.
+    """
+    column = CUBE_GRAINS[grain]
+    w = weight(con, taxi_type)
+    # finite-population correction of each bucket, n / N = 1 / weight
+    fpc = math.sqrt(max(1 - 1 / w, 0.0)) if w else 0.0
+    return con.execute(f"""
+        SELECT {column} AS bucket, AVG(trip_co2_kgs) AS avg_kg,
+            {CONFIDENCE_Z} * {fpc} * COALESCE(STDDEV_SAMP(trip_co2_kgs), 0) / SQRT(COUNT(trip_co2_kgs))
+                AS half_width,
+            COUNT(trip_co2_kgs) AS n
+        FROM emissions_sample
+        WHERE taxi_type = ? {year_filter(year)}
+        GROUP BY bucket
+        HAVING COUNT(trip_co2_kgs) > 0
+        ORDER BY avg_kg DESC
+    """, [taxi_type]).fetchall()
+
+
+def overlaps(a, b):
+    # True when the difference of two (bucket, avg, half_width, n) estimates is not significant
+    return abs(a[1] - b[1]) < math.hypot(a[2], b[2])
+
+
+def approx_heavy_light(con, taxi_type, grain, year=None):
+    """Heaviest and lightest bucket of grain with confidence half-widths.
+
+    Returns ((bucket, avg, half_width, uncertain), (bucket, avg, half_width, uncertain)).
+    uncertain is True when the runner-up could be the real heaviest (lightest)
+    bucket under the sample, i.e. their intervals are not clearly apart.
+    """
+    rows = approx_buckets(con, taxi_type, grain, year)
+    if not rows:
+        return None, None
+    heavy, light = rows[0], rows[-1]
+    heavy_uncertain = len(rows) > 1 and overlaps(rows[0], rows[1])
+    light_uncertain = len(rows) > 1 and overlaps(rows[-1], rows[-2])
+    return (heavy[0], heavy[1], heavy[2], heavy_uncertain), (light[0], light[1], light[2], light_uncertain)
+
+
+def approx_totals(con, taxi_type, by, year=None):
+    """Estimated total CO2 per month of year ('month') or per year ('year').
+
+    Returns rows of (key, total, half_width).
+    """
+    key = "month_of_year" if by == "month" else "year(pickup_ts)"
+    w = weight(con, taxi_type)
+    rows = con.execute(f"""
+        SELECT {key} AS k, SUM(trip_co2_kgs), SUM(trip_co2_kgs * trip_co2_kgs)
+        FROM emissions_sample
+        WHERE taxi_type = ? {year_filter(year)}
+        GROUP BY k
+        ORDER BY k
+    """, [taxi_type]).fetchall()
+    return [
+        (k, w * (total or 0.0), CONFIDENCE_Z * math.sqrt(max(w * (w - 1), 0.0) * (squares or 0.0)))
+        for k, total, squares in rows
+    ]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='approximate.log'
+    )
+    parser = argparse.ArgumentParser(description="Build the emissions_sample used by analysis.py --approximate")
+    parser.add_argument("--sample-rows", type=int, default=SAMPLE_ROWS, help="sampled trips per taxi type")
+    parser.add_argument("--method", choices=SAMPLE_METHODS, default="reservoir", help="row or block sampling")
+    parser.add_argument("--parquet-dir", default=None,
+                        help="sample transform.py's hive-partitioned parquet output instead of the tables")
+    parser.add_argument("--seed", type=int, default=42, help="sampling seed")
+    parser.add_argument("--force", action="store_true", help="resample even when the sources are unchanged")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    con = None
+    try:
+        con = connect('emissions.duckdb')
+        logger.info("Connected to emissions database")
+        apply_resources(con, "rollup", **resource_overrides(args))
+        build_sample(con, args.sample_rows, args.method, args.parquet_dir, args.seed, args.force)
+    except Exception as e:
+        logger.error(f"Error building emissions_sample: {e}")
+        print(f"Error building emissions_sample: {e}")
+    finally:
+        if con is not None:
+            con.close()
@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import duckdb
+import functools
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='benchmark.log'
+)
+logger = logging.getLogger(__name__)
+
+# imported after basicConfig so the stage modules log to benchmark.log
+from load import bulk_load, ensure_load_manifest, load_month
+from synthetic import SCALE_ROWS, generate, month_file
+
+STAGES = ["load", "clean", "transform", "analysis"]
+
+# tables whose rows a stage produced, used for its rows/s figure (analysis answers from the transformed rows)
+STAGE_TABLES = {
+    "load": ["yellow_taxi", "green_taxi"],
+    "clean": ["yellow_clean", "green_clean"],
+    "transform": ["yellow_transformed", "green_transformed"],
+    "analysis": ["yellow_transformed", "green_transformed"],
+}
+
+# tables that must exist and have rows after a stage, else it failed
+STAGE_OUTPUTS = {
+    "load": ["yellow_taxi", "green_taxi"],
+    "clean": ["yellow_clean", "green_clean"],
+    "transform": ["yellow_transformed", "green_transformed"],
+    "analysis": ["emissions_cube"],
+}
+
+RESULTS_FILE = "benchmark_results.jsonl"
+
+
+def bench_load(files, work_dir):
+    """Time the per-month INSERT path against the single-scan bulk path on fresh databases."""
+    results = {}
+    for mode in ["per_month", "bulk"]:
+        con = duckdb.connect(os.path.join(work_dir, f"{mode}.duckdb"))
+        ensure_load_manifest(con)
+        start = time.perf_counter()
+        if mode == "bulk":
+            bulk_load(con, "yellow", files)
+        else:
+            for year, month, path, checksum in files:
+                load_month(con, "yellow", year, month, path, checksum)
+        elapsed = time.perf_counter() - start
+        (rows,) = con.execute("SELECT COUNT(*) FROM yellow_taxi").fetchone()
+        con.close()
+        results[mode] = (elapsed, rows)
+        print(f"{mode:>10}: {elapsed:8.2f} s  {rows:,} rows  {rows / elapsed:,.0f} rows/s")
+        logger.info(f"{mode}: {elapsed:.2f} s, {rows:,} rows")
+    print(f"bulk speedup: {results['per_month'][0] / results['bulk'][0]:.1f}x")
+    return results
+
+
+def serve(data_dir, latency=0.0, throttle_first=0, throttle_every=0, throttle_status=429, retry_after=None):
+    """Serve data_dir over http on a free local port, returns (server, base url).
+
+    Stands in for the TLC CDN when testing the concurrent loader: every answer
+    is delayed by latency seconds, and the first throttle_first requests plus
+    every throttle_every-th one after them get throttle_status (with a
+    Retry-After header when retry_after is set) instead of the file.
+    server.requests records (monotonic time, path, status) of every answer.
+    """
+    requests = []
+    received = itertools.count(1)
+    lock = threading.Lock()
+
+    class StandInHandler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            with lock:
+                n = next(received)
+            throttled = n <= throttle_first or (throttle_every and (n - throttle_first) % throttle_every == 0)
+            if not throttled:
+                return super().do_GET()
+            self.send_response(throttle_status)
+            if retry_after is not None:
+                self.send_header("Retry-After", str(retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def send_response(self, code, message=None):
+            with lock:
+                requests.append((time.monotonic(), self.path, code))
+            super().send_response(code, message)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(StandInHandler, directory=data_dir))
+    server.requests = requests
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class ErrorLog(logging.Handler):
+    """Keeps what a stage logged at ERROR: its entry point catches and logs its own exceptions."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def run_stage(stage, work_dir, base_url, start_year, end_year, verbose, results):
+    """Run one pipeline stage in work_dir, put (seconds, peak rss bytes, errors) on results.
+
+    Runs in its own process so the peak memory is the stage's alone. errors are
+    the messages the stage logged at ERROR (or raised), empty when it succeeded.
+    """
+    os.chdir(work_dir)
+    errors = ErrorLog()
+    logging.getLogger().addHandler(errors)
+    out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with out:
+        start = time.perf_counter()
+        try:
+            if stage == "load":
+                from load import load_parquet_files
+                load_parquet_files(base=base_url, cache_dir=None, start_year=start_year, end_year=end_year)
+            elif stage == "clean":
+                from clean import clean_parquet
+                clean_parquet()
+            elif stage == "transform":
+                from transform import transform_parquet
+                transform_parquet()
+            elif stage == "analysis":
+                from analysis import analyze_data
+                analyze_data(years=[end_year], rebuild_cube=True)
+        except Exception as e:
+            errors.messages.append(str(e))
+        elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, errors.messages[:5]))
+
+
+def stage_result(process, results):
+    # run_stage()'s result, or None when the process died without putting one
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    return None
+
+
+def stage_rows(work_dir, stage):
+    """Rows the stage produced, and its output tables that are missing or empty."""
+    database = os.path.join(work_dir, "emissions.duckdb")
+    if not os.path.exists(database):
+        return 0, list(STAGE_OUTPUTS[stage])
+    con = duckdb.connect(database, read_only=True)
+    try:
+        existing = {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+        counts = {
+            table: con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] if table in existing else 0
+            for table in set(STAGE_TABLES[stage]) | set(STAGE_OUTPUTS[stage])
+        }
+        return sum(counts[t] for t in STAGE_TABLES[stage]), [t for t in STAGE_OUTPUTS[stage] if not counts[t]]
+    finally:
+        con.close()
+
+
+def bench_pipeline(work_dir, base_url, scale, start_year, end_year, stages=STAGES,
+                   results_file=RESULTS_FILE, verbose=False):
+    """Run the stages in order on a fresh database and append one result line per stage.
+
+    Each line of results_file is a JSON object with the stage, wall seconds, rows
+    produced, rows/s and peak RSS, so runs at the same scale can be compared.
+    A stage that logs an error, dies, or leaves an output table missing or empty
+    is written with status "failed" and its errors instead of a timing, and the
+    run stops there.
+    """
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+                    os.path.join(work_dir, "data"), dirs_exist_ok=True)
+    ctx = multiprocessing.get_context("spawn")
+    run_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    records = []
+    for stage in stages:
+        results = ctx.Queue()
+        process = ctx.Process(target=run_stage,
+                              args=(stage, work_dir, base_url, start_year, end_year, verbose, results))
+        process.start()
+        result = stage_result(process, results)
+        process.join()
+        record = {
+            "run_at": run_at,
+            "scale": scale,
+            "start_year": start_year,
+            "end_year": end_year,
+            "stage": stage,
+        }
+        errors = [f"stage process exited with code {process.exitcode}"] if result is None else result[2]
+        if result is not None:
+            rows, missing = stage_rows(work_dir, stage)
+            errors += [f"{table} is missing or empty" for table in missing]
+        if errors:
+            # a failed stage gets no timing, it would look like a valid (and fast) run
+            record.update({"status": "failed", "errors": errors})
+            records.append(record)
+            print(f"{stage:>10}: FAILED  {'; '.join(errors)}")
+            logger.error(f"{stage} failed: {'; '.join(errors)}")
+            break
+        elapsed, peak_rss, _ = result
+        record.update({
+            "status": "ok",
+            "seconds": round(elapsed, 3),
+            "rows": rows,
+            "rows_per_s": round(rows / elapsed) if elapsed > 0 else None,
+            "peak_rss_mb": round(peak_rss / 1024 ** 2, 1),
+        })
+        records.append(record)
+        print(f"{stage:>10}: {elapsed:8.2f} s  {rows:,} rows  {record['rows_per_s'] or 0:,} rows/s  "
+              f"peak {record['peak_rss_mb']:,.0f} MB")
+        logger.info(f"{stage}: {elapsed:.2f} s, {rows:,} rows, peak {record['peak_rss_mb']} MB")
+    with open(results_file, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    print(f"Appended {len(records)} results to {results_file}")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic TLC data")
+    parser.add_argument("--years", type=int, default=2, help="number of years of monthly files, ending 2024")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help=f"scale factor, 1 = {SCALE_ROWS['yellow']:,} yellow / {SCALE_ROWS['green']:,} green rows per month")
+    parser.add_argument("--stages", nargs="*", choices=STAGES, default=STAGES,
+                        help="stages to run, in pipeline order")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSONL file the stage results are appended to")
+    parser.add_argument("--ingest", action="store_true",
+                        help="compare load.py's per-month and bulk ingest paths instead")
+    parser.add_argument("--verbose", action="store_true", help="show the stages' own output")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the local server waits before each answer")
+    parser.add_argument("--throttle-every", type=int, default=0,
+                        help="answer every n-th request with HTTP 429 like a throttling CDN")
+    args = parser.parse_args()
+
+    start_year, end_year = 2024 - args.years + 1, 2024
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        data_dir = os.path.join(tmp, "tripdata")
+        generate(data_dir, args.scale, start_year, end_year)
+        if args.ingest:
+            files = [
+                (y, m, month_file(data_dir, "yellow", y, m), f"{y}-{m:02d}")
+                for y in range(start_year, end_year + 1) for m in range(1, 13)
+            ]
+            bench_load(files, tmp)
+        else:
+            server, base_url = serve(data_dir, args.latency, throttle_every=args.throttle_every)
+            try:
+                records = bench_pipeline(tmp, base_url, args.scale, start_year, end_year, args.stages,
+                                         os.path.abspath(args.results), args.verbose)
+            finally:
+                server.shutdown()
+            if any(record["status"] == "failed" for record in records):
+                raise SystemExit(1)
@@ -1,106 +1,324 @@
-import duckdb
+import argparse
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import connect
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from taxi_config import (
+    CLEAN_END_YEAR, CLEAN_START_YEAR, TAXI_TYPES, clean_columns, clean_rules, clean_select,
+    create_trips_view, month_predicate, reason_code,
+)
 
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
     filename='clean.log'
 )
 logger = logging.getLogger(__name__)
-def clean_parquet():
+
+
+def partition_months():
+    # pickup months that can survive cleaning, the dedup partitions
+    return [f"{y}-{m:02d}-01" for y in range(CLEAN_START_YEAR, CLEAN_END_YEAR + 1) for m in range(1, 13)]
+
+
+def rebuild_partition(cur, taxi_type, month_start, target):
+    # one pickup month of target recomputed from the raw table, in the caller's transaction
+    pickup = TAXI_TYPES[taxi_type]["pickup"]
+    cur.execute(f"DELETE FROM {target} WHERE {month_predicate(pickup, month_start)}")
+    cur.execute(f"""
+        INSERT INTO {target}
+        {clean_select(taxi_type, f"{taxi_type}_taxi", [month_predicate(pickup, month_start)])}
+    """)
+
+
+def rebuild_partitions(con, taxi_type, months, target, workers=2):
+    """Recompute the given pickup-month partitions of target from the raw table.
+
+    Duplicate rows share their pickup time, so a SELECT DISTINCT per pickup month
+    gives exactly the rows of one whole-table DISTINCT, while each hash table only
+    holds one month. Partitions run concurrently on separate cursors, each in its
+    own transaction.
+    """
+    def rebuild(month_start):
+        cur = con.cursor()
+        try:
+            cur.execute("BEGIN TRANSACTION")
+            try:
+                rebuild_partition(cur, taxi_type, month_start, target)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        finally:
+            cur.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() so an exception in any partition is raised here
+        list(pool.map(rebuild, months))
+
+
+def ensure_clean_manifest(con):
+    # which load_manifest version of every source month is reflected in *_clean,
+    # and which pickup-month partitions its rows fall into
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS clean_manifest (
+            taxi_type VARCHAR,
+            source_month DATE,
+            checksum VARCHAR,
+            pickup_months DATE[],
+            PRIMARY KEY (taxi_type, source_month)
+        )
+    """)
+
+
+def record_clean_manifest(con, taxi_type, source_months=None):
+    # source_months None means every month of the raw table
+    pickup = TAXI_TYPES[taxi_type]["pickup"]
+    only = "AND t.source_month IN (SELECT UNNEST(?))" if source_months is not None else ""
+    params = [taxi_type, taxi_type] + ([source_months] if source_months is not None else [])
+    if source_months is None:
+        con.execute("DELETE FROM clean_manifest WHERE taxi_type = ?", [taxi_type])
+    con.execute(f"""
+        INSERT OR REPLACE INTO clean_manifest
+        SELECT ?, t.source_month, any_value(m.checksum),
+            list(DISTINCT CAST(date_trunc('month', t.{pickup}) AS DATE))
+                FILTER (WHERE t.{pickup} IS NOT NULL)
+        FROM {taxi_type}_taxi t
+        JOIN load_manifest m
+            ON m.taxi_type = ? AND make_date(m.year, m.month, 1) = t.source_month
+        WHERE true {only}
+        GROUP BY t.source_month
+    """, params)
+
+
+def build_clean_table(con, taxi_type, strategy="partitioned", incremental=False, workers=2):
+    """Build {taxi_type}_clean from {taxi_type}_taxi.
+
+    "distinct" is the original single SELECT DISTINCT over the whole table.
+    "partitioned" deduplicates one pickup month at a time into a new table that
+    replaces the old one at the end. With incremental=True only the partitions
+    that rows of new or reloaded source months fall into (before and after the
+    reload) are recomputed in place, one after the other in the transaction that
+    updates clean_manifest, so a failed run leaves both as they were.
+
+    Returns the source months that were recleaned or removed incrementally, or
+    None after a full rebuild.
+    """
+    raw, target = f"{taxi_type}_taxi", f"{taxi_type}_clean"
+    ensure_clean_manifest(con)
+    if strategy == "distinct":
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(f"""
+                CREATE OR REPLACE TABLE {target} AS
+                {clean_select(taxi_type, raw)}
+            """)
+            # transform.py versions its pickup months from the manifest, so it is kept here too
+            record_clean_manifest(con, taxi_type)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        return
+
+    has_target = con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [target]
+    ).fetchone()[0]
+    has_manifest = con.execute(
+        "SELECT COUNT(*) FROM clean_manifest WHERE taxi_type = ?", [taxi_type]
+    ).fetchone()[0]
+
+    if incremental and has_target and has_manifest:
+        changed = [row[0] for row in con.execute("""
+            SELECT make_date(m.year, m.month, 1)
+            FROM load_manifest m
+            LEFT JOIN clean_manifest c
+                ON c.taxi_type = m.taxi_type AND c.source_month = make_date(m.year, m.month, 1)
+            WHERE m.taxi_type = ? AND c.checksum IS DISTINCT FROM m.checksum
+        """, [taxi_type]).fetchall()]
+        # months dropped from load_manifest (e.g. a full reload of fewer years) have no raw rows left
+        removed = [row[0] for row in con.execute("""
+            SELECT c.source_month
+            FROM clean_manifest c
+            LEFT JOIN load_manifest m
+                ON m.taxi_type = c.taxi_type AND make_date(m.year, m.month, 1) = c.source_month
+            WHERE c.taxi_type = ? AND m.checksum IS NULL
+        """, [taxi_type]).fetchall()]
+        if not changed and not removed:
+            logger.info(f"{target} is up to date")
+            print(f"{target} is up to date")
+            return []
+        con.execute("BEGIN TRANSACTION")
+        try:
+            # partitions the old rows of these months were in, plus the ones the new rows fall into
+            old = con.execute("""
+                SELECT DISTINCT UNNEST(pickup_months) FROM clean_manifest
+                WHERE taxi_type = ? AND source_month IN (SELECT UNNEST(?))
+            """, [taxi_type, changed + removed]).fetchall()
+            con.execute("DELETE FROM clean_manifest WHERE taxi_type = ? AND source_month IN (SELECT UNNEST(?))",
+                        [taxi_type, removed])
+            record_clean_manifest(con, taxi_type, changed)
+            new = con.execute("""
+                SELECT DISTINCT UNNEST(pickup_months) FROM clean_manifest
+                WHERE taxi_type = ? AND source_month IN (SELECT UNNEST(?))
+            """, [taxi_type, changed]).fetchall()
+            valid = set(partition_months())
+            months = sorted({str(m) for (m,) in old + new} & valid)
+            for month_start in months:
+                rebuild_partition(con, taxi_type, month_start, target)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        logger.info(f"Rebuilt {len(months)} partitions of {target} for {len(changed)} changed "
+                    f"and {len(removed)} removed months")
+        print(f"Rebuilt {len(months)} partitions of {target} for {len(changed)} changed "
+              f"and {len(removed)} removed months")
+        return changed + removed
+
+    staging = f"{target}_new"
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {staging} AS
+        {clean_select(taxi_type, raw)}
+        LIMIT 0
+    """)
+    rebuild_partitions(con, taxi_type, partition_months(), staging, workers)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DROP TABLE IF EXISTS {target}")
+        con.execute(f"ALTER TABLE {staging} RENAME TO {target}")
+        record_clean_manifest(con, taxi_type)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+def build_rejects(con, taxi_type, source_months=None):
+    """Keep every row the cleaning filters drop in {taxi_type}_rejects, with a reason bitmask.
+
+    Only the cleaned columns and source_month are stored, the bits of reason_code
+    are the rules in taxi_config.clean_rules(). source_months limits the rebuild
+    to those raw months (incremental runs).
+    """
+    columns = ", ".join(clean_columns(taxi_type))
+    rejects = f"""
+        SELECT * FROM (
+            SELECT {columns}, source_month, {reason_code(taxi_type)} AS reason_code
+            FROM {taxi_type}_taxi
+            {"WHERE source_month IN (SELECT UNNEST(?))" if source_months is not None else ""}
+        )
+        WHERE reason_code <> 0
+    """
+    params = [source_months] if source_months is not None else []
+    if source_months is None:
+        con.execute(f"CREATE OR REPLACE TABLE {taxi_type}_rejects AS {rejects}", params)
+    else:
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(f"DELETE FROM {taxi_type}_rejects WHERE source_month IN (SELECT UNNEST(?))", params)
+            con.execute(f"INSERT INTO {taxi_type}_rejects {rejects}", params)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+
+def quality_report(con, taxi_type):
+    """Data quality metrics for one taxi type from a single pass over each table.
+
+    The rejects table gives the count per failed rule, one aggregate over the
+    clean table re-checks that none of the rules are violated there, and
+    duplicates are what's left of the raw row count.
+    """
+    t = TAXI_TYPES[taxi_type]
+    pickup, dropoff = t["pickup"], t["dropoff"]
+    rules = clean_rules(taxi_type)
+    per_rule = ", ".join(
+        f"COUNT(*) FILTER (WHERE reason_code & {bit} <> 0) AS {name}" for bit, name, _ in rules
+    )
+    rejected = con.execute(f"SELECT COUNT(*), {per_rule} FROM {taxi_type}_rejects").fetchone()
+    report = {"rejected": rejected[0]}
+    report.update({f"rejected_{name}": count for (_, name, _), count in zip(rules, rejected[1:])})
+
+    # TEST: verify the cleaning conditions no longer exist in the data, all in one scan
+    clean = con.execute(f"""
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE passenger_count = 0),
+            COUNT(*) FILTER (WHERE trip_distance = 0),
+            COUNT(*) FILTER (WHERE trip_distance > 100),
+            COUNT(*) FILTER (WHERE ({dropoff} - {pickup}) > INTERVAL '24' HOUR),
+            MIN(EXTRACT(year FROM {pickup})),
+            MAX(EXTRACT(year FROM {pickup}))
+        FROM {taxi_type}_clean
+    """).fetchone()
+    report.update(zip(["clean_rows", "zero_passengers", "zero_distance", "long_distance",
+                       "long_duration", "min_year", "max_year"], clean))
+
+    (raw_rows,) = con.execute(f"SELECT COUNT(*) FROM {taxi_type}_taxi").fetchone()
+    report["raw_rows"] = raw_rows
+    report["duplicates"] = raw_rows - report["rejected"] - report["clean_rows"]
+    return report
+
+
+def clean_taxi_type(con, taxi_type, strategy="partitioned", incremental=False, workers=2):
+    """Clean one taxi type: {taxi_type}_clean, {taxi_type}_rejects and the quality report."""
+    # clean {taxi_type}_taxi into {taxi_type}_clean, the raw table is left
+    # untouched so load.py can keep loading it incrementally
+    changed = build_clean_table(con, taxi_type, strategy, incremental, workers)
+    logging.info(f"Cleaned {taxi_type}_taxi into {taxi_type}_clean")
+    print(f"Cleaned {taxi_type}_taxi into {taxi_type}_clean")
+
+    if changed is None or not con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [f"{taxi_type}_rejects"]
+    ).fetchone()[0]:
+        build_rejects(con, taxi_type)
+    elif changed:
+        build_rejects(con, taxi_type, changed)
+
+    r = quality_report(con, taxi_type)
+    name = f"{taxi_type.title()} Taxi"
+    logging.info(f"{name} - Zero Passengers: {r['zero_passengers']}, Zero Distance: {r['zero_distance']}, Long Distance: {r['long_distance']}, Long Duration: {r['long_duration']}, Year Range: {r['min_year']} - {r['max_year']}")
+    print(f"{name} - Zero Passengers: {r['zero_passengers']}, Zero Distance: {r['zero_distance']}, Long Distance: {r['long_distance']}, Long Duration: {r['long_duration']}, Year Range: {r['min_year']} - {r['max_year']}")
+    dropped = ", ".join(f"{name}: {r[f'rejected_{name}']:,}" for _, name, _ in clean_rules(taxi_type))
+    logging.info(f"{taxi_type}: {r['raw_rows']:,} raw rows, {r['clean_rows']:,} kept, {r['rejected']:,} rejected ({dropped}), {r['duplicates']:,} duplicates")
+    print(f"{taxi_type}: {r['raw_rows']:,} raw rows, {r['clean_rows']:,} kept, {r['rejected']:,} rejected ({dropped}), {r['duplicates']:,} duplicates")
+    return r
+
+
+def clean_parquet(strategy="partitioned", incremental=False, workers=2, resources=None):
+    con = None
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
+        con = connect('emissions.duckdb')
         logging.info("Connected to emissions database")
         print("Connected to emissions database")
-        con.execute("PRAGMA memory_limit='4GB'")
-
-        # clean yellow_taxi
-        con.execute("""
-            CREATE OR REPLACE TABLE yellow_taxi AS
-            SELECT DISTINCT
-            tpep_pickup_datetime,
-            tpep_dropoff_datetime,
-            passenger_count,
-            trip_distance
-            FROM yellow_taxi
-            WHERE passenger_count > 0
-            AND trip_distance > 0
-            AND trip_distance <= 100
-            AND (tpep_dropoff_datetime - tpep_pickup_datetime) > INTERVAL '0' SECOND
-            AND (tpep_dropoff_datetime - tpep_pickup_datetime) <= INTERVAL '24' HOUR
-            AND EXTRACT(year FROM tpep_pickup_datetime) BETWEEN 2015 AND 2024
-            AND EXTRACT(year FROM tpep_dropoff_datetime) BETWEEN 2015 AND 2024
-        """)
-        logging.info("Cleaned yellow_taxi table")
-        print("Cleaned yellow_taxi table")
-
-        # TEST: verify above conditions no longer exist in the data
-        yellow_zero_passengers = con.execute("""
-            SELECT COUNT(*) FROM yellow_taxi WHERE passenger_count = 0;
-        """).fetchone()[0]
-        yellow_zero_distance = con.execute("""
-            SELECT COUNT(*) FROM yellow_taxi WHERE trip_distance = 0;
-        """).fetchone()[0]
-        yellow_long_distance = con.execute("""
-            SELECT COUNT(*) FROM yellow_taxi WHERE trip_distance > 100;
-        """).fetchone()[0]
-        yellow_long_duration = con.execute("""
-            SELECT COUNT(*) FROM yellow_taxi
-            WHERE (tpep_dropoff_datetime - tpep_pickup_datetime) > INTERVAL '24' HOUR;
-        """).fetchone()[0]
-        y_min_year, y_max_year = con.execute("""
-            SELECT MIN(EXTRACT(year FROM tpep_pickup_datetime)), MAX(EXTRACT(year FROM tpep_pickup_datetime))
-            FROM yellow_taxi;
-        """).fetchone()
-        logging.info(f"Yellow Taxi - Zero Passengers: {yellow_zero_passengers}, Zero Distance: {yellow_zero_distance}, Long Distance: {yellow_long_distance}, Long Duration: {yellow_long_duration}, Year Range: {y_min_year} - {y_max_year}")
-        print(f"Yellow Taxi - Zero Passengers: {yellow_zero_passengers}, Zero Distance: {yellow_zero_distance}, Long Distance: {yellow_long_distance}, Long Duration: {yellow_long_duration}, Year Range: {y_min_year} - {y_max_year}")
-    except Exception as e:
-        logging.error(f"Error cleaning parquet files: {e}")
+        apply_resources(con, "clean", **(resources or {}))
 
-    try:
-        # clean green taxi
-        con.execute("""
-            CREATE OR REPLACE TABLE green_taxi AS
-            SELECT DISTINCT
-            lpep_pickup_datetime,
-            lpep_dropoff_datetime,
-            passenger_count,
-            trip_distance
-            FROM green_taxi
-            WHERE passenger_count > 0
-            AND trip_distance > 0
-            AND trip_distance <= 100
-            AND (lpep_dropoff_datetime - lpep_pickup_datetime) > INTERVAL '0' SECOND
-            AND (lpep_dropoff_datetime - lpep_pickup_datetime) <= INTERVAL '24' HOUR
-            AND EXTRACT(year FROM lpep_pickup_datetime) BETWEEN 2015 AND 2024
-            AND EXTRACT(year FROM lpep_dropoff_datetime) BETWEEN 2015 AND 2024
-        """)
-        logging.info("Cleaned green taxi table")
-        print("Cleaned green taxi table")
-
-        # TEST: verify above conditions no longer exist in the data
-        green_zero_passengers = con.execute("""
-            SELECT COUNT(*) FROM green_taxi WHERE passenger_count = 0;
-        """).fetchone()[0]
-        green_zero_distance = con.execute("""
-            SELECT COUNT(*) FROM green_taxi WHERE trip_distance = 0;
-        """).fetchone()[0]
-        green_long_distance = con.execute("""
-            SELECT COUNT(*) FROM green_taxi WHERE trip_distance > 100;
-        """).fetchone()[0]
-        green_long_duration = con.execute("""
-            SELECT COUNT(*) FROM green_taxi
-            WHERE (lpep_dropoff_datetime - lpep_pickup_datetime) > INTERVAL '24' HOUR;
-        """).fetchone()[0]
-        g_min_year, g_max_year = con.execute("""
-            SELECT MIN(EXTRACT(year FROM lpep_pickup_datetime)), MAX(EXTRACT(year FROM lpep_pickup_datetime))
-            FROM green_taxi;
-        """).fetchone()
-        logging.info(f"Green Taxi - Zero Passengers: {green_zero_passengers}, Zero Distance: {green_zero_distance}, Long Distance: {green_long_distance}, Long Duration: {green_long_duration}, Year Range: {g_min_year} - {g_max_year}")
-        print(f"Green Taxi - Zero Passengers: {green_zero_passengers}, Zero Distance: {green_zero_distance}, Long Distance: {green_long_distance}, Long Duration: {green_long_duration}, Year Range: {g_min_year} - {g_max_year}")
-        con.close()
+        for taxi_type in TAXI_TYPES:
+            try:
+                clean_taxi_type(con, taxi_type, strategy, incremental, workers)
+            except Exception as e:
+                logging.error(f"Error cleaning parquet files: {e}")
 
+        # every feed's clean rows in one relation, with pickup_ts/dropoff_ts and a taxi_type column
+        create_trips_view(con, "trips_clean", {t: f"{t}_clean" for t in TAXI_TYPES})
+        logging.info("Created trips_clean view")
     except Exception as e:
         logging.error(f"Error cleaning parquet files: {e}")
+    finally:
+        if con is not None:
+            con.close()
+
+
 if __name__ == "__main__":
-    clean_parquet()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Clean the raw taxi tables into *_clean")
+    parser.add_argument("--strategy", choices=["partitioned", "distinct"], default="partitioned",
+                        help="deduplicate per pickup month, or with one whole-table DISTINCT")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only recompute partitions touched by new or reloaded months")
+    parser.add_argument("--workers", type=int, default=2, help="partitions deduplicated concurrently")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    clean_parquet(strategy=args.strategy, incremental=args.incremental, workers=args.workers,
+                  resources=resource_overrides(args))
\ No newline at end of file
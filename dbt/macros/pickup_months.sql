@@ -0,0 +1,47 @@
+{#
+    Pickup months an incremental run of the transformed models rebuilds.
+
+    With --vars '{months: ["2024-05", "2024-06"]}' exactly those pickup months are
+    rebuilt, as a manual override. Otherwise they are the months whose version in
+    transform_manifest no longer matches what clean_manifest says about the clean
+    rows (see transform_month_versions()): new, republished, late and removed
+    months alike, so the run ends up with what a full refresh would build. When
+    either manifest has no rows for the taxi type there is nothing to compare and
+    every month is rebuilt.
+#}
+{% macro pickup_months_predicate(month_expression, pickup_column) %}
+    {% set taxi_type = this.identifier | replace('_transformed', '') %}
+    {% set months = var('months', none) %}
+    {% if months %}
+    {{ month_expression }} IN (
+        {%- for month in months %}DATE '{{ month }}-01'{% if not loop.last %}, {% endif %}{% endfor -%}
+    )
+    {% elif manifest_rows('clean_manifest', taxi_type) and manifest_rows('transform_manifest', taxi_type) %}
+    {{ month_expression }} IN ({{ changed_pickup_months(taxi_type, pickup_column) }})
+    {% else %}
+    true
+    {% endif %}
+{% endmacro %}
+
+{# WHERE clause of the model's select over the clean rows #}
+{% macro pickup_months_filter(pickup_column) %}
+    {{ pickup_months_predicate("CAST(date_trunc('month', " ~ pickup_column ~ ") AS DATE)", pickup_column) }}
+{% endmacro %}
+
+{# pre-hook: delete+insert only replaces months that still have rows, months
+   left without any (a removed source month) are deleted here #}
+{% macro delete_pickup_months(pickup_column) %}
+    {% if is_incremental() %}
+    DELETE FROM {{ this }} WHERE {{ pickup_months_predicate('pickup_month', pickup_column) }}
+    {% endif %}
+{% endmacro %}
+
+{% macro changed_pickup_months(taxi_type, pickup_column) %}
+    SELECT pickup_month
+    FROM ({{ transform_month_versions(taxi_type,
+        "(SELECT DISTINCT CAST(date_trunc('month', " ~ pickup_column ~ ") AS DATE) AS pickup_month FROM "
+        ~ taxi_type ~ "_clean)") }}) expected
+    FULL OUTER JOIN (SELECT pickup_month, version FROM transform_manifest WHERE taxi_type = '{{ taxi_type }}') recorded
+        USING (pickup_month)
+    WHERE expected.version IS DISTINCT FROM recorded.version
+{% endmacro %}
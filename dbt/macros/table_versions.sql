@@ -0,0 +1,10 @@
+{# every run gives the model a new random version in table_versions, the query
+   cache (query_cache.py) keys on it so results of the old rows are never served #}
+{% macro bump_table_version() %}
+    CREATE TABLE IF NOT EXISTS table_versions (
+        table_name VARCHAR PRIMARY KEY,
+        version UUID,
+        built_at TIMESTAMP
+    );
+    INSERT OR REPLACE INTO table_versions VALUES ('{{ this.identifier }}', gen_random_uuid(), current_timestamp)
+{% endmacro %}
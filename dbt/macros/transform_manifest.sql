@@ -0,0 +1,53 @@
+{# (pickup_month, version) of every month in the months relation: the md5 of the
+   emission factor and the clean_manifest checksums of the source months whose
+   rows fall into it. Must match transform.record_transform_manifest(). #}
+{% macro transform_month_versions(taxi_type, months) %}
+    SELECT p.pickup_month, md5(concat_ws(':',
+        (SELECT co2_grams_per_mile FROM vehicle_emissions WHERE vehicle_type = '{{ taxi_type }}_taxi'),
+        string_agg(c.source_month || '=' || c.checksum, ',' ORDER BY c.source_month))) AS version
+    FROM {{ months }} p
+    LEFT JOIN clean_manifest c ON c.taxi_type = '{{ taxi_type }}' AND list_contains(c.pickup_months, p.pickup_month)
+    WHERE p.pickup_month IS NOT NULL
+    GROUP BY p.pickup_month
+{% endmacro %}
+
+{# rows of a manifest table for taxi_type, 0 when the table doesn't exist #}
+{% macro manifest_rows(table, taxi_type) %}
+    {% if not execute %}
+        {{ return(0) }}
+    {% endif %}
+    {% set relation = adapter.get_relation(database=this.database, schema=this.schema, identifier=table) %}
+    {% if relation is none %}
+        {{ return(0) }}
+    {% endif %}
+    {% set result = run_query("SELECT COUNT(*) FROM " ~ table ~ " WHERE taxi_type = '" ~ taxi_type ~ "'") %}
+    {{ return(result.columns[0].values()[0]) }}
+{% endmacro %}
+
+{# post-hook: versions the model's pickup months in transform_manifest for timeseries.py
+   and the next incremental run, hashed like transform.py so a month only gets a new
+   version when its inputs changed. Without clean_manifest rows (fused load) the
+   versions are random. A run over --vars months only re-versions those months. #}
+{% macro record_transform_manifest() %}
+    {% set taxi_type = this.identifier | replace('_transformed', '') %}
+    {% set months = var('months', none) %}
+    {% set listed %}
+        {%- for month in months or [] %}DATE '{{ month }}-01'{% if not loop.last %}, {% endif %}{% endfor -%}
+    {% endset %}
+    {% set only = " AND pickup_month IN (" ~ listed ~ ")" if months else "" %}
+    {% set produced = "(SELECT DISTINCT pickup_month FROM " ~ this ~ " WHERE true" ~ only ~ ")" %}
+    CREATE TABLE IF NOT EXISTS transform_manifest (
+        taxi_type VARCHAR,
+        pickup_month DATE,
+        version VARCHAR,
+        PRIMARY KEY (taxi_type, pickup_month)
+    );
+    DELETE FROM transform_manifest WHERE taxi_type = '{{ taxi_type }}' {{ only }};
+    INSERT INTO transform_manifest
+    {% if manifest_rows('clean_manifest', taxi_type) %}
+    SELECT '{{ taxi_type }}', pickup_month, version FROM ({{ transform_month_versions(taxi_type, produced) }})
+    {% else %}
+    SELECT '{{ taxi_type }}', pickup_month, CAST(gen_random_uuid() AS VARCHAR)
+    FROM {{ produced }} WHERE pickup_month IS NOT NULL
+    {% endif %}
+{% endmacro %}
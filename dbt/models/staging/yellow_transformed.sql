@@ -1,8 +1,21 @@
+{# incremental, delete+insert on pickup_month: a run only transforms the months picked by
+   pickup_months_filter() (those changed since the last run) and replaces them,
+   dbt run --full-refresh rebuilds everything.
+   With --vars '{parquet_dir: <dir>}' the model is written as hive-partitioned parquet
+   (year=/month= directories, zstd, 1M-row row groups) instead, like transform.py --parquet-dir #}
+{% set parquet_dir = var('parquet_dir', none) %}
+{{ config(
+    materialized=('external' if parquet_dir else 'incremental'),
+    location=(parquet_dir ~ '/taxi_type=yellow' if parquet_dir else none),
+    format='parquet',
+    options={'partition_by': 'year, month', 'codec': 'zstd', 'row_group_size': 1000000},
+    pre_hook="{{ delete_pickup_months('tpep_pickup_datetime') }}"
+) }}
 -- yellow taxi transformations
-SELECT yellow_taxi.*,
+SELECT yellow_clean.*,
     (
         -- add column to calculate CO2 emissions per trip in kilograms
-        yellow_taxi.trip_distance * (
+        yellow_clean.trip_distance * (
             SELECT co2_grams_per_mile
             FROM vehicle_emissions
             WHERE vehicle_type = 'yellow_taxi'
@@ -23,5 +36,15 @@ SELECT yellow_taxi.*,
     -- add column to extract week number of the year
     CAST(strftime(tpep_pickup_datetime, '%V') AS INTEGER) AS week_of_year,
     -- add column to extract month number of the year
-    CAST(strftime(tpep_pickup_datetime, '%m') AS INTEGER) AS month_of_year
-FROM yellow_taxi
\ No newline at end of file
+    CAST(strftime(tpep_pickup_datetime, '%m') AS INTEGER) AS month_of_year,
+    -- pickup month, the unit an incremental run deletes and re-inserts
+    CAST(date_trunc('month', tpep_pickup_datetime) AS DATE) AS pickup_month
+    {% if parquet_dir %},
+    -- partition columns of the parquet output
+    CAST(EXTRACT(year FROM tpep_pickup_datetime) AS INTEGER) AS year,
+    CAST(strftime(tpep_pickup_datetime, '%m') AS INTEGER) AS month
+    {% endif %}
+FROM yellow_clean
+{% if is_incremental() %}
+WHERE {{ pickup_months_filter('tpep_pickup_datetime') }}
+{% endif %}
@@ -0,0 +1,188 @@
+import argparse
+import logging
+import re
+
+from publish import connect_reader
+from rollup import CUBE_GRAINS
+from taxi_config import TAXI_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Columnar query API for downstream services. Results come back as Arrow
+# (a RecordBatchReader that streams batch by batch, or a whole Table), so no
+# Python object is built per row; .to_pandas() / .column(i).to_numpy() give
+# pandas and NumPy views.
+#
+#   con = connect_api(args.database)
+#   table = emissions_table(con, ["taxi_type", "month"], {"year": 2024})
+#
+# dims and filters use the names below. emissions_cube answers taxi_type, year
+# and at most one of hour/dow/week/month; source="trips" aggregates the
+# unified trips view instead and takes any combination.
+DIMENSIONS = ["taxi_type", "year"] + list(CUBE_GRAINS)
+MEASURES = ["trips", "co2_kgs", "avg_co2_kgs", "max_co2_kgs"]
+BATCH_SIZE = 1_000_000
+
+
+def connect_api(database=None):
+    # read-only on the published snapshot (see publish.py), so consumers never wait on the loader
+    return connect_reader(database)
+
+
+def dimension_sql(dim, source):
+    # column expression of one dimension in emissions_cube or a trips relation
+    if dim not in DIMENSIONS:
+        raise ValueError(f"unknown dimension {dim!r}, expected one of {', '.join(DIMENSIONS)}")
+    if source is None:
+        return {"taxi_type": "taxi_type", "year": "year"}.get(dim, "bucket")
+    return {
+        "taxi_type": "CAST(taxi_type AS VARCHAR)",
+        "year": "CAST(EXTRACT(year FROM pickup_ts) AS INTEGER)",
+    }.get(dim) or CUBE_GRAINS[dim]
+
+
+def check_source(con, source):
+    # source is put into the SQL as is, so it has to name an existing table or view
+    if source is None:
+        return
+    known = {row[0] for row in con.execute("""
+        SELECT table_name FROM duckdb_tables() UNION SELECT view_name FROM duckdb_views() WHERE NOT internal
+    """).fetchall()}
+    if source not in known:
+        raise ValueError(f"unknown source {source!r}, expected a table or view such as 'trips'")
+
+
+def emissions_sql(dims, filters=None, taxi_types=None, source=None):
+    """SQL and parameters of emissions_by(), see there for the arguments."""
+    if source is not None and not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", source):
+        raise ValueError(f"source must be a table or view name, got {source!r}")
+    dims = list(dims)
+    filters = dict(filters or {})
+    grains = [d for d in set(dims) | set(filters) if d in CUBE_GRAINS]
+    where, params = [], []
+    if source is None:
+        if len(grains) > 1:
+            raise ValueError(f"emissions_cube holds one grain at a time, got {', '.join(sorted(grains))}; "
+                             "use source='trips' to combine them")
+        # every trip is in exactly one bucket of each grain, month rows serve the grain-less queries
+        where.append("grain = ?")
+        params.append(grains[0] if grains else "month")
+        relation = "emissions_cube"
+        measures = """
+            CAST(SUM(trip_count) AS BIGINT) AS trips,
+            SUM(co2_sum) AS co2_kgs,
+            SUM(co2_sum) / NULLIF(SUM(co2_count), 0) AS avg_co2_kgs,
+            MAX(co2_max) AS max_co2_kgs
+        """
+    else:
+        relation = source
+        measures = """
+            COUNT(*) AS trips,
+            SUM(trip_co2_kgs) AS co2_kgs,
+            AVG(trip_co2_kgs) AS avg_co2_kgs,
+            MAX(trip_co2_kgs) AS max_co2_kgs
+        """
+
+    taxi_types = list(taxi_types) if taxi_types else None
+    if taxi_types:
+        unknown = set(taxi_types) - set(TAXI_TYPES)
+        if unknown:
+            raise ValueError(f"unknown taxi types: {', '.join(sorted(unknown))}")
+        where.append(f"{dimension_sql('taxi_type', source)} IN ({', '.join('?' for _ in taxi_types)})")
+        params.extend(taxi_types)
+    for dim, value in filters.items():
+        if isinstance(value, range) and value.step == 1:
+            # a range of years etc. stays two parameters however wide it is
+            where.append(f"{dimension_sql(dim, source)} BETWEEN ? AND ?")
+            params.extend([value.start, value.stop - 1])
+            continue
+        values = list(value) if isinstance(value, (list, tuple, set, range)) else [value]
+        if not values:
+            # nothing to match, and IN () isn't valid SQL
+            where.append("false")
+            continue
+        where.append(f"{dimension_sql(dim, source)} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+
+    select = [f"{dimension_sql(d, source)} AS {d}" for d in dims]
+    group = f"GROUP BY {', '.join(str(i + 1) for i in range(len(dims)))}" if dims else ""
+    order = f"ORDER BY {', '.join(dims)}" if dims else ""
+    sql = f"""
+        SELECT {', '.join(select + [measures])}
+        FROM {relation}
+        WHERE {' AND '.join(where) if where else 'true'}
+        {group}
+        {order}
+    """
+    return sql, params
+
+
+def emissions_by(con, dims, filters=None, taxi_types=None, source=None, batch_size=BATCH_SIZE):
+    """Trips and CO2 per combination of dims, as a pyarrow.RecordBatchReader.
+
+    dims: names from DIMENSIONS to group by, [] for one grand total row.
+    filters: {dimension: value or list of values}, e.g. {"year": [2023, 2024]};
+        a range, e.g. {"year": range(2020, 2025)}, filters with BETWEEN. An empty
+        list matches no rows.
+    taxi_types: feeds to include, all by default.
+    source: None for emissions_cube, or a unified trips relation such as "trips";
+        anything but an existing table or view raises ValueError.
+    Columns are dims followed by MEASURES; batches hold up to batch_size rows.
+    """
+    check_source(con, source)
+    sql, params = emissions_sql(dims, filters, taxi_types, source)
+    return con.execute(sql, params).to_arrow_reader(batch_size)
+
+
+def emissions_table(con, dims, filters=None, taxi_types=None, source=None, cache=None):
+    """emissions_by() collected into one pyarrow.Table.
+
+    cache (a query_cache.QueryCache) answers repeat queries until the source changes.
+    """
+    check_source(con, source)
+    sql, params = emissions_sql(dims, filters, taxi_types, source)
+    if cache is not None:
+        return cache.to_arrow_table(con, sql, params, tables=[source or "emissions_cube"])
+    return con.execute(sql, params).to_arrow_table()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='emissions_api.log'
+    )
+    parser = argparse.ArgumentParser(description="Query trips and CO2 by dimension, written as Arrow IPC or CSV")
+    parser.add_argument("dims", nargs="*", help=f"dimensions to group by: {', '.join(DIMENSIONS)}")
+    parser.add_argument("--year", type=int, nargs="*", default=None, help="only these years")
+    parser.add_argument("--taxi-type", nargs="*", default=None, choices=list(TAXI_TYPES), help="only these feeds")
+    parser.add_argument("--source", default=None, help="aggregate this trips relation instead of emissions_cube")
+    parser.add_argument("--database", default=None, help="database to read (default: the current snapshot)")
+    parser.add_argument("--output", default=None, help="write an Arrow IPC stream here instead of CSV to stdout")
+    args = parser.parse_args()
+    con = None
+    try:
+        import pyarrow as pa
+        import pyarrow.csv
+
+        con = connect_api(args.database)
+        filters = {"year": args.year} if args.year else None
+        reader = emissions_by(con, args.dims, filters, args.taxi_type, args.source)
+        rows = 0
+        if args.output:
+            with pa.OSFile(args.output, "wb") as sink, pa.ipc.new_stream(sink, reader.schema) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+        else:
+            with pa.output_stream("/dev/stdout") as sink, pa.csv.CSVWriter(sink, reader.schema) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+        logger.info(f"Wrote {rows:,} rows for dims {args.dims}")
+    except Exception as e:
+        logger.error(f"Error querying emissions: {e}")
+        print(f"Error querying emissions: {e}")
+    finally:
+        if con is not None:
+            con.close()
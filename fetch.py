@@ -0,0 +1,251 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# no basicConfig here, the stage scripts (load.py etc.) configure logging
+logger = logging.getLogger(__name__)
+
+# status codes that mean the server wants us to slow down (CloudFront answers 403 when throttling)
+THROTTLE_STATUS = {403, 429}
+
+
+class RateLimiter:
+    """Token bucket shared by all fetch workers.
+
+    The refill rate is lowered when the server throttles us (403/429/5xx) and
+    slowly raised again after successful requests.
+    """
+
+    def __init__(self, rate=4.0, burst=4, min_rate=0.2, max_rate=16.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # block until a token is available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait_time)
+
+    def backoff(self, retry_after=None):
+        # multiplicative decrease, and pause everyone if the server told us how long to wait
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logger.info(f"Rate limiter backing off to {self.rate:.2f} req/s")
+
+    def success(self):
+        # additive increase
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+def open_url(url, limiter, headers=None, max_retries=5, timeout=60):
+    """Open url through the rate limiter, retrying throttled requests with backoff.
+
+    Returns the response object. A 304 Not Modified is returned as the HTTPError
+    itself (it has .code and .headers) so callers can handle conditional requests.
+    """
+    request = urllib.request.Request(url, headers=headers or {})
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            resp = urllib.request.urlopen(request, timeout=timeout)
+            limiter.success()
+            return resp
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                limiter.success()
+                return e
+            if e.code not in THROTTLE_STATUS and e.code < 500:
+                raise
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            retry_after = e.headers.get("Retry-After") if e.headers else None
+            limiter.backoff(float(retry_after) if retry_after and retry_after.isdigit() else None)
+            # jittered exponential backoff for this worker on top of the shared limiter
+            time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+            logger.info(f"Retrying {url} after HTTP {e.code} (attempt {attempt})")
+
+
+def download(resp, dest_dir, suffix=".part"):
+    """Stream a response body into a temp file in dest_dir, returns (path, size, sha256)."""
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=dest_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = resp.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, size, digest.hexdigest()
+
+
+def fetch_month(url, dest_dir, limiter):
+    """Download one monthly parquet file to dest_dir without caching, returns (path, sha256)."""
+    with open_url(url, limiter) as resp:
+        path, _, sha256 = download(resp, dest_dir, suffix=".parquet")
+    return path, sha256
+
+
+class ParquetCache:
+    """Content-addressed on-disk cache for the monthly trip-data parquet files.
+
+    Files are stored as objects/<sha256>.parquet and manifest.json maps each url
+    to its object, size, ETag/Last-Modified and last use time. Cached entries are
+    revalidated with conditional requests, so a month that TLC republished is
+    downloaded again while unchanged months are read from local disk.
+    """
+
+    def __init__(self, cache_dir=".parquet_cache", max_bytes=None, revalidate=True):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+        self.lock = threading.Lock()
+        self.pinned = {}
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable cache manifest {self.manifest_path}: {e}")
+            return {}
+
+    def _write_manifest(self):
+        # write then rename so a crash never leaves a half written manifest
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, f"{sha256}.parquet")
+
+    def entry(self, url):
+        with self.lock:
+            entry = self.manifest.get(url)
+            return dict(entry) if entry else None
+
+    def get(self, url, limiter):
+        """Return a local path for url, downloading it only when missing or changed.
+
+        The returned file is pinned against eviction until release(url) is called.
+        """
+        entry = self.entry(url)
+        cached = entry is not None and os.path.exists(self.object_path(entry["sha256"]))
+
+        if cached and not self.revalidate:
+            return self._hit(url)
+
+        headers = {}
+        if cached:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with open_url(url, limiter, headers) as resp:
+            if resp.status == 304 and cached:
+                return self._hit(url)
+            tmp, size, sha256 = download(resp, self.cache_dir)
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+
+        os.replace(tmp, self.object_path(sha256))
+
+        with self.lock:
+            if cached and entry["sha256"] != sha256:
+                logger.info(f"{url} was republished upstream, cached copy replaced")
+                print(f"{url} was republished upstream, cached copy replaced")
+                del self.manifest[url]
+                self._drop_object(entry["sha256"])
+            self.manifest[url] = {
+                "sha256": sha256,
+                "size": size,
+                "etag": etag,
+                "last_modified": last_modified,
+                "last_used": time.time(),
+            }
+            self.pinned[url] = self.pinned.get(url, 0) + 1
+            self._evict()
+            self._write_manifest()
+        return self.object_path(sha256)
+
+    def _hit(self, url):
+        with self.lock:
+            entry = self.manifest[url]
+            entry["last_used"] = time.time()
+            self.pinned[url] = self.pinned.get(url, 0) + 1
+            self._write_manifest()
+            return self.object_path(entry["sha256"])
+
+    def release(self, url):
+        with self.lock:
+            if self.pinned.get(url, 0) > 1:
+                self.pinned[url] -= 1
+            else:
+                self.pinned.pop(url, None)
+
+    def _evict(self):
+        # drop least recently used urls until the cache fits, never touching pinned files;
+        # an object is only deleted once no url references its hash any more
+        if not self.max_bytes:
+            return
+        sizes = {e["sha256"]: e["size"] for e in self.manifest.values()}
+        total = sum(sizes.values())
+        for url, entry in sorted(self.manifest.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if url in self.pinned:
+                continue
+            del self.manifest[url]
+            if self._drop_object(entry["sha256"]):
+                total -= sizes[entry["sha256"]]
+            logger.info(f"Evicted {url} from parquet cache")
+
+    def _drop_object(self, sha256):
+        # objects are shared by hash, only delete one when no url references it any more
+        if any(e["sha256"] == sha256 for e in self.manifest.values()):
+            return False
+        try:
+            os.remove(self.object_path(sha256))
+        except FileNotFoundError:
+            pass
+        return True
@@ -1,6 +1,15 @@
-import duckdb
+import argparse
 import logging
-import time
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from fetch import ParquetCache, RateLimiter, fetch_month
+from parquet_index import ensure_parquet_index, index_file, indexed_schema, record_location
+from profiling import connect
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from taxi_config import clean_select
 
 logging.basicConfig(
     level=logging.INFO,
@@ -8,121 +17,472 @@ logging.basicConfig(
     filename='load.log'
 )
 logger = logging.getLogger(__name__)
-sleep_time = 1
-def load_parquet_files():
-    con = None
+
+# base url can be pointed at a local HTTP server for testing the concurrent loader
+BASE_URL = os.environ.get("TLC_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data")
+CACHE_DIR = os.environ.get("TLC_CACHE_DIR", ".parquet_cache")
+
+
+VEHICLE_EMISSIONS_CSV = "data/vehicle_emissions.csv"
+
+# columns load_stats keeps mergeable partials of (sum and non-null count per month)
+STAT_COLUMNS = ["passenger_count", "trip_distance", "total_amount", "tip_amount"]
+
+
+def month_url(base, taxi_type, year, month):
+    return f"{base}/{taxi_type}_tripdata_{year}-{month:02d}.parquet"
+
+
+def ensure_load_manifest(con):
+    # one row per loaded month, used to skip months that are already loaded and unchanged
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS load_manifest (
+            taxi_type VARCHAR,
+            year INTEGER,
+            month INTEGER,
+            row_count BIGINT,
+            checksum VARCHAR,
+            loaded_at TIMESTAMP,
+            PRIMARY KEY (taxi_type, year, month)
+        )
+    """)
+    # per-month partial sums and non-null counts of STAT_COLUMNS, written with the month
+    partials = ", ".join(f"{c}_sum DOUBLE, {c}_count BIGINT" for c in STAT_COLUMNS)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS load_stats (
+            taxi_type VARCHAR,
+            source_month DATE,
+            row_count BIGINT,
+            {partials},
+            PRIMARY KEY (taxi_type, source_month)
+        )
+    """)
+    ensure_parquet_index(con)
+
+
+def record_load_stats(con, taxi_type, source_months):
+    """Store the load_stats partials of just-loaded source months.
+
+    Only those months' rows are read, so the cost is the batch's, not the table's.
+    """
+    partials = ", ".join(f"SUM({c}), COUNT({c})" for c in STAT_COLUMNS)
+    con.execute(f"""
+        INSERT OR REPLACE INTO load_stats
+        SELECT ?, source_month, COUNT(*), {partials}
+        FROM {taxi_type}_taxi
+        WHERE source_month IN (SELECT UNNEST(CAST(? AS DATE[])))
+        GROUP BY source_month
+    """, [taxi_type, list(source_months)])
+
+
+def backfill_load_stats(con, taxi_type):
+    # months loaded before load_stats existed get their partials once
+    missing = [row[0] for row in con.execute("""
+        SELECT make_date(m.year, m.month, 1) FROM load_manifest m
+        LEFT JOIN load_stats s ON s.taxi_type = m.taxi_type AND s.source_month = make_date(m.year, m.month, 1)
+        WHERE m.taxi_type = ? AND s.source_month IS NULL
+    """, [taxi_type]).fetchall()]
+    if missing and table_columns(con, f"{taxi_type}_taxi"):
+        record_load_stats(con, taxi_type, missing)
+        logger.info(f"Computed load_stats for {len(missing)} earlier {taxi_type} months")
+
+
+def load_summary(con, taxi_type):
+    """Rows and passenger/distance/amount/tip averages and totals of the loaded months.
+
+    Merged from the load_stats partials of the months in load_manifest, the raw
+    table is never scanned. Returns {"rows": n, "avg_<col>": ..., "total_<col>": ...}.
+    """
+    merged = ", ".join(f"SUM(s.{c}_sum), SUM(s.{c}_sum) / NULLIF(SUM(s.{c}_count), 0)" for c in STAT_COLUMNS)
+    row = con.execute(f"""
+        SELECT COALESCE(SUM(s.row_count), 0), {merged}
+        FROM load_stats s
+        JOIN load_manifest m ON m.taxi_type = s.taxi_type AND make_date(m.year, m.month, 1) = s.source_month
+        WHERE s.taxi_type = ?
+    """, [taxi_type]).fetchone()
+    summary = {"rows": row[0]}
+    for i, c in enumerate(STAT_COLUMNS):
+        summary[f"total_{c}"] = row[1 + 2 * i] or 0.0
+        summary[f"avg_{c}"] = row[2 + 2 * i] or 0.0
+    return summary
+
+
+def table_columns(con, table):
+    rows = con.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = 'main' AND table_name = ?
+        ORDER BY ordinal_position
+    """, [table]).fetchall()
+    return {name.lower(): dtype for name, dtype in rows}
+
+
+def prepare_table(con, taxi_type, full_refresh=False):
+    """Drop the raw table when it can't be loaded incrementally.
+
+    That is on --full-refresh, or for tables created before months were tagged
+    with source_month (their rows can't be matched to the manifest).
+    """
+    table = f"{taxi_type}_taxi"
+    columns = table_columns(con, table)
+    if columns and (full_refresh or "source_month" not in columns):
+        con.execute(f"DROP TABLE {table}")
+        con.execute("DELETE FROM load_manifest WHERE taxi_type = ?", [taxi_type])
+        con.execute("DELETE FROM load_stats WHERE taxi_type = ?", [taxi_type])
+        logger.info(f"Dropped {table} for a full reload")
+        print(f"Dropped {table} for a full reload")
+
+
+def align_schema(con, table, sources, schema=None):
+    """Add columns that first appear in later months (e.g. airport_fee) so BY NAME inserts work.
+
+    schema is the sources' [(column, type)] from the parquet index; without it
+    DuckDB resolves the union of the files' schemas.
+    """
+    columns = table_columns(con, table)
+    if schema is None:
+        schema = con.execute("DESCRIBE SELECT * FROM read_parquet(?, union_by_name=true)", [sources]).fetchall()
+    for name, dtype, *_ in schema:
+        if name.lower() not in columns:
+            con.execute(f'ALTER TABLE {table} ADD COLUMN "{name}" {dtype}')
+            columns[name.lower()] = dtype
+            logger.info(f"Added column {name} {dtype} to {table}")
+
+
+def load_month(con, taxi_type, year, month, source, checksum):
+    """Load one month in its own transaction, replacing any earlier copy of it.
+
+    Returns the number of rows loaded, or None when the manifest already has
+    this month with the same checksum.
+    """
+    table = f"{taxi_type}_taxi"
+    loaded = con.execute("""
+        SELECT checksum FROM load_manifest WHERE taxi_type = ? AND year = ? AND month = ?
+    """, [taxi_type, year, month]).fetchone()
+    if loaded and loaded[0] == checksum:
+        return None
+
+    # the footer goes into the parquet index first, the schema decision below reads it from there
+    index_file(con, taxi_type, year, month, source, checksum)
+    source_month = f"{year}-{month:02d}-01"
+    con.execute("BEGIN TRANSACTION")
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        logger.info("Connected to DuckDB instance")
+        if not table_columns(con, table):
+            # create the table from the first month that gets loaded
+            (row_count,) = con.execute(f"""
+                CREATE TABLE {table} AS
+                SELECT *, CAST(? AS DATE) AS source_month FROM read_parquet(?, union_by_name=true)
+            """, [source_month, source]).fetchone()
+        else:
+            align_schema(con, table, source, indexed_schema(con, taxi_type, [(year, month)]))
+            con.execute(f"DELETE FROM {table} WHERE source_month = ?", [source_month])
+            (row_count,) = con.execute(f"""
+                INSERT INTO {table} BY NAME
+                SELECT *, CAST(? AS DATE) AS source_month FROM read_parquet(?, union_by_name=true)
+            """, [source_month, source]).fetchone()
+        con.execute("""
+            INSERT OR REPLACE INTO load_manifest VALUES (?, ?, ?, ?, ?, current_timestamp)
+        """, [taxi_type, year, month, row_count, checksum])
+        record_load_stats(con, taxi_type, [source_month])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return row_count
+
+
+def readable_files(con, taxi_type, files):
+    """Return files (year, month, path, checksum) whose parquet footer can be read, plus num_rows.
+
+    Only the footer is read (into the parquet index), so truncated or corrupt
+    files are caught before a big scan.
+    """
+    readable = []
+    for year, month, path, checksum in files:
+        try:
+            num_rows = index_file(con, taxi_type, year, month, path, checksum)
+        except Exception as e:
+            logger.info(f"Skip {taxi_type} {year}-{month:02d}: {e}")
+            print(f"Skip {taxi_type} {year}-{month:02d}: {e}")
+            continue
+        readable.append((year, month, path, checksum, num_rows))
+    return readable
+
+
+def load_months(con, taxi_type, files):
+    # bulk_load()'s fallback: (year, month, path, checksum, num_rows) one load_month() each
+    for year, month, path, checksum, _ in files:
+        try:
+            load_month(con, taxi_type, year, month, path, checksum)
+        except Exception as e:
+            logger.info(f"Skip {taxi_type} {year}-{month:02d}: {e}")
+            print(f"Skip {taxi_type} {year}-{month:02d}: {e}")
+
 
-        base = "https://d37ci6vzurychx.cloudfront.net/trip-data"
-        start_year, end_year = 2015, 2024
+def bulk_load(con, taxi_type, files):
+    """Load many months with one multi-file scan instead of one INSERT per month.
 
-        # Loading yellow taxi table
-        # Create table from first available month, then insert the rest
-        created = False
-        for year in range(start_year, end_year + 1):
-            for m in range(1, 13):
-                url = f"{base}/yellow_tripdata_{year}-{m:02d}.parquet"
+    files is a list of (year, month, path, checksum). Months the manifest already
+    has with the same checksum are skipped, and files whose parquet footer can't
+    be read are reported and left out. If the combined scan still fails the
+    months are loaded one at a time so a single bad file can't sink the rest.
+    """
+    table = f"{taxi_type}_taxi"
+    manifest = {
+        (year, month): checksum for year, month, checksum in con.execute(
+            "SELECT year, month, checksum FROM load_manifest WHERE taxi_type = ?", [taxi_type]
+        ).fetchall()
+    }
+
+    changed = []
+    for year, month, path, checksum in files:
+        if manifest.get((year, month)) == checksum:
+            logger.info(f"Up to date {taxi_type} {year}-{month:02d}")
+        else:
+            changed.append((year, month, path, checksum))
+    todo = readable_files(con, taxi_type, changed)
+    # the cache is content-addressed, so byte-identical months can share one path; the
+    # filename join below can't tell those apart and they are loaded one month at a time
+    uses = Counter(path for _, _, path, _, _ in todo)
+    shared = [f for f in todo if uses[f[2]] > 1]
+    todo = [f for f in todo if uses[f[2]] == 1]
+    if shared:
+        load_months(con, taxi_type, shared)
+    if not todo:
+        return
+
+    paths = [path for _, _, path, _, _ in todo]
+    # the filename column maps every row back to its month through the small bulk_files table
+    scan = f"""
+        SELECT r.* EXCLUDE (filename), f.source_month
+        FROM read_parquet(?, union_by_name=true, filename=true) r
+        JOIN bulk_files f ON r.filename = f.path
+    """
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute("CREATE OR REPLACE TEMP TABLE bulk_files (path VARCHAR, source_month DATE)")
+        con.executemany("INSERT INTO bulk_files VALUES (?, ?)",
+                        [[path, f"{year}-{month:02d}-01"] for year, month, path, _, _ in todo])
+        if not table_columns(con, table):
+            con.execute(f"CREATE TABLE {table} AS {scan}", [paths])
+        else:
+            # resolve the unified schema of all files once, up front
+            align_schema(con, table, paths,
+                         indexed_schema(con, taxi_type, [(year, month) for year, month, _, _, _ in todo]))
+            con.execute(f"DELETE FROM {table} WHERE source_month IN (SELECT source_month FROM bulk_files)")
+            con.execute(f"INSERT INTO {table} BY NAME {scan}", [paths])
+        con.executemany("INSERT OR REPLACE INTO load_manifest VALUES (?, ?, ?, ?, ?, current_timestamp)",
+                        [[taxi_type, year, month, num_rows, checksum]
+                         for year, month, _, checksum, num_rows in todo])
+        record_load_stats(con, taxi_type, [f"{year}-{month:02d}-01" for year, month, _, _, _ in todo])
+        con.execute("COMMIT")
+    except Exception as e:
+        con.execute("ROLLBACK")
+        logger.info(f"Bulk load of {taxi_type} failed, loading month by month: {e}")
+        print(f"Bulk load of {taxi_type} failed, loading month by month: {e}")
+        load_months(con, taxi_type, todo)
+        return
+
+    total = sum(num_rows for _, _, _, _, num_rows in todo)
+    print(f"Bulk loaded {len(todo)} {taxi_type} months ({total:,} rows)")
+    logger.info(f"Bulk loaded {len(todo)} {taxi_type} months ({total:,} rows)")
+
+
+def fused_load(con, taxi_type, files):
+    """Build {taxi_type}_clean straight from the parquet files, skipping the raw table.
+
+    clean.py's column list and filters are applied inside the parquet scan, so
+    only surviving rows are ever written. The result is identical to loading
+    the same months and then running clean.py. The raw table and load_manifest
+    are left untouched.
+    """
+    todo = readable_files(con, taxi_type, files)
+    if not todo:
+        return
+    paths = [path for _, _, path, _, _ in todo]
+    source = "read_parquet(?, union_by_name=true)"
+    con.execute("BEGIN TRANSACTION")
+    try:
+        (row_count,) = con.execute(f"""
+            CREATE OR REPLACE TABLE {taxi_type}_clean AS
+            {clean_select(taxi_type, source)}
+        """, [paths]).fetchone()
+        # clean_manifest described the replaced table, without it the next clean.py and transform.py runs are full ones
+        if con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'clean_manifest'").fetchone()[0]:
+            con.execute("DELETE FROM clean_manifest WHERE taxi_type = ?", [taxi_type])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    total = sum(num_rows for _, _, _, _, num_rows in todo)
+    print(f"Fused load of {len(todo)} {taxi_type} months kept {row_count:,} of {total:,} rows")
+    logger.info(f"Fused load of {len(todo)} {taxi_type} months kept {row_count:,} of {total:,} rows")
+
+
+def fetch_sequentially(months, fetch):
+    # yields ((year, month), result, error) one month at a time
+    for key in months:
+        try:
+            yield key, fetch(*key), None
+        except Exception as e:
+            yield key, None, e
+
+
+def fetch_concurrently(months, fetch, workers):
+    """Fetch months in a bounded thread pool, yielding them as they complete.
+
+    The caller consumes the results on its own thread, so it stays the only writer.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        queue = iter(months)
+
+        def submit_next():
+            for key in queue:
+                pending[pool.submit(fetch, *key)] = key
+                return
+
+        # keep at most 2x workers downloads in flight so files don't pile up
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                submit_next()
                 try:
-                    # create a table if it doesn't exist, otherwise insert
-                    if not created:
-                        con.execute("""
-                            CREATE OR REPLACE TABLE yellow_taxi AS
-                            SELECT * FROM read_parquet(?, union_by_name=true)
-                        """, [url])
-                        logger.info(f"Initialized yellow_taxi from {url}")
-                        print(f"Initialized yellow_taxi from {url}")
-                        created = True
-                    else:
-                        con.execute("""
-                            INSERT INTO yellow_taxi
-                            SELECT * FROM read_parquet(?, union_by_name=true)
-                        """, [url])
-                        print(f"Inserted yellow {year}-{m:02d}")
-                        logger.info(f"Inserted yellow {year}-{m:02d}")
-                        
-                        # sleep to avoid overwhelming the server or hitting rate limits
-                        time.sleep(sleep_time)
+                    yield key, future.result(), None
                 except Exception as e:
-                    logger.info(f"Skip yellow {year}-{m:02d}: {e}")
-                    print(f"Skip yellow {year}-{m:02d}: {e}")
-
-        # loading green taxi table
-        # Create table from first available month, then insert the rest
-        created = False
-        for year in range(start_year, end_year + 1):
-            for m in range(1, 13):
-                url = f"{base}/green_tripdata_{year}-{m:02d}.parquet"
+                    yield key, None, e
+
+
+def load_taxi_type(con, taxi_type, base, months, workers, limiter, cache=None, mode="months"):
+    """Load the given (year, month) list for one taxi type, skipping unchanged months.
+
+    mode "months" loads each month as soon as it is fetched. "bulk" and "fused"
+    fetch every month first and hand the whole list to bulk_load() or fused_load().
+    """
+    with tempfile.TemporaryDirectory(prefix="tlc_") as tmp:
+
+        def fetch(year, m):
+            # returns (local path, sha256 of the file, cleanup callback)
+            url = month_url(base, taxi_type, year, m)
+            if cache:
+                path = cache.get(url, limiter)
+                return path, cache.entry(url)["sha256"], lambda: cache.release(url)
+            path, sha256 = fetch_month(url, tmp, limiter)
+            return path, sha256, lambda: os.remove(path)
+
+        if workers > 1:
+            results = fetch_concurrently(months, fetch, workers)
+        else:
+            results = fetch_sequentially(months, fetch)
+
+        if mode in ("bulk", "fused"):
+            files, cleanups = [], []
+            for (year, m), fetched, error in results:
+                if error:
+                    logger.info(f"Skip {taxi_type} {year}-{m:02d}: {error}")
+                    print(f"Skip {taxi_type} {year}-{m:02d}: {error}")
+                    continue
+                path, checksum, cleanup = fetched
+                files.append((year, m, path, checksum))
+                cleanups.append(cleanup)
+            try:
+                if mode == "fused":
+                    fused_load(con, taxi_type, sorted(files))
+                else:
+                    bulk_load(con, taxi_type, sorted(files))
+            finally:
+                for year, m, path, _ in files:
+                    record_location(con, taxi_type, year, m, path, month_url(base, taxi_type, year, m))
+                for cleanup in cleanups:
+                    cleanup()
+            return
+
+        for (year, m), fetched, error in results:
+            try:
+                if error:
+                    raise error
+                path, checksum, cleanup = fetched
                 try:
-                    # create a table if it doesn't exist, otherwise insert
-                    if not created:
-                        con.execute("""
-                            CREATE OR REPLACE TABLE green_taxi AS
-                            SELECT * FROM read_parquet(?, union_by_name=true)
-                        """, [url])
-                        logger.info(f"Initialized green_taxi from {url}")
-                        print(f"Initialized green_taxi from {url}")
-                        created = True
-                    else:
-                        con.execute("""
-                            INSERT INTO green_taxi
-                            SELECT * FROM read_parquet(?, union_by_name=true)
-                        """, [url])
-                        print(f"Inserted green {year}-{m:02d}")
-                        logger.info(f"Inserted green {year}-{m:02d}")
-
-                        # sleep to avoid overwhelming the server or hitting rate limits
-                        time.sleep(sleep_time)
-                # skip months that don't exist (just in case)
-                except Exception as e:
-                    logger.info(f"Skip green {year}-{m:02d}: {e}")
-                    print(f"Skip green {year}-{m:02d}: {e}")
+                    row_count = load_month(con, taxi_type, year, m, path, checksum)
+                finally:
+                    record_location(con, taxi_type, year, m, path, month_url(base, taxi_type, year, m))
+                    cleanup()
+                if row_count is None:
+                    logger.info(f"Up to date {taxi_type} {year}-{m:02d}")
+                else:
+                    print(f"Loaded {taxi_type} {year}-{m:02d} ({row_count:,} rows)")
+                    logger.info(f"Loaded {taxi_type} {year}-{m:02d} ({row_count:,} rows)")
+            # skip months that don't exist (just in case)
+            except Exception as e:
+                logger.info(f"Skip {taxi_type} {year}-{m:02d}: {e}")
+                print(f"Skip {taxi_type} {year}-{m:02d}: {e}")
 
-        # load vehicle_emissions data from CSV
-        con.execute("""
-            CREATE OR REPLACE TABLE vehicle_emissions AS
-            SELECT * FROM read_csv_auto('data/vehicle_emissions.csv', header=true)
-        """)
-        logger.info("Created vehicle_emissions from CSV")
-
-        # compute basic summary stats
-        for table in ["yellow_taxi", "green_taxi"]:
-            row_counts = con.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0]
-            logger.info(f"{table}: {row_counts:,} rows")
-            print(f"{table}: {row_counts:,} rows")
-
-            stats = con.execute(f"""
-                SELECT
-                    AVG(passenger_count) AS avg_passengers,
-                    SUM(passenger_count) AS total_passengers,
-                    AVG(trip_distance) AS avg_trip_distance,
-                    SUM(trip_distance) AS total_trip_distance,
-                    AVG(total_amount) AS avg_total_amount,
-                    SUM(total_amount) AS total_revenue,
-                    AVG(tip_amount) AS avg_tip_amount,
-                    SUM(tip_amount) AS total_tips
-                FROM {table};
-            """).fetchone()
+
+def load_vehicle_emissions(con, path=VEHICLE_EMISSIONS_CSV):
+    # load vehicle_emissions data from CSV
+    con.execute(f"""
+        CREATE OR REPLACE TABLE vehicle_emissions AS
+        SELECT * FROM read_csv_auto('{path}', header=true)
+    """)
+    logger.info("Created vehicle_emissions from CSV")
+
+
+def load_parquet_files(workers=1, base=BASE_URL, cache_dir=CACHE_DIR, cache_max_gb=None, revalidate=True,
+                       start_year=2015, end_year=2024, full_refresh=False, mode="months", resources=None):
+    con = None
+    try:
+        con = connect('emissions.duckdb')
+        logger.info("Connected to DuckDB instance")
+        apply_resources(con, "load", **(resources or {}))
+
+        limiter = RateLimiter()
+
+        # keep a local copy of every month so re-runs don't download the history again
+        cache = None
+        if cache_dir:
+            max_bytes = int(cache_max_gb * 1024 ** 3) if cache_max_gb else None
+            cache = ParquetCache(cache_dir, max_bytes=max_bytes, revalidate=revalidate)
+            logger.info(f"Using parquet cache in {cache_dir}")
+
+        ensure_load_manifest(con)
+        months = [(y, m) for y in range(start_year, end_year + 1) for m in range(1, 13)]
+        for taxi_type in ["yellow", "green"]:
+            if mode != "fused":
+                prepare_table(con, taxi_type, full_refresh)
+            load_taxi_type(con, taxi_type, base, months, workers, limiter, cache, mode)
+
+        load_vehicle_emissions(con)
+
+        # summary stats merged from the per-month partials written at ingest
+        # (the fused mode doesn't build the raw tables)
+        taxi_types = [] if mode == "fused" else ["yellow", "green"]
+        for taxi_type in taxi_types:
+            backfill_load_stats(con, taxi_type)
+            stats = load_summary(con, taxi_type)
+            logger.info(f"{taxi_type}_taxi: {stats['rows']:,} rows")
+            print(f"{taxi_type}_taxi: {stats['rows']:,} rows")
 
             print(
-                f"average passenger count: {stats[0]:.2f} \n"
-                f"total passengers: {stats[1]:.2f}\n"
-                f"average trip distance: {stats[2]:.2f} \n"
-                f"total trip distance: {stats[3]:.2f}\n"
-                f"average total amount: {stats[4]:.2f} \n"
-                f"total revenue: {stats[5]:.2f}\n"
-                f"average tip amount: {stats[6]:.2f} \n"
-                f"total tips received: {stats[7]:.2f}\n"
+                f"average passenger count: {stats['avg_passenger_count']:.2f} \n"
+                f"total passengers: {stats['total_passenger_count']:.2f}\n"
+                f"average trip distance: {stats['avg_trip_distance']:.2f} \n"
+                f"total trip distance: {stats['total_trip_distance']:.2f}\n"
+                f"average total amount: {stats['avg_total_amount']:.2f} \n"
+                f"total revenue: {stats['total_total_amount']:.2f}\n"
+                f"average tip amount: {stats['avg_tip_amount']:.2f} \n"
+                f"total tips received: {stats['total_tip_amount']:.2f}\n"
             )
-            logger.info(f"average passenger count: {stats[0]:.2f} \n"
-                f"total passengers: {stats[1]:.2f}\n"
-                f"average trip distance: {stats[2]:.2f} \n"
-                f"total trip distance: {stats[3]:.2f}\n"
-                f"average total amount: {stats[4]:.2f} \n"
-                f"total revenue: {stats[5]:.2f}\n"
-                f"average tip amount: {stats[6]:.2f} \n"
-                f"total tips received: {stats[7]:.2f}\n"
+            logger.info(f"average passenger count: {stats['avg_passenger_count']:.2f} \n"
+                f"total passengers: {stats['total_passenger_count']:.2f}\n"
+                f"average trip distance: {stats['avg_trip_distance']:.2f} \n"
+                f"total trip distance: {stats['total_trip_distance']:.2f}\n"
+                f"average total amount: {stats['avg_total_amount']:.2f} \n"
+                f"total revenue: {stats['total_total_amount']:.2f}\n"
+                f"average tip amount: {stats['avg_tip_amount']:.2f} \n"
+                f"total tips received: {stats['total_tip_amount']:.2f}\n"
                 )
 
     except Exception as e:
@@ -133,4 +493,29 @@ def load_parquet_files():
             con.close()
 
 if __name__ == "__main__":
-    load_parquet_files()
+    parser = argparse.ArgumentParser(description="Load TLC trip data into emissions.duckdb")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of months to download in parallel (1 = sequential)")
+    parser.add_argument("--base-url", default=BASE_URL, help="trip-data base url")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="local parquet cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="read months straight from the server")
+    parser.add_argument("--cache-max-gb", type=float, default=None,
+                        help="evict least recently used months above this size")
+    parser.add_argument("--offline", action="store_true",
+                        help="trust cached months without revalidating them upstream")
+    parser.add_argument("--start-year", type=int, default=2015)
+    parser.add_argument("--end-year", type=int, default=2024)
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="drop the trip tables and load manifest and reload everything")
+    parser.add_argument("--bulk", action="store_const", dest="mode", const="bulk", default="months",
+                        help="fetch all months first, then ingest them with a single multi-file scan")
+    parser.add_argument("--fused", action="store_const", dest="mode", const="fused",
+                        help="apply clean.py's filters during the scan and build *_clean directly")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    load_parquet_files(workers=args.workers, base=args.base_url,
+                       cache_dir=None if args.no_cache else args.cache_dir,
+                       cache_max_gb=args.cache_max_gb, revalidate=not args.offline,
+                       start_year=args.start_year, end_year=args.end_year,
+                       full_refresh=args.full_refresh, mode=args.mode,
+                       resources=resource_overrides(args))
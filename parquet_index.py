@@ -0,0 +1,263 @@
+import argparse
+import glob
+import logging
+import os
+import re
+
+from profiling import connect
+from taxi_config import TAXI_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Index of the monthly parquet files built from their footers only: row count
+# and row groups per file, and per column its type, min, max and null count
+# merged over the row groups. Row counts, pickup ranges and "which months have
+# airport_fee" are answered from these two small tables without touching row
+# data, and load.py takes a month's schema from here instead of re-reading it.
+#   parquet_files:   taxi_type, year, month, path, checksum, num_rows, num_row_groups, indexed_at
+#   parquet_columns: taxi_type, year, month, column_id, column_name, column_type, min_value, max_value, null_count
+# min_value/max_value are text, compared as numbers or timestamps for such columns.
+# path is the local file for indexed directories, and the trip-data url for
+# months load.py fetched (its local copy is temporary or can be evicted).
+FILE_PATTERN = re.compile(r"(?P<taxi_type>[a-z]+)_tripdata_(?P<year>\d{4})-(?P<month>\d{2})\.parquet$")
+NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER",
+                 "UBIGINT", "FLOAT", "DOUBLE")
+
+
+def ensure_parquet_index(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS parquet_files (
+            taxi_type VARCHAR,
+            year INTEGER,
+            month INTEGER,
+            path VARCHAR,
+            checksum VARCHAR,
+            num_rows BIGINT,
+            num_row_groups BIGINT,
+            indexed_at TIMESTAMP,
+            PRIMARY KEY (taxi_type, year, month)
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS parquet_columns (
+            taxi_type VARCHAR,
+            year INTEGER,
+            month INTEGER,
+            column_id INTEGER,
+            column_name VARCHAR,
+            column_type VARCHAR,
+            min_value VARCHAR,
+            max_value VARCHAR,
+            null_count BIGINT,
+            PRIMARY KEY (taxi_type, year, month, column_name)
+        )
+    """)
+
+
+def stat_expr(agg, column):
+    # merge one footer statistic over the row groups, ordered by the column's type
+    numeric = " OR ".join(
+        ["s.duckdb_type LIKE 'DECIMAL%'"] + [f"s.duckdb_type = '{t}'" for t in NUMERIC_TYPES]
+    )
+    return f"""CASE
+        WHEN s.duckdb_type LIKE 'TIMESTAMP%' OR s.duckdb_type = 'DATE'
+            THEN CAST({agg}(TRY_CAST(m.{column} AS TIMESTAMP)) AS VARCHAR)
+        WHEN {numeric} THEN CAST({agg}(TRY_CAST(m.{column} AS DOUBLE)) AS VARCHAR)
+        ELSE {agg}(m.{column})
+    END"""
+
+
+def index_file(con, taxi_type, year, month, path, checksum):
+    """Record one month's footer in the index, returns its row count.
+
+    A month already indexed with the same checksum isn't read again. Raises
+    when the footer can't be read (truncated or not a parquet file).
+    """
+    known = con.execute("""
+        SELECT checksum, num_rows FROM parquet_files WHERE taxi_type = ? AND year = ? AND month = ?
+    """, [taxi_type, year, month]).fetchone()
+    if known and known[0] == checksum:
+        return known[1]
+
+    num_rows, num_row_groups = con.execute(
+        "SELECT num_rows, num_row_groups FROM parquet_file_metadata(?)", [path]
+    ).fetchone()
+    columns = con.execute(f"""
+        SELECT s.column_id, s.name, s.duckdb_type,
+            {stat_expr('MIN', 'stats_min_value')},
+            {stat_expr('MAX', 'stats_max_value')},
+            SUM(m.stats_null_count)
+        FROM parquet_schema(?) s
+        LEFT JOIN parquet_metadata(?) m ON m.path_in_schema = s.name
+        WHERE s.num_children IS NULL
+        GROUP BY s.column_id, s.name, s.duckdb_type
+        ORDER BY s.column_id
+    """, [path, path]).fetchall()
+
+    con.execute("DELETE FROM parquet_columns WHERE taxi_type = ? AND year = ? AND month = ?",
+                [taxi_type, year, month])
+    con.executemany(
+        "INSERT INTO parquet_columns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [[taxi_type, year, month, *column] for column in columns],
+    )
+    con.execute("""
+        INSERT OR REPLACE INTO parquet_files VALUES (?, ?, ?, ?, ?, ?, ?, current_timestamp)
+    """, [taxi_type, year, month, os.path.abspath(path), checksum, num_rows, num_row_groups])
+    logger.info(f"Indexed {taxi_type} {year}-{month:02d} ({num_rows:,} rows, {len(columns)} columns)")
+    return num_rows
+
+
+def record_location(con, taxi_type, year, month, path, location):
+    # replace the local path an indexed month was read from with where the file came from
+    con.execute("""
+        UPDATE parquet_files SET path = ? WHERE taxi_type = ? AND year = ? AND month = ? AND path = ?
+    """, [location, taxi_type, year, month, os.path.abspath(path)])
+
+
+def indexed_schema(con, taxi_type, months):
+    """[(column, type)] of the union of the indexed months' schemas, in first-seen order.
+
+    None when a month isn't indexed or a column's type differs between months,
+    then the caller has to let DuckDB resolve the union itself.
+    """
+    keys = sorted({year * 100 + month for year, month in months})
+    (indexed,) = con.execute("""
+        SELECT COUNT(*) FROM parquet_files
+        WHERE taxi_type = ? AND year * 100 + month IN (SELECT UNNEST(?))
+    """, [taxi_type, keys]).fetchone()
+    if indexed < len(keys):
+        return None
+    rows = con.execute("""
+        SELECT column_name, list(DISTINCT column_type), MIN(year * 100 + month), MIN(column_id)
+        FROM parquet_columns
+        WHERE taxi_type = ? AND year * 100 + month IN (SELECT UNNEST(?))
+        GROUP BY column_name
+        ORDER BY 3, 4
+    """, [taxi_type, keys]).fetchall()
+    if any(len(types) > 1 for _, types, _, _ in rows):
+        return None
+    return [(name, types[0]) for name, types, _, _ in rows]
+
+
+def month_rows(con, taxi_type=None, year=None):
+    # (taxi_type, year, month, num_rows) of the indexed files
+    return con.execute("""
+        SELECT taxi_type, year, month, num_rows FROM parquet_files
+        WHERE (? IS NULL OR taxi_type = ?) AND (? IS NULL OR year = ?)
+        ORDER BY ALL
+    """, [taxi_type, taxi_type, year, year]).fetchall()
+
+
+def column_range(con, column, taxi_type=None):
+    """(taxi_type, year, month, min, max, null_count) of a column in every indexed file that has it.
+
+    column matches case-insensitively (TLC renamed some columns over the years).
+    """
+    return con.execute("""
+        SELECT taxi_type, year, month, min_value, max_value, null_count FROM parquet_columns
+        WHERE lower(column_name) = lower(?) AND (? IS NULL OR taxi_type = ?)
+        ORDER BY taxi_type, year, month
+    """, [column, taxi_type, taxi_type]).fetchall()
+
+
+def pickup_range(con, taxi_type):
+    # earliest and latest pickup over every indexed month of taxi_type
+    return con.execute("""
+        SELECT MIN(CAST(min_value AS TIMESTAMP)), MAX(CAST(max_value AS TIMESTAMP)) FROM parquet_columns
+        WHERE taxi_type = ? AND lower(column_name) = lower(?)
+    """, [taxi_type, TAXI_TYPES[taxi_type]["pickup"]]).fetchone()
+
+
+def months_with_column(con, column, taxi_type=None):
+    # (taxi_type, year, month, column_type) of the files that have the column
+    return con.execute("""
+        SELECT taxi_type, year, month, column_type FROM parquet_columns
+        WHERE lower(column_name) = lower(?) AND (? IS NULL OR taxi_type = ?)
+        ORDER BY taxi_type, year, month
+    """, [column, taxi_type, taxi_type]).fetchall()
+
+
+def file_schema(con, taxi_type, year, month):
+    return con.execute("""
+        SELECT column_name, column_type FROM parquet_columns
+        WHERE taxi_type = ? AND year = ? AND month = ?
+        ORDER BY column_id
+    """, [taxi_type, year, month]).fetchall()
+
+
+def index_directory(con, directory):
+    """Index every <taxi_type>_tripdata_YYYY-MM.parquet under directory. Returns the files indexed.
+
+    Files are identified by size and mtime here; load.py passes the sha256 it already has.
+    """
+    ensure_parquet_index(con)
+    indexed = 0
+    for path in sorted(glob.glob(os.path.join(directory, "**", "*.parquet"), recursive=True)):
+        match = FILE_PATTERN.search(os.path.basename(path))
+        if not match or match["taxi_type"] not in TAXI_TYPES:
+            continue
+        stat = os.stat(path)
+        try:
+            index_file(con, match["taxi_type"], int(match["year"]), int(match["month"]), path,
+                       f"{stat.st_size}:{stat.st_mtime_ns}")
+            indexed += 1
+        except Exception as e:
+            logger.info(f"Skip {path}: {e}")
+            print(f"Skip {path}: {e}")
+    logger.info(f"Indexed {indexed} files from {directory}")
+    print(f"Indexed {indexed} files from {directory}")
+    return indexed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='parquet_index.log'
+    )
+    parser = argparse.ArgumentParser(description="Answer row-count, range and schema questions from parquet footers")
+    commands = parser.add_subparsers(dest="command", required=True)
+    query = argparse.ArgumentParser(add_help=False)
+    query.add_argument("--taxi-type", choices=list(TAXI_TYPES), default=None, help="only this feed")
+    build = commands.add_parser("build", help="index the monthly parquet files under a directory")
+    build.add_argument("directory")
+    rows = commands.add_parser("rows", parents=[query], help="trips per indexed month")
+    rows.add_argument("--year", type=int, default=None)
+    commands.add_parser("pickup-range", parents=[query], help="earliest and latest pickup per taxi type")
+    has = commands.add_parser("has-column", parents=[query], help="months whose files have a column")
+    has.add_argument("column")
+    stats = commands.add_parser("column-stats", parents=[query], help="min, max and null count of a column per month")
+    stats.add_argument("column")
+    schema = commands.add_parser("schema", parents=[query], help="columns and types of one month's file")
+    schema.add_argument("month", help="YYYY-MM")
+    args = parser.parse_args()
+
+    con = None
+    try:
+        con = connect('emissions.duckdb', read_only=args.command != "build")
+        if args.command == "build":
+            index_directory(con, args.directory)
+        elif args.command == "rows":
+            for t, y, m, n in month_rows(con, args.taxi_type, args.year):
+                print(f"{t} {y}-{m:02d}: {n:,} rows")
+        elif args.command == "pickup-range":
+            for t in [args.taxi_type] if args.taxi_type else TAXI_TYPES:
+                first, last = pickup_range(con, t)
+                print(f"{t}: {first} .. {last}")
+        elif args.command == "has-column":
+            for t, y, m, dtype in months_with_column(con, args.column, args.taxi_type):
+                print(f"{t} {y}-{m:02d}: {dtype}")
+        elif args.command == "column-stats":
+            for t, y, m, low, high, nulls in column_range(con, args.column, args.taxi_type):
+                print(f"{t} {y}-{m:02d}: min {low}, max {high}, nulls {nulls}")
+        else:
+            year, month = (int(part) for part in args.month.split("-"))
+            for t in [args.taxi_type] if args.taxi_type else TAXI_TYPES:
+                for name, dtype in file_schema(con, t, year, month):
+                    print(f"{t} {args.month} {name}: {dtype}")
+    except Exception as e:
+        logger.error(f"Error reading the parquet index: {e}")
+        print(f"Error reading the parquet index: {e}")
+    finally:
+        if con is not None:
+            con.close()
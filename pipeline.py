@@ -0,0 +1,270 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='pipeline.log'
+)
+logger = logging.getLogger(__name__)
+
+# imported after basicConfig so the stage modules log to pipeline.log
+from analysis import report_all
+from clean import clean_taxi_type, ensure_clean_manifest
+from fetch import ParquetCache, RateLimiter
+from load import (
+    BASE_URL, CACHE_DIR, VEHICLE_EMISSIONS_CSV, ensure_load_manifest, load_taxi_type,
+    load_vehicle_emissions, prepare_table,
+)
+from plots import render_plots
+from profiling import connect
+from publish import CURRENT_FILE, SNAPSHOT_DIR, publish
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from rollup import build_cube
+from taxi_config import TAXI_TYPES, create_trips_view, ensure_taxi_type_enum
+from timeseries import AGGREGATES, ensure_timeseries, refresh_taxi_type
+from transform import create_trips, transform_taxi_type
+
+# A stage is skipped when the fingerprint of its inputs matches the one recorded
+# after its last successful run and its outputs still exist. Stages are
+# deterministic, so a stage's own fingerprint is its input fingerprint; only the
+# sources (the load manifest and the emissions CSV) are fingerprinted from data.
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:16]
+
+
+def manifest_fingerprint(con, taxi_type):
+    # the checksums of every loaded month stand in for the raw table's contents
+    rows = con.execute("""
+        SELECT year, month, checksum FROM load_manifest
+        WHERE taxi_type = ? ORDER BY year, month
+    """, [taxi_type]).fetchall()
+    return fingerprint(rows)
+
+
+def file_fingerprint(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def ensure_pipeline_state(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_state (
+            stage VARCHAR PRIMARY KEY,
+            fingerprint VARCHAR,
+            seconds DOUBLE,
+            finished_at TIMESTAMP
+        )
+    """)
+
+
+def table_exists(con, table):
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [table]
+    ).fetchone()[0] > 0
+
+
+def stage(run, deps=(), outputs=(), files=(), key=None, source=None, always=False):
+    """One node of the pipeline DAG.
+
+    run(cursor) does the work. outputs/files must exist for the stage to be
+    skipped. key holds the options that change the result. source(cursor) gives
+    the fingerprint of external inputs; for always=True stages (the loads, which
+    have to ask upstream anyway) it is taken after running and becomes the
+    stage's fingerprint.
+    """
+    return {"run": run, "deps": list(deps), "outputs": list(outputs), "files": list(files),
+            "key": key, "source": source, "always": always}
+
+
+def build_stages(args):
+    limiter = RateLimiter()
+    cache = None
+    if args.cache_dir:
+        cache = ParquetCache(args.cache_dir, revalidate=not args.offline)
+    months = [(y, m) for y in range(args.start_year, args.end_year + 1) for m in range(1, 13)]
+
+    stages = {
+        "emissions": stage(
+            load_vehicle_emissions, outputs=["vehicle_emissions"],
+            source=lambda cur: file_fingerprint(VEHICLE_EMISSIONS_CSV),
+        ),
+    }
+    for taxi_type in TAXI_TYPES:
+
+        def load(cur, taxi_type=taxi_type):
+            prepare_table(cur, taxi_type, False)
+            load_taxi_type(cur, taxi_type, args.base_url, months, args.workers, limiter, cache)
+
+        stages[f"load_{taxi_type}"] = stage(
+            load, outputs=[f"{taxi_type}_taxi"], always=not args.no_load,
+            source=lambda cur, taxi_type=taxi_type: manifest_fingerprint(cur, taxi_type),
+        )
+        stages[f"clean_{taxi_type}"] = stage(
+            lambda cur, taxi_type=taxi_type: clean_taxi_type(cur, taxi_type, incremental=True),
+            deps=[f"load_{taxi_type}"], outputs=[f"{taxi_type}_clean", f"{taxi_type}_rejects"],
+        )
+        stages[f"transform_{taxi_type}"] = stage(
+            lambda cur, taxi_type=taxi_type: transform_taxi_type(cur, taxi_type),
+            deps=[f"clean_{taxi_type}", "emissions"], outputs=[f"{taxi_type}_transformed"],
+        )
+
+    def cube(cur):
+        create_trips_view(cur, "trips_clean", {t: f"{t}_clean" for t in TAXI_TYPES})
+        create_trips(cur)
+        build_cube(cur)
+
+    stages["cube"] = stage(cube, deps=[f"transform_{t}" for t in TAXI_TYPES], outputs=["emissions_cube"])
+
+    def timeseries(cur):
+        # only the pickup months of changed source months are recomputed
+        for taxi_type in TAXI_TYPES:
+            refresh_taxi_type(cur, taxi_type)
+
+    stages["timeseries"] = stage(
+        timeseries, deps=[f"transform_{t}" for t in TAXI_TYPES], outputs=AGGREGATES + ["timeseries_manifest"],
+    )
+    years = sorted(args.years)
+    stages["analysis"] = stage(
+        lambda cur: render_plots(report_all(cur, years)), deps=["cube"], key=years,
+        files=["monthly_co2_emissions_all.png", "yearly_co2_emissions_all.png"]
+              + [f"monthly_co2_emissions_{y}.png" for y in years],
+    )
+    # readers (analysis.py, emissions_api.py) switch to the new snapshot once it is complete
+    stages["publish"] = stage(publish, deps=["cube", "timeseries"], files=[os.path.join(SNAPSHOT_DIR, CURRENT_FILE)])
+    return stages
+
+
+def run_pipeline(con, stages, force=(), workers=2):
+    """Run stages in dependency order, independent ones concurrently on their own cursors.
+
+    force lists stages to run even when up to date (their dependents then see a
+    new run but the same fingerprint, so they are only redone if also forced).
+    Returns {stage: "ran" | "skipped" | "failed" | "blocked"}.
+    """
+    ensure_pipeline_state(con)
+    recorded = dict(con.execute("SELECT stage, fingerprint FROM pipeline_state").fetchall())
+    fingerprints, status = {}, {}
+
+    def up_to_date(cur, name, spec, input_fp):
+        return (
+            name not in force
+            and recorded.get(name) == input_fp
+            and all(table_exists(cur, table) for table in spec["outputs"])
+            and all(os.path.exists(path) for path in spec["files"])
+        )
+
+    def execute(name):
+        spec = stages[name]
+        cur = con.cursor()
+        try:
+            source = spec["source"](cur) if spec["source"] and not spec["always"] else None
+            input_fp = fingerprint(name, spec["key"], [fingerprints[d] for d in spec["deps"]], source)
+            if not spec["always"] and up_to_date(cur, name, spec, input_fp):
+                fingerprints[name] = input_fp
+                return "skipped", 0.0
+            start = time.perf_counter()
+            spec["run"](cur)
+            elapsed = time.perf_counter() - start
+            if spec["always"]:
+                # same formula as above, so a later --no-load run finds it up to date
+                input_fp = fingerprint(name, spec["key"], [fingerprints[d] for d in spec["deps"]],
+                                       spec["source"](cur))
+            fingerprints[name] = input_fp
+            cur.execute(
+                "INSERT OR REPLACE INTO pipeline_state VALUES (?, ?, ?, current_timestamp)",
+                [name, input_fp, elapsed],
+            )
+            return "ran", elapsed
+        finally:
+            cur.close()
+
+    pending = dict(stages)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            for name in list(pending):
+                deps = pending[name]["deps"]
+                if any(status.get(d) in ("failed", "blocked") for d in deps):
+                    status[name] = "blocked"
+                    logger.error(f"{name}: blocked by a failed dependency")
+                    print(f"{name}: blocked by a failed dependency")
+                    del pending[name]
+                elif all(status.get(d) in ("ran", "skipped") for d in deps):
+                    running[pool.submit(execute, name)] = name
+                    del pending[name]
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    status[name], elapsed = future.result()
+                    if status[name] == "ran":
+                        logger.info(f"{name}: ran in {elapsed:.2f} s")
+                        print(f"{name}: ran in {elapsed:.2f} s")
+                    else:
+                        logger.info(f"{name}: up to date, skipped")
+                        print(f"{name}: up to date, skipped")
+                except Exception as e:
+                    status[name] = "failed"
+                    logger.error(f"{name}: failed: {e}")
+                    print(f"{name}: failed: {e}")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run load, clean, transform and analysis over one connection, skipping up-to-date stages"
+    )
+    parser.add_argument("--base-url", default=BASE_URL, help="trip-data base url")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="local parquet cache directory")
+    parser.add_argument("--offline", action="store_true",
+                        help="trust cached months without revalidating them upstream")
+    parser.add_argument("--no-load", action="store_true",
+                        help="don't contact upstream, treat the loaded months as current")
+    parser.add_argument("--start-year", type=int, default=2015)
+    parser.add_argument("--end-year", type=int, default=2024)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="months downloaded in parallel per taxi type")
+    parser.add_argument("--years", type=int, nargs="*", default=[2024],
+                        help="single years analysis reports on")
+    parser.add_argument("--force", nargs="*", default=[],
+                        help="stages to rerun even when up to date (e.g. clean_yellow analysis)")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+
+    con = None
+    try:
+        con = connect('emissions.duckdb')
+        logger.info("Connected to emissions database")
+        print("Connected to emissions database")
+        # one instance-wide budget: the stages share the connection and run concurrently
+        apply_resources(con, "pipeline", **resource_overrides(args))
+        # shared catalog objects are created up front, not raced by the branches
+        ensure_load_manifest(con)
+        ensure_clean_manifest(con)
+        ensure_taxi_type_enum(con)
+        ensure_timeseries(con)
+        stages = build_stages(args)
+        unknown = set(args.force) - set(stages)
+        if unknown:
+            raise ValueError(f"unknown stages: {', '.join(sorted(unknown))}")
+        start = time.perf_counter()
+        status = run_pipeline(con, stages, force=set(args.force), workers=len(TAXI_TYPES))
+        ran = sum(1 for s in status.values() if s == "ran")
+        logger.info(f"Pipeline finished in {time.perf_counter() - start:.2f} s, {ran} of {len(stages)} stages ran")
+        print(f"Pipeline finished in {time.perf_counter() - start:.2f} s, {ran} of {len(stages)} stages ran")
+    except Exception as e:
+        logger.error(f"Pipeline error: {e}")
+        print(f"Pipeline error: {e}")
+    finally:
+        if con is not None:
+            con.close()
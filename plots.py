@@ -0,0 +1,113 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Figures are described by plain JSON "specs" (title, axes labels, x values and one
+# y series per line) that analysis.py writes next to the PNGs. Rendering is a
+# separate step: matplotlib is only imported by the processes that draw, and a
+# figure whose spec hash matches the one recorded for its PNG is not redrawn.
+SERIES_FILE = "plot_series.json"
+HASHES_FILE = "plot_hashes.json"
+
+
+def line_plot(filename, title, xlabel, ylabel, x, series, xticks=False):
+    """Spec of a line plot, series is {label: [y for each x]}."""
+    return {"filename": filename, "title": title, "xlabel": xlabel, "ylabel": ylabel,
+            "x": list(x), "series": {label: list(y) for label, y in series.items()}, "xticks": xticks}
+
+
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def render(spec):
+    """Draw one spec to its PNG, returns the filename. Runs in a worker process."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for label, y in spec["series"].items():
+        ax.plot(spec["x"], y, marker='o', label=label)
+    if spec["xticks"]:
+        ax.set_xticks(spec["x"])
+    ax.set_xlabel(spec["xlabel"])
+    ax.set_ylabel(spec["ylabel"])
+    ax.set_title(spec["title"])
+    ax.legend()
+    ax.grid()
+    fig.tight_layout()
+    fig.savefig(spec["filename"], dpi=150)
+    plt.close(fig)
+    return spec["filename"]
+
+
+def read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    # via a temp file so an interrupted run never leaves a half-written file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1, default=str)
+    os.replace(tmp, path)
+
+
+def save_series(specs, path=SERIES_FILE):
+    write_json(path, specs)
+
+
+def render_plots(specs, workers=None, hashes_file=HASHES_FILE, force=False):
+    """Render the specs whose data changed, in a process pool. Returns the filenames drawn."""
+    hashes = read_json(hashes_file, {})
+    todo = []
+    for spec in specs:
+        h = spec_hash(spec)
+        if not force and hashes.get(spec["filename"]) == h and os.path.exists(spec["filename"]):
+            logger.info(f"Plot up to date: {spec['filename']}")
+            print(f"Plot up to date: {spec['filename']}")
+            continue
+        todo.append((spec, h))
+    if not todo:
+        return []
+
+    if len(todo) == 1:
+        rendered = [render(todo[0][0])]
+    else:
+        workers = min(workers or os.cpu_count() or 1, len(todo))
+        # spawn, not fork: the caller may hold an open DuckDB connection and run us from
+        # a worker thread (pipeline.py), and forking either can deadlock the child
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            rendered = list(pool.map(render, [spec for spec, _ in todo]))
+
+    for (spec, h), filename in zip(todo, rendered):
+        hashes[filename] = h
+        logger.info(f"Saved plot: {filename}")
+        print(f"Saved plot: {filename}")
+    write_json(hashes_file, hashes)
+    return rendered
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='plots.log'
+    )
+    parser = argparse.ArgumentParser(description="Render the figures described in analysis.py's series file")
+    parser.add_argument("series", nargs="?", default=SERIES_FILE, help="plot series JSON written by analysis.py")
+    parser.add_argument("--workers", type=int, default=None, help="rendering processes (default: CPUs)")
+    parser.add_argument("--force", action="store_true", help="redraw even when the data is unchanged")
+    args = parser.parse_args()
+    render_plots(read_json(args.series, []), args.workers, force=args.force)
@@ -0,0 +1,232 @@
+import argparse
+import duckdb
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+# Opt-in query profiling: with TLC_PROFILE=<trace.jsonl> set, connect() returns a
+# connection whose every query is timed and profiled by DuckDB, and a background
+# thread samples memory. Everything is appended to the trace as JSON lines:
+#   {"type": "query", ...}   one per statement, see ProfiledConnection.execute()
+#   {"type": "memory", ...}  RSS and duckdb_memory() every SAMPLE_SECONDS
+# python profiling.py summary <trace.jsonl> ranks the queries by time.
+PROFILE_PATH = os.environ.get("TLC_PROFILE")
+SAMPLE_SECONDS = 0.5
+
+
+def connect(database, read_only=False):
+    """duckdb.connect(), profiled when TLC_PROFILE is set."""
+    con = duckdb.connect(database=database, read_only=read_only)
+    if not PROFILE_PATH:
+        return con
+    trace = Trace(PROFILE_PATH)
+    trace.start_sampler(con)
+    return ProfiledConnection(con, trace)
+
+
+def normalize_sql(sql):
+    # literals and whitespace out, so repeated statements group together in the summary
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(\.\d+)?\b", "?", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def operators(node, out=None):
+    """Flatten a DuckDB JSON profile tree into [{operator, seconds, rows, rows_scanned}]."""
+    out = [] if out is None else out
+    for child in node.get("children", []):
+        out.append({
+            "operator": child.get("operator_name") or child.get("operator_type"),
+            "seconds": child.get("operator_timing", 0.0),
+            "rows": child.get("operator_cardinality", 0),
+            "rows_scanned": child.get("operator_rows_scanned", 0),
+        })
+        operators(child, out)
+    return out
+
+
+def rss_bytes():
+    # resident set size from /proc, 0 where that doesn't exist
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class Trace:
+    """Thread-safe JSONL writer plus the memory sampler thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.script = os.path.basename(sys.argv[0]) if sys.argv else ""
+        self.stop = threading.Event()
+        self.sampler = None
+
+    def write(self, record):
+        record = {"type": record.pop("type"), "ts": time.time(), "script": self.script, **record}
+        line = json.dumps(record, default=str)
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def start_sampler(self, con):
+        # a plain cursor of its own, so the samples aren't profiled as queries
+        cur = con.cursor()
+
+        def sample():
+            while not self.stop.wait(SAMPLE_SECONDS):
+                try:
+                    (duckdb_bytes,) = cur.execute(
+                        "SELECT COALESCE(SUM(memory_usage_bytes), 0) FROM duckdb_memory()"
+                    ).fetchone()
+                except duckdb.Error:
+                    break
+                self.write({"type": "memory", "rss_mb": round(rss_bytes() / 1024 ** 2, 1),
+                            "duckdb_mb": round(duckdb_bytes / 1024 ** 2, 1)})
+
+            cur.close()
+
+        self.sampler = threading.Thread(target=sample, daemon=True)
+        self.sampler.start()
+
+    def close(self):
+        # the sampler's cursor keeps the database open, it has to be gone before we return
+        self.stop.set()
+        self.sampler.join()
+
+
+class ProfiledConnection:
+    """Wraps a DuckDB connection or cursor; every execute() is profiled into the trace.
+
+    Anything else (fetchone, close, register, ...) is passed straight through.
+    """
+
+    def __init__(self, con, trace, owner=True):
+        self._con = con
+        self._trace = trace
+        self._owner = owner
+        fd, self._profile_file = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+        os.close(fd)
+        con.execute("PRAGMA enable_profiling='json'")
+        con.execute(f"PRAGMA profiling_output='{self._profile_file}'")
+        con.execute("SET profiling_mode='detailed'")
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _profiled(self, method, sql, *args):
+        # statements DuckDB doesn't profile (PRAGMA, SET) leave the file empty
+        open(self._profile_file, "w").close()
+        start = time.perf_counter()
+        error = None
+        try:
+            return method(sql, *args)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            profile = {}
+            if error is None:
+                try:
+                    with open(self._profile_file) as f:
+                        profile = json.load(f)
+                except (OSError, ValueError):
+                    profile = {}
+            normalized = normalize_sql(sql)
+            self._trace.write({
+                "type": "query",
+                "query_id": hashlib.sha1(normalized.encode()).hexdigest()[:12],
+                "sql": normalized[:2000],
+                "seconds": round(elapsed, 6),
+                "rows_scanned": profile.get("cumulative_rows_scanned"),
+                "rows_returned": profile.get("rows_returned"),
+                "cpu_seconds": profile.get("cpu_time"),
+                "peak_buffer_mb": round(profile.get("system_peak_buffer_memory", 0) / 1024 ** 2, 1),
+                "operators": operators(profile),
+                "error": error,
+                "profile": profile,
+            })
+
+    def execute(self, sql, *args):
+        self._profiled(self._con.execute, sql, *args)
+        return self
+
+    def executemany(self, sql, *args):
+        self._profiled(self._con.executemany, sql, *args)
+        return self
+
+    def sql(self, sql, *args):
+        # relations run lazily, only the bind time is seen here
+        return self._profiled(self._con.sql, sql, *args)
+
+    def cursor(self):
+        return ProfiledConnection(self._con.cursor(), self._trace, owner=False)
+
+    def close(self):
+        if self._owner:
+            self._trace.close()
+        self._con.close()
+        if os.path.exists(self._profile_file):
+            os.remove(self._profile_file)
+
+
+def summarize(path, top=20):
+    """Rank the traced queries by total time, and report peak memory."""
+    queries = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                   "rows_scanned": 0, "operators": defaultdict(float)})
+    peak_rss = peak_duckdb = 0.0
+    total = 0.0
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "memory":
+                peak_rss = max(peak_rss, record["rss_mb"])
+                peak_duckdb = max(peak_duckdb, record["duckdb_mb"])
+                continue
+            q = queries[record["query_id"]]
+            q["sql"] = record["sql"]
+            q["script"] = record["script"]
+            q["calls"] += 1
+            q["seconds"] += record["seconds"]
+            q["max_seconds"] = max(q["max_seconds"], record["seconds"])
+            q["rows_scanned"] += record.get("rows_scanned") or 0
+            for op in record.get("operators", []):
+                q["operators"][op["operator"]] += op["seconds"]
+            total += record["seconds"]
+
+    ranked = sorted(queries.values(), key=lambda q: q["seconds"], reverse=True)
+    print(f"{len(queries)} distinct queries, {sum(q['calls'] for q in ranked):,} calls, {total:.2f} s total")
+    print(f"peak RSS {peak_rss:,.0f} MB, peak duckdb_memory() {peak_duckdb:,.0f} MB")
+    for q in ranked[:top]:
+        share = 100 * q["seconds"] / total if total else 0
+        hottest = max(q["operators"].items(), key=lambda kv: kv[1], default=("-", 0.0))
+        print(f"\n{q['seconds']:9.3f} s {share:5.1f}%  {q['calls']:>5} calls  max {q['max_seconds']:.3f} s  "
+              f"{q['rows_scanned']:,} rows scanned  [{q['script']}]")
+        print(f"           hottest operator: {hottest[0]} ({hottest[1]:.3f} s)")
+        print(f"           {q['sql'][:160]}")
+    return ranked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a TLC_PROFILE query trace")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="rank traced queries by total time")
+    summary.add_argument("trace", help="JSONL trace written with TLC_PROFILE=<path>")
+    summary.add_argument("--top", type=int, default=20, help="number of queries to show")
+    args = parser.parse_args()
+    summarize(args.trace, args.top)
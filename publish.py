@@ -0,0 +1,142 @@
+import argparse
+import logging
+import os
+import time
+
+from profiling import connect
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from taxi_config import TAXI_TYPES, create_trips_view
+
+logger = logging.getLogger(__name__)
+
+# Readers never open the working database: DuckDB's file lock would keep them
+# out for a whole load. publish() copies the transformed and aggregate tables
+# into a new, never modified, snapshot file snapshots/emissions-<version>.duckdb
+# and then switches the CURRENT pointer file to it with an atomic rename.
+# Readers resolve CURRENT when they connect and open that snapshot read-only, so
+# any number of them run next to the loader. Old snapshots are pruned; a reader
+# still holding one keeps reading it (the file is only unlinked).
+SNAPSHOT_DIR = os.environ.get("TLC_SNAPSHOT_DIR", "snapshots")
+CURRENT_FILE = "CURRENT"
+KEEP_SNAPSHOTS = 3
+WORKING_DATABASE = "emissions.duckdb"
+PUBLISHED_TABLES = [f"{t}_transformed" for t in TAXI_TYPES] + [
+    "vehicle_emissions", "emissions_cube", "emissions_cube_sources", "emissions_scenarios", "emissions_sample",
+    "emissions_sample_info", "trips_hourly", "trips_daily", "table_versions",
+]
+
+
+def current_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Path of the published snapshot CURRENT points to, None before the first publish."""
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE)) as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(snapshot_dir, name)
+    return path if name and os.path.exists(path) else None
+
+
+def reader_database(database=None, snapshot_dir=SNAPSHOT_DIR):
+    # what a read-only consumer should open: the given file, else the current snapshot, else the working database
+    return database or current_snapshot(snapshot_dir) or WORKING_DATABASE
+
+
+def connect_reader(database=None, snapshot_dir=SNAPSHOT_DIR):
+    return connect(reader_database(database, snapshot_dir), read_only=True)
+
+
+def existing_tables(con):
+    return {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables() WHERE schema_name = 'main'").fetchall()}
+
+
+def publish(con, snapshot_dir=SNAPSHOT_DIR, tables=None, keep=KEEP_SNAPSHOTS):
+    """Copy tables (PUBLISHED_TABLES that exist by default) into a new snapshot and make it current.
+
+    The snapshot also gets the unified trips view over its transformed tables.
+    Returns the snapshot's path.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    present = existing_tables(con)
+    tables = [t for t in (tables or PUBLISHED_TABLES) if t in present]
+    if not tables:
+        raise ValueError("nothing to publish, run transform.py and rollup.py first")
+
+    version = time.strftime("%Y%m%dT%H%M%S")
+    name = f"emissions-{version}.duckdb"
+    suffix = 1
+    while os.path.exists(os.path.join(snapshot_dir, name)):
+        suffix += 1
+        name = f"emissions-{version}-{suffix}.duckdb"
+    path = os.path.join(snapshot_dir, name)
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    # written under a temp name, a reader can never see a half-copied snapshot
+    con.execute(f"ATTACH '{tmp}' AS snapshot")
+    try:
+        for table in tables:
+            con.execute(f"CREATE TABLE snapshot.main.{table} AS SELECT * FROM main.{table}")
+            logger.info(f"Published {table}")
+    finally:
+        con.execute("DETACH snapshot")
+
+    snap = connect(tmp)
+    try:
+        transformed = {t: f"{t}_transformed" for t in TAXI_TYPES if f"{t}_transformed" in tables}
+        if len(transformed) == len(TAXI_TYPES):
+            create_trips_view(snap, "trips", transformed)
+        snap.execute("CHECKPOINT")
+    finally:
+        snap.close()
+    os.replace(tmp, path)
+
+    pointer = os.path.join(snapshot_dir, CURRENT_FILE)
+    with open(f"{pointer}.tmp", "w") as f:
+        f.write(name + "\n")
+    os.replace(f"{pointer}.tmp", pointer)
+    logger.info(f"Published snapshot {path} ({len(tables)} tables)")
+    print(f"Published snapshot {path} ({len(tables)} tables)")
+    prune(snapshot_dir, keep)
+    return path
+
+
+def prune(snapshot_dir=SNAPSHOT_DIR, keep=KEEP_SNAPSHOTS):
+    # drop all but the newest keep snapshots, never the current one
+    current = current_snapshot(snapshot_dir)
+    snapshots = sorted(
+        (e.path for e in os.scandir(snapshot_dir) if e.name.startswith("emissions-") and e.name.endswith(".duckdb")),
+        key=os.path.getmtime, reverse=True,
+    )
+    for path in snapshots[keep:]:
+        if current and os.path.samefile(path, current):
+            continue
+        os.remove(path)
+        logger.info(f"Removed old snapshot {path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='publish.log'
+    )
+    parser = argparse.ArgumentParser(description="Publish the transformed and aggregate tables as a read-only snapshot")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="where snapshots and the CURRENT pointer live")
+    parser.add_argument("--keep", type=int, default=KEEP_SNAPSHOTS, help="snapshots to keep")
+    parser.add_argument("--tables", nargs="*", default=None, help="tables to publish (default: all published tables)")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    con = None
+    try:
+        con = connect(WORKING_DATABASE)
+        logger.info("Connected to emissions database")
+        apply_resources(con, "publish", **resource_overrides(args))
+        publish(con, args.snapshot_dir, args.tables, args.keep)
+    except Exception as e:
+        logger.error(f"Error publishing snapshot: {e}")
+        print(f"Error publishing snapshot: {e}")
+    finally:
+        if con is not None:
+            con.close()
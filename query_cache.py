@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+
+logger = logging.getLogger(__name__)
+
+# On-disk cache of query results. An entry's key is the normalized SQL, its
+# parameters and the version of every table it reads, so a table that changed
+# simply misses (the stale entry ages out), and a hit is always exact. Tables
+# the pipeline rebuilds (transformed trips, emissions_cube) get a new random
+# version in table_versions from their writer on every rebuild or in-place
+# change; other tables are versioned by a hash of their contents when they are
+# small enough, and not cached at all otherwise. A view's version is that of
+# the tables it reads.
+CACHE_DIR = os.environ.get("TLC_QUERY_CACHE", ".query_cache")
+MAX_ENTRIES = 1000
+
+# unversioned tables up to this many rows are keyed on a content hash, larger ones aren't cached
+SMALL_TABLE_ROWS = 100_000
+
+
+def normalize_sql(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def ensure_table_versions(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name VARCHAR PRIMARY KEY,
+            version UUID,
+            built_at TIMESTAMP
+        )
+    """)
+
+
+def bump_table_version(con, *tables):
+    # writers call this after rebuilding or changing a table, cached results of it then miss
+    ensure_table_versions(con)
+    for table in tables:
+        con.execute("INSERT OR REPLACE INTO table_versions VALUES (?, gen_random_uuid(), current_timestamp)",
+                    [table])
+
+
+def table_version(con, table):
+    if not con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'table_versions'").fetchone()[0]:
+        return None
+    row = con.execute("SELECT version FROM table_versions WHERE table_name = ?", [table]).fetchone()
+    return str(row[0]) if row else None
+
+
+def view_tables(con, view):
+    # the tables and views a view reads, None when it also reads files
+    (sql,) = con.execute("SELECT sql FROM duckdb_views() WHERE view_name = ?", [view]).fetchone()
+    if re.search(r"\bread_\w+\s*\(", sql, re.IGNORECASE):
+        return None
+    relations = [row[0] for row in con.execute("""
+        SELECT table_name FROM duckdb_tables()
+        UNION SELECT view_name FROM duckdb_views() WHERE NOT internal AND view_name <> ?
+    """, [view]).fetchall()]
+    return sorted(r for r in relations if re.search(rf"\b{re.escape(r)}\b", sql))
+
+
+def table_snapshot(con, table):
+    """Version of table for cache keys, None when it can't be told exactly (see the module comment)."""
+    if con.execute("SELECT COUNT(*) FROM duckdb_views() WHERE view_name = ?", [table]).fetchone()[0]:
+        bases = view_tables(con, table)
+        if not bases:
+            return None
+        versions = [table_snapshot(con, base) for base in bases]
+        return None if None in versions else [table, versions]
+    if not con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [table]).fetchone()[0]:
+        return None
+    version = table_version(con, table)
+    if version:
+        return [table, version]
+    (rows,) = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+    if rows > SMALL_TABLE_ROWS:
+        return None
+    return [table, rows, con.execute(f"SELECT SUM(CAST(hash(t) AS HUGEINT)) FROM {table} t").fetchone()[0]]
+
+
+class QueryCache:
+    """fetchall() through a bounded on-disk cache, see the module comment.
+
+    Least recently used entries are evicted above max_entries.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.snapshots = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def snapshot(self, con, tables):
+        """Versions of tables, None when one of them can't be versioned exactly.
+
+        Remembered per table until forget() is called, a run asks for the same tables many times.
+        """
+        for table in tables:
+            if table not in self.snapshots:
+                self.snapshots[table] = table_snapshot(con, table)
+        snapshot = [self.snapshots[table] for table in tables]
+        return None if None in snapshot else snapshot
+
+    def forget(self, *tables):
+        # call after writing to a table in the same run, its snapshot is re-read on next use
+        for table in tables or list(self.snapshots):
+            self.snapshots.pop(table, None)
+
+    def key(self, sql, params, snapshot, fetch="fetchall"):
+        text = repr((normalize_sql(sql), list(params), snapshot, fetch))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def fetchall(self, con, sql, params=(), tables=()):
+        """con.execute(sql, params).fetchall(), answered from the cache when tables are unchanged."""
+        return self.fetch(con, sql, params, tables, "fetchall")
+
+    def to_arrow_table(self, con, sql, params=(), tables=()):
+        # as fetchall(), the result as a pyarrow.Table
+        return self.fetch(con, sql, params, tables, "to_arrow_table")
+
+    def fetch(self, con, sql, params, tables, fetch):
+        snapshot = self.snapshot(con, tables)
+        if snapshot is None:
+            # no exact version of a table, always ask the database
+            self.uncached += 1
+            return getattr(con.execute(sql, list(params)), fetch)()
+        key = self.key(sql, params, snapshot, fetch)
+        path = os.path.join(self.cache_dir, f"{key}.pkl")
+        try:
+            with open(path, "rb") as f:
+                rows = pickle.load(f)
+            os.utime(path)
+            self.hits += 1
+            return rows
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        rows = getattr(con.execute(sql, list(params)), fetch)()
+        self.misses += 1
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(rows, f)
+        os.replace(tmp, path)
+        self._evict()
+        return rows
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".pkl")]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[: len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        logger.info(f"Evicted {len(entries) - self.max_entries} query cache entries")
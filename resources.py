@@ -0,0 +1,136 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Per-stage DuckDB resource budgets, sized from what the process may actually use
+# (cgroup CPU/memory limits included), instead of a fixed memory_limit='4GB'.
+#   memory: fraction of the available memory given to DuckDB
+#   preserve_insertion_order: off for bulk stages, lets DuckDB stream and spill more freely
+STAGE_PROFILES = {
+    "load": {"memory": 0.5, "preserve_insertion_order": False},
+    "clean": {"memory": 0.75, "preserve_insertion_order": False},
+    "transform": {"memory": 0.75, "preserve_insertion_order": False},
+    "rollup": {"memory": 0.75, "preserve_insertion_order": False},
+    "scenarios": {"memory": 0.75, "preserve_insertion_order": False},
+    "analysis": {"memory": 0.5, "preserve_insertion_order": True},
+    "pipeline": {"memory": 0.75, "preserve_insertion_order": False},
+    "publish": {"memory": 0.5, "preserve_insertion_order": True},
+}
+
+# environment overrides, the CLI flags added by add_resource_arguments() win over these
+THREADS_ENV = "TLC_THREADS"
+MEMORY_ENV = "TLC_MEMORY_LIMIT"
+TEMP_DIR_ENV = "TLC_TEMP_DIR"
+DEFAULT_TEMP_DIR = "emissions.duckdb.tmp"
+
+
+def read_first(*paths):
+    # first readable file's stripped content, None if none exists
+    for path in paths:
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def detect_cpus():
+    """CPUs this process may use: affinity mask, capped by a cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    # cgroup v2: "max 100000" or "<quota> <period>"
+    cpu_max = read_first("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            cpus = min(cpus, max(int(int(quota) / int(period)), 1))
+    else:
+        # cgroup v1, quota -1 means unlimited
+        quota = read_first("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us")
+        period = read_first("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us")
+        if quota and period and int(quota) > 0:
+            cpus = min(cpus, max(int(int(quota) / int(period)), 1))
+    return cpus
+
+
+def detect_memory():
+    """Bytes of memory this process may use: physical memory, capped by a cgroup limit."""
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        memory = 4 * 1024 ** 3
+    limit = read_first("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    # "max" (v2) or a huge sentinel (v1) when there is no limit
+    if limit and limit.isdigit():
+        memory = min(memory, int(limit))
+    return memory
+
+
+def parse_size(text):
+    """'6GB', '512MB', '2.5GiB' or plain bytes to bytes."""
+    units = {"TB": 1000 ** 4, "GB": 1000 ** 3, "MB": 1000 ** 2, "KB": 1000,
+             "TIB": 1024 ** 4, "GIB": 1024 ** 3, "MIB": 1024 ** 2, "KIB": 1024, "B": 1}
+    text = text.strip().upper().replace(" ", "")
+    for unit in sorted(units, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[: -len(unit)]) * units[unit])
+    return int(text)
+
+
+def stage_resources(stage, threads=None, memory_limit=None, temp_directory=None):
+    """Settings for stage: {threads, memory_limit (bytes), temp_directory, preserve_insertion_order}.
+
+    Explicit arguments win, then the TLC_THREADS / TLC_MEMORY_LIMIT / TLC_TEMP_DIR
+    environment variables, then the stage profile applied to the detected limits.
+    """
+    profile = STAGE_PROFILES[stage]
+    threads = threads or os.environ.get(THREADS_ENV) or detect_cpus()
+    memory_limit = memory_limit or os.environ.get(MEMORY_ENV)
+    if memory_limit:
+        memory = parse_size(str(memory_limit))
+    else:
+        memory = int(detect_memory() * profile["memory"])
+    return {
+        "threads": int(threads),
+        "memory_limit": memory,
+        "temp_directory": temp_directory or os.environ.get(TEMP_DIR_ENV) or DEFAULT_TEMP_DIR,
+        "preserve_insertion_order": profile["preserve_insertion_order"],
+    }
+
+
+def apply_resources(con, stage, threads=None, memory_limit=None, temp_directory=None):
+    """Size the DuckDB instance behind con for stage, returns the settings applied.
+
+    Anything over memory_limit spills to temp_directory. These are instance-wide
+    settings, every cursor of con shares them.
+    """
+    settings = stage_resources(stage, threads, memory_limit, temp_directory)
+    con.execute(f"SET threads = {settings['threads']}")
+    con.execute(f"SET memory_limit = '{settings['memory_limit'] // 1024 ** 2}MB'")
+    con.execute(f"SET temp_directory = '{settings['temp_directory']}'")
+    con.execute(f"SET preserve_insertion_order = {str(settings['preserve_insertion_order']).lower()}")
+    logger.info(
+        f"Resources for {stage}: {settings['threads']} threads, "
+        f"{settings['memory_limit'] / 1024 ** 3:.1f} GiB memory, temp {settings['temp_directory']}, "
+        f"preserve_insertion_order={settings['preserve_insertion_order']}"
+    )
+    return settings
+
+
+def add_resource_arguments(parser):
+    # --threads / --memory-limit / --temp-dir for a stage's CLI
+    parser.add_argument("--threads", type=int, default=None,
+                        help=f"DuckDB threads (default: usable CPUs, or ${THREADS_ENV})")
+    parser.add_argument("--memory-limit", default=None,
+                        help=f"DuckDB memory limit such as 6GB (default: stage share of usable memory, or ${MEMORY_ENV})")
+    parser.add_argument("--temp-dir", default=None,
+                        help=f"DuckDB spill directory (default: {DEFAULT_TEMP_DIR}, or ${TEMP_DIR_ENV})")
+
+
+def resource_overrides(args):
+    # the add_resource_arguments() values as apply_resources() keyword arguments
+    return {"threads": args.threads, "memory_limit": args.memory_limit, "temp_directory": args.temp_dir}
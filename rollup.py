@@ -0,0 +1,217 @@
+import argparse
+import logging
+import os
+
+from profiling import connect
+from query_cache import bump_table_version, table_version
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from taxi_config import TAXI_TYPES, ensure_taxi_type_enum, trips_select
+
+logger = logging.getLogger(__name__)
+
+# cube grains and the transformed column each one groups by
+CUBE_GRAINS = {
+    "hour": "hour_of_day",
+    "dow": "day_of_week",
+    "week": "week_of_year",
+    "month": "month_of_year",
+}
+
+# tables the cube is built from; transform.py and the dbt models bump their
+# table_versions entry on every build, the cube records the versions it saw
+CUBE_SOURCES = [f"{t}_transformed" for t in TAXI_TYPES]
+
+
+def cube_select(source, where=""):
+    """One grouped scan of the unified trips relation producing every cube row.
+
+    Each row is (taxi_type, grain, year, bucket) with the SUM/COUNT/MAX of
+    trip_co2_kgs. bucket holds the hour/dow/week/month value named by grain.
+    Yearly figures are the sum of a year's month rows.
+    """
+    # grouped by expression, the parquet source has its own year partition column
+    year = "CAST(EXTRACT(year FROM pickup_ts) AS INTEGER)"
+    grain = "CASE " + " ".join(
+        f"WHEN GROUPING({column}) = 0 THEN '{name}'" for name, column in CUBE_GRAINS.items()
+    ) + " END"
+    bucket = "COALESCE(" + ", ".join(CUBE_GRAINS.values()) + ")"
+    sets = ", ".join(f"(taxi_type, {year}, {column})" for column in CUBE_GRAINS.values())
+    return f"""
+        SELECT
+            CAST(taxi_type AS VARCHAR) AS taxi_type,
+            {grain} AS grain,
+            {year} AS year,
+            {bucket} AS bucket,
+            SUM(trip_co2_kgs) AS co2_sum,
+            COUNT(trip_co2_kgs) AS co2_count,
+            MAX(trip_co2_kgs) AS co2_max,
+            COUNT(*) AS trip_count
+        FROM {source}
+        {where}
+        GROUP BY GROUPING SETS ({sets})
+    """
+
+
+def parquet_glob(parquet_dir, taxi_type):
+    # files of one taxi type in the taxi_type=/year=/month= layout written by transform.py
+    return os.path.join(parquet_dir, f"taxi_type={taxi_type}", "*", "*", "*.parquet")
+
+
+def transformed_source(taxi_type, parquet_dir=None):
+    """Relation holding the transformed trips of one taxi type.
+
+    With parquet_dir it reads the hive-partitioned files written by transform.py
+    (year and month come from the directory names, taxi_type is dropped as the
+    trips view adds its own).
+    """
+    if parquet_dir:
+        glob = parquet_glob(os.path.abspath(parquet_dir), taxi_type)
+        return f"(SELECT * EXCLUDE (taxi_type) FROM read_parquet('{glob}', hive_partitioning=true))"
+    return f"{taxi_type}_transformed"
+
+
+def years_predicate(years, parquet_dir=None):
+    # parquet: filter on the year= partition so other years' files are never opened
+    if parquet_dir:
+        return f"year IN ({', '.join(str(int(y)) for y in years)})"
+    return " OR ".join(
+        f"(pickup_ts >= TIMESTAMP '{int(y)}-01-01' AND pickup_ts < TIMESTAMP '{int(y) + 1}-01-01')"
+        for y in years
+    )
+
+
+def build_cube(con, parquet_dir=None, years=None):
+    """(Re)build emissions_cube with one grouped scan over every taxi type.
+
+    years limits the rebuild to those years' cube rows, so with the parquet
+    output only those partitions are read. Only a full build records the source
+    versions in emissions_cube_sources, a cube refreshed for some years still
+    counts as stale against sources that changed since.
+    """
+    ensure_taxi_type_enum(con)
+    if years and not cube_exists(con):
+        # nothing to refresh in place, build every year
+        years = None
+    source = "(" + trips_select({t: transformed_source(t, parquet_dir) for t in TAXI_TYPES}) + ")"
+    where = f"WHERE {years_predicate(years, parquet_dir)}" if years else ""
+    cube = cube_select(source, where)
+    if years:
+        year_list = ", ".join(str(int(y)) for y in years)
+        con.execute("BEGIN TRANSACTION")
+        con.execute(f"DELETE FROM emissions_cube WHERE year IN ({year_list})")
+        con.execute(f"INSERT INTO emissions_cube {cube}")
+        bump_table_version(con, "emissions_cube")
+        con.execute("COMMIT")
+    else:
+        versions = source_versions(con)
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(f"CREATE OR REPLACE TABLE emissions_cube AS {cube}")
+            con.execute("CREATE OR REPLACE TABLE emissions_cube_sources (table_name VARCHAR, version VARCHAR)")
+            con.executemany("INSERT INTO emissions_cube_sources VALUES (?, ?)", list(versions.items()))
+            bump_table_version(con, "emissions_cube")
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+    (rows,) = con.execute("SELECT COUNT(*) FROM emissions_cube").fetchone()
+    logger.info(f"Built emissions_cube ({rows:,} rows)")
+    print(f"Built emissions_cube ({rows:,} rows)")
+
+
+def cube_exists(con):
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'emissions_cube'"
+    ).fetchone()[0] > 0
+
+
+def source_versions(con):
+    # {source table: its table_versions entry, None when it has none}
+    return {table: table_version(con, table) for table in CUBE_SOURCES}
+
+
+def cube_is_current(con):
+    """True when emissions_cube exists and was fully built from the current source versions."""
+    if not cube_exists(con) or not con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'emissions_cube_sources'"
+    ).fetchone()[0]:
+        return False
+    recorded = dict(con.execute("SELECT table_name, version FROM emissions_cube_sources").fetchall())
+    return recorded == source_versions(con)
+
+
+def year_filter(year):
+    return "" if year is None else f"AND year = {int(year)}"
+
+
+def cube_query(con, sql, params, cache=None):
+    # rows of a query on emissions_cube, through a query_cache.QueryCache when given
+    if cache is None:
+        return con.execute(sql, params).fetchall()
+    return cache.fetchall(con, sql, params, tables=["emissions_cube"])
+
+
+def max_trip(con, taxi_type, year=None, cache=None):
+    # largest single-trip CO2, any grain covers every trip once
+    ((value,),) = cube_query(con, f"""
+        SELECT MAX(co2_max) FROM emissions_cube
+        WHERE taxi_type = ? AND grain = 'month' {year_filter(year)}
+    """, [taxi_type], cache)
+    return value
+
+
+def heavy_light(con, taxi_type, grain, year=None, cache=None):
+    """Most and least carbon heavy bucket of grain by average trip CO2.
+
+    Returns ((bucket, avg), (bucket, avg)) for heavy and light.
+    """
+    rows = cube_query(con, f"""
+        SELECT bucket, SUM(co2_sum) / SUM(co2_count) AS avg_kg
+        FROM emissions_cube
+        WHERE taxi_type = ? AND grain = ? {year_filter(year)}
+        GROUP BY bucket
+        HAVING SUM(co2_count) > 0
+        ORDER BY avg_kg DESC
+    """, [taxi_type, grain], cache)
+    if not rows:
+        return None, None
+    return rows[0], rows[-1]
+
+
+def totals(con, taxi_type, by, year=None, cache=None):
+    # total CO2 per month of year ('month') or per year ('year')
+    key = "bucket" if by == "month" else "year"
+    return cube_query(con, f"""
+        SELECT {key}, SUM(co2_sum) AS total_co2_kg
+        FROM emissions_cube
+        WHERE taxi_type = ? AND grain = 'month' {year_filter(year)}
+        GROUP BY {key}
+        ORDER BY {key}
+    """, [taxi_type], cache)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='rollup.log'
+    )
+    parser = argparse.ArgumentParser(description="Build the emissions_cube aggregate table")
+    parser.add_argument("--parquet-dir", default=None,
+                        help="read the hive-partitioned parquet output of transform.py instead of the tables")
+    parser.add_argument("--years", type=int, nargs="*", default=None,
+                        help="only rebuild these years of the cube")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    con = None
+    try:
+        con = connect('emissions.duckdb')
+        logger.info("Connected to emissions database")
+        apply_resources(con, "rollup", **resource_overrides(args))
+        build_cube(con, args.parquet_dir, args.years)
+    except Exception as e:
+        logger.error(f"Error building emissions_cube: {e}")
+        print(f"Error building emissions_cube: {e}")
+    finally:
+        if con is not None:
+            con.close()
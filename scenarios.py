@@ -0,0 +1,158 @@
+import argparse
+import logging
+
+from profiling import connect
+from resources import add_resource_arguments, apply_resources, resource_overrides
+
+logger = logging.getLogger(__name__)
+
+# trip CO2 is distance * grams per mile, so every scenario is a scale factor on the
+# same distance totals: one grouped scan, then a join against the (tiny) factor table
+
+
+def parse_mix(text):
+    """Parse a fleet mix given as 'name=profile:share,profile:share'.
+
+    Shares are weights, they are normalized to sum to 1. Returns (name, {profile: share}).
+    """
+    name, _, parts = text.partition("=")
+    if not name or not parts:
+        raise ValueError(f"fleet mix must look like name=profile:share,...: {text!r}")
+    mix = {}
+    for part in parts.split(","):
+        profile, _, share = part.partition(":")
+        mix[profile.strip()] = float(share) if share else 1.0
+    if any(share < 0 for share in mix.values()) or sum(mix.values()) <= 0:
+        raise ValueError(f"fleet mix {name!r} needs non-negative shares with a positive total")
+    return name.strip(), mix
+
+
+def load_fleet_mixes(con, mixes):
+    """Put the fleet mixes ({name: {profile: share}}) in a temp table fleet_mixes."""
+    profiles = {row[0] for row in con.execute("SELECT vehicle_type FROM vehicle_emissions").fetchall()}
+    con.execute("CREATE OR REPLACE TEMP TABLE fleet_mixes (scenario VARCHAR, vehicle_type VARCHAR, share DOUBLE)")
+    for name, mix in mixes.items():
+        unknown = set(mix) - profiles
+        if unknown:
+            raise ValueError(f"fleet mix {name!r} uses unknown profiles: {', '.join(sorted(unknown))}")
+        con.executemany(
+            "INSERT INTO fleet_mixes VALUES (?, ?, ?)",
+            [(name, profile, share) for profile, share in mix.items()],
+        )
+
+
+def scenario_factors():
+    """SQL for (scenario, taxi_type, gpm): the grams per mile each scenario applies.
+
+    'actual' uses every feed's own <taxi_type>_taxi profile, each vehicle_emissions
+    profile applies to all feeds, and a fleet mix applies its share-weighted average.
+    taxi_type NULL means the factor holds for every feed.
+    """
+    return """
+        SELECT 'actual' AS scenario, replace(vehicle_type, '_taxi', '') AS taxi_type,
+            co2_grams_per_mile AS gpm
+        FROM vehicle_emissions
+        WHERE vehicle_type LIKE '%\\_taxi' ESCAPE '\\'
+        UNION ALL
+        SELECT vehicle_type, NULL, co2_grams_per_mile
+        FROM vehicle_emissions
+        UNION ALL
+        SELECT m.scenario, NULL, SUM(m.share * v.co2_grams_per_mile) / SUM(m.share)
+        FROM fleet_mixes m
+        JOIN vehicle_emissions v USING (vehicle_type)
+        GROUP BY m.scenario
+    """
+
+
+def build_scenarios(con, mixes=None, source="trips_clean"):
+    """(Re)build emissions_scenarios: CO2 per scenario, taxi type, year and month.
+
+    source is any relation with taxi_type, pickup_ts and trip_distance (the trips
+    or trips_clean view). It is scanned once whatever the number of scenarios.
+    """
+    load_fleet_mixes(con, mixes or {})
+    con.execute(f"""
+        CREATE OR REPLACE TABLE emissions_scenarios AS
+        WITH distance AS (
+            SELECT
+                CAST(taxi_type AS VARCHAR) AS taxi_type,
+                CAST(EXTRACT(year FROM pickup_ts) AS INTEGER) AS year,
+                CAST(EXTRACT(month FROM pickup_ts) AS INTEGER) AS month,
+                COUNT(*) AS trips,
+                SUM(trip_distance) AS miles,
+                MAX(trip_distance) AS max_miles
+            FROM {source}
+            GROUP BY ALL
+        ),
+        factors AS ({scenario_factors()})
+        SELECT
+            f.scenario,
+            d.taxi_type,
+            d.year,
+            d.month,
+            d.trips,
+            d.miles,
+            f.gpm,
+            d.miles * f.gpm / 1000.0 AS co2_kgs,
+            d.max_miles * f.gpm / 1000.0 AS max_trip_co2_kgs
+        FROM distance d
+        JOIN factors f ON f.taxi_type IS NULL OR f.taxi_type = d.taxi_type
+    """)
+    (rows,) = con.execute("SELECT COUNT(*) FROM emissions_scenarios").fetchone()
+    logger.info(f"Built emissions_scenarios ({rows:,} rows)")
+    print(f"Built emissions_scenarios ({rows:,} rows)")
+
+
+def scenario_totals(con, year=None):
+    """Total CO2 per scenario and taxi type with the change against 'actual'.
+
+    Returns rows of (scenario, taxi_type, co2_kgs, pct_vs_actual).
+    """
+    where = "" if year is None else f"WHERE year = {int(year)}"
+    return con.execute(f"""
+        WITH totals AS (
+            SELECT scenario, taxi_type, SUM(co2_kgs) AS co2_kgs
+            FROM emissions_scenarios
+            {where}
+            GROUP BY ALL
+        )
+        SELECT t.scenario, t.taxi_type, t.co2_kgs,
+            100.0 * (t.co2_kgs - a.co2_kgs) / a.co2_kgs AS pct_vs_actual
+        FROM totals t
+        JOIN totals a ON a.scenario = 'actual' AND a.taxi_type = t.taxi_type
+        ORDER BY t.taxi_type, t.co2_kgs
+    """).fetchall()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='scenarios.log'
+    )
+    parser = argparse.ArgumentParser(
+        description="CO2 for every vehicle_emissions profile and fleet mix from one scan of the trips"
+    )
+    parser.add_argument("--mix", action="append", default=[],
+                        help="fleet mix as name=profile:share,... e.g. half_hybrid=yellow_taxi:1,via:1")
+    parser.add_argument("--source", default="trips_clean",
+                        help="unified trips relation to scan (trips_clean or trips)")
+    parser.add_argument("--year", type=int, default=None, help="report totals for one year only")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    con = None
+    try:
+        mixes = dict(parse_mix(text) for text in args.mix)
+        con = connect('emissions.duckdb')
+        logger.info("Connected to emissions database")
+        apply_resources(con, "scenarios", **resource_overrides(args))
+        build_scenarios(con, mixes, args.source)
+        for scenario, taxi_type, co2_kgs, pct in scenario_totals(con, args.year):
+            print(f"{taxi_type.upper()} {scenario}: {co2_kgs:,.3f} kg ({pct:+.1f}% vs actual)")
+            logger.info(f"{taxi_type.upper()} {scenario}: {co2_kgs:,.3f} kg ({pct:+.1f}% vs actual)")
+    except Exception as e:
+        logger.error(f"Error building emissions scenarios: {e}")
+        print(f"Error building emissions scenarios: {e}")
+    finally:
+        if con is not None:
+            con.close()
@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from emissions_api import emissions_table
+from profiling import connect
+from publish import reader_database
+from resources import apply_resources, detect_cpus
+from rollup import CUBE_GRAINS
+from taxi_config import CLEAN_END_YEAR, CLEAN_START_YEAR, TAXI_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Local HTTP/JSON service over the published emissions aggregates, for
+# dashboards that used to run analysis.py and scrape its output:
+#   GET /max?taxi_type=yellow&year_from=2020&year_to=2024
+#   GET /heavy_light?grain=hour&year_from=2024
+#   GET /totals?by=month&taxi_type=yellow,green&year_to=2019
+#   GET /health
+# One asyncio loop takes the connections; queries run on a thread pool, each on
+# a read-only cursor borrowed from a pool. Identical requests in flight share
+# one query and answers are kept in an LRU cache keyed by the snapshot they came
+# from, so a newly published snapshot is picked up without serving stale data.
+HOST = "127.0.0.1"
+PORT = 8765
+WORKERS = 4
+CACHE_SIZE = 1024
+REFRESH_SECONDS = 5.0
+
+
+class CursorPool:
+    """Read-only cursors of one database, borrowed by the worker threads."""
+
+    def __init__(self, database, size):
+        self.database = database
+        self.con = connect(database, read_only=True)
+        apply_resources(self.con, "analysis")
+        self.cursors = queue.Queue()
+        for _ in range(size):
+            self.cursors.put(self.con.cursor())
+        self.size = size
+        self.borrowed = 0
+        self.retired = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def borrow(self):
+        # counted when a query is queued, not when a worker starts it, so retire() waits for queued ones too
+        with self.lock:
+            if self.closed:
+                raise RuntimeError(f"cursor pool of {self.database} is closed")
+            self.borrowed += 1
+
+    def release(self):
+        with self.lock:
+            self.borrowed -= 1
+            done = self.retired and self.borrowed == 0 and not self.closed
+            self.closed = self.closed or done
+        if done:
+            self.close()
+
+    def run(self, fn, *args):
+        """fn(cursor, *args) on a free cursor. The caller has borrow()ed, released here either way."""
+        try:
+            if self.closed:
+                raise RuntimeError(f"cursor pool of {self.database} is closed")
+            cur = self.cursors.get()
+            try:
+                return fn(cur, *args)
+            finally:
+                self.cursors.put(cur)
+        finally:
+            self.release()
+
+    def retire(self):
+        # no new queries come here; closed once the borrowed ones have returned
+        with self.lock:
+            self.retired = True
+            done = self.borrowed == 0 and not self.closed
+            self.closed = self.closed or done
+        if done:
+            self.close()
+
+    def close(self):
+        # only reached with nothing borrowed, every cursor is back in the queue
+        while not self.cursors.empty():
+            self.cursors.get().close()
+        self.con.close()
+
+
+def year_filter(params):
+    # year_from / year_to (inclusive, either may be left out) as an emissions_api range filter
+    years = {}
+    if "year_from" in params or "year_to" in params:
+        start = int(params.get("year_from", CLEAN_START_YEAR))
+        end = int(params.get("year_to", CLEAN_END_YEAR))
+        for year in (start, end):
+            # cleaning keeps only these years, anything else can't match a trip
+            if not CLEAN_START_YEAR <= year <= CLEAN_END_YEAR:
+                raise ValueError(f"years must be within {CLEAN_START_YEAR}-{CLEAN_END_YEAR}, got {year}")
+        if start > end:
+            raise ValueError("year_from is after year_to")
+        years["year"] = range(start, end + 1)
+    return years
+
+
+def taxi_types(params):
+    if "taxi_type" not in params:
+        return list(TAXI_TYPES)
+    types = [t for t in params["taxi_type"].split(",") if t]
+    unknown = set(types) - set(TAXI_TYPES)
+    if unknown:
+        raise ValueError(f"unknown taxi types: {', '.join(sorted(unknown))}")
+    return types
+
+
+def max_trip(cur, params):
+    table = emissions_table(cur, ["taxi_type"], year_filter(params), taxi_types(params))
+    return [{"taxi_type": r["taxi_type"], "max_co2_kgs": r["max_co2_kgs"]} for r in table.to_pylist()]
+
+
+def heavy_light(cur, params):
+    grain = params.get("grain", "hour")
+    if grain not in CUBE_GRAINS:
+        raise ValueError(f"grain must be one of {', '.join(CUBE_GRAINS)}")
+    table = emissions_table(cur, ["taxi_type", grain], year_filter(params), taxi_types(params))
+    by_type = {}
+    for row in table.to_pylist():
+        if row["avg_co2_kgs"] is not None:
+            by_type.setdefault(row["taxi_type"], []).append(row)
+    result = []
+    for taxi_type, rows in by_type.items():
+        heavy = max(rows, key=lambda r: r["avg_co2_kgs"])
+        light = min(rows, key=lambda r: r["avg_co2_kgs"])
+        result.append({
+            "taxi_type": taxi_type, "grain": grain,
+            "heavy": {"bucket": heavy[grain], "avg_co2_kgs": heavy["avg_co2_kgs"]},
+            "light": {"bucket": light[grain], "avg_co2_kgs": light["avg_co2_kgs"]},
+        })
+    return result
+
+
+def totals(cur, params):
+    by = params.get("by", "year")
+    if by not in ["year"] + list(CUBE_GRAINS):
+        raise ValueError(f"by must be year or one of {', '.join(CUBE_GRAINS)}")
+    table = emissions_table(cur, ["taxi_type", by], year_filter(params), taxi_types(params))
+    return table.select(["taxi_type", by, "trips", "co2_kgs"]).to_pylist()
+
+
+ENDPOINTS = {"/max": max_trip, "/heavy_light": heavy_light, "/totals": totals}
+
+
+class EmissionsService:
+    """Request handling: snapshot tracking, in-flight coalescing and the LRU cache."""
+
+    def __init__(self, database=None, workers=WORKERS, cache_size=CACHE_SIZE):
+        self.fixed_database = database
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.pool = CursorPool(reader_database(database), workers)
+        self.checked = time.monotonic()
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.inflight = {}
+        self.stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "queries": 0}
+
+    def refresh(self):
+        # every REFRESH_SECONDS, follow the CURRENT pointer to a newly published snapshot
+        if self.fixed_database or time.monotonic() - self.checked < REFRESH_SECONDS:
+            return
+        self.checked = time.monotonic()
+        database = reader_database()
+        if database != self.pool.database:
+            old, self.pool = self.pool, CursorPool(database, self.workers)
+            old.retire()
+            logger.info(f"Switched to snapshot {database}")
+
+    async def query(self, path, params):
+        """JSON-ready result of one endpoint, from the cache, a running query or a new one."""
+        self.stats["requests"] += 1
+        self.refresh()
+        pool = self.pool
+        key = (pool.database, path, tuple(sorted(params.items())))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+            return self.cache[key]
+        if key in self.inflight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self.inflight[key])
+
+        pool.borrow()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, pool.run, ENDPOINTS[path], params)
+        except Exception:
+            pool.release()
+            raise
+        self.inflight[key] = future
+        self.stats["queries"] += 1
+        try:
+            result = await future
+        finally:
+            del self.inflight[key]
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    async def respond(self, method, target):
+        # (status, body object) for one request
+        if method != "GET":
+            return 405, {"error": "only GET is supported"}
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, {"database": self.pool.database, **self.stats}
+        if url.path not in ENDPOINTS:
+            return 404, {"error": f"unknown endpoint {url.path}", "endpoints": sorted(ENDPOINTS)}
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            # bad year ranges are answered here, without taking a query worker
+            year_filter(params)
+            return 200, await self.query(url.path, params)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            logger.error(f"Error serving {target}: {e}")
+            return 500, {"error": str(e)}
+
+    async def handle(self, reader, writer):
+        # minimal HTTP/1.1 with keep-alive, one request at a time per connection
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                status, body = await self.respond(method, target)
+                data = json.dumps(body, default=str).encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.retire()
+
+
+async def serve(host=HOST, port=PORT, database=None, workers=WORKERS, cache_size=CACHE_SIZE):
+    service = EmissionsService(database, workers, cache_size)
+    server = await asyncio.start_server(service.handle, host, port)
+    logger.info(f"Serving {service.pool.database} on http://{host}:{port} with {workers} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='service.log'
+    )
+    parser = argparse.ArgumentParser(description="Serve emissions metrics as JSON over HTTP on localhost")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--database", default=None, help="database to serve (default: follow the current snapshot)")
+    parser.add_argument("--workers", type=int, default=min(WORKERS, detect_cpus()),
+                        help="query threads and read-only cursors")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="responses kept in the LRU cache")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.database, args.workers, args.cache_size))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"Service error: {e}")
+        print(f"Service error: {e}")
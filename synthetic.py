@@ -0,0 +1,170 @@
+import argparse
+import duckdb
+import os
+
+# rows per monthly file at scale factor 1, green is roughly a tenth of yellow like the real feeds
+SCALE_ROWS = {"yellow": 100_000, "green": 10_000}
+
+# share of rows broken on purpose (each hits one clean.py rule) and of exact duplicate rows
+DIRTY_FRACTION = 0.05
+DUPLICATE_FRACTION = 0.01
+
+
+def yellow_columns(year):
+    """(name, SQL expression) of a yellow_tripdata file of year, in file order.
+
+    The expressions use the columns built by write_month(): i (row number),
+    pickup, dropoff, passengers, distance, fare and tip. Column set and types
+    drift like the real files: congestion_surcharge from 2019, airport_fee from
+    2022, INT32 VendorID and INT64 passenger_count from 2023.
+    """
+    vendor = "CAST((i % 2) + 1 AS INTEGER)" if year >= 2023 else "CAST((i % 2) + 1 AS BIGINT)"
+    passengers = "CAST(passengers AS BIGINT)" if year >= 2023 else "CAST(passengers AS DOUBLE)"
+    columns = [
+        ("VendorID", vendor),
+        ("tpep_pickup_datetime", "pickup"),
+        ("tpep_dropoff_datetime", "dropoff"),
+        ("passenger_count", passengers),
+        ("trip_distance", "distance"),
+        ("RatecodeID", "CAST(CASE WHEN i % 97 = 0 THEN 2.0 ELSE 1.0 END AS DOUBLE)"),
+        ("store_and_fwd_flag", "CASE WHEN i % 50 = 0 THEN 'Y' ELSE 'N' END"),
+        ("PULocationID", "CAST(1 + hash(i) % 263 AS INTEGER)"),
+        ("DOLocationID", "CAST(1 + hash(i + 1) % 263 AS INTEGER)"),
+        ("payment_type", "CAST(1 + i % 3 AS BIGINT)"),
+        ("fare_amount", "fare"),
+        ("extra", "CAST(i % 3 AS DOUBLE) * 0.5"),
+        ("mta_tax", "CAST(0.5 AS DOUBLE)"),
+        ("tip_amount", "tip"),
+        ("tolls_amount", "CAST(CASE WHEN i % 20 = 0 THEN 6.55 ELSE 0 END AS DOUBLE)"),
+        ("improvement_surcharge", "CAST(0.3 AS DOUBLE)"),
+        ("total_amount", "fare + tip + 0.8"),
+    ]
+    if year >= 2019:
+        columns.append(("congestion_surcharge", "CAST(2.5 AS DOUBLE)"))
+    if year >= 2022:
+        columns.append(("airport_fee", "CAST(CASE WHEN i % 15 = 0 THEN 1.25 ELSE 0 END AS DOUBLE)"))
+    return columns
+
+
+def green_columns(year):
+    # (name, SQL expression) of a green_tripdata file of year, see yellow_columns()
+    columns = [
+        ("VendorID", "CAST((i % 2) + 1 AS BIGINT)"),
+        ("lpep_pickup_datetime", "pickup"),
+        ("lpep_dropoff_datetime", "dropoff"),
+        ("store_and_fwd_flag", "CASE WHEN i % 50 = 0 THEN 'Y' ELSE 'N' END"),
+        ("RatecodeID", "CAST(CASE WHEN i % 97 = 0 THEN 2.0 ELSE 1.0 END AS DOUBLE)"),
+        ("PULocationID", "CAST(1 + hash(i) % 263 AS BIGINT)"),
+        ("DOLocationID", "CAST(1 + hash(i + 1) % 263 AS BIGINT)"),
+        ("passenger_count", "CAST(passengers AS DOUBLE)"),
+        ("trip_distance", "distance"),
+        ("fare_amount", "fare"),
+        ("extra", "CAST(i % 3 AS DOUBLE) * 0.5"),
+        ("mta_tax", "CAST(0.5 AS DOUBLE)"),
+        ("tip_amount", "tip"),
+        ("tolls_amount", "CAST(CASE WHEN i % 20 = 0 THEN 6.55 ELSE 0 END AS DOUBLE)"),
+        ("ehail_fee", "CAST(NULL AS DOUBLE)"),
+        ("improvement_surcharge", "CAST(0.3 AS DOUBLE)"),
+        ("total_amount", "fare + tip + 0.8"),
+        ("payment_type", "CAST(1 + i % 3 AS DOUBLE)"),
+        ("trip_type", "CAST(CASE WHEN i % 30 = 0 THEN 2.0 ELSE 1.0 END AS DOUBLE)"),
+    ]
+    if year >= 2019:
+        columns.append(("congestion_surcharge", "CAST(CASE WHEN i % 4 = 0 THEN 2.75 ELSE 0 END AS DOUBLE)"))
+    return columns
+
+
+SCHEMAS = {"yellow": yellow_columns, "green": green_columns}
+
+
+def month_file(out_dir, taxi_type, year, month):
+    # same file name as the TLC trip-data urls, so load.py can fetch from a local server
+    return os.path.join(out_dir, f"{taxi_type}_tripdata_{year}-{month:02d}.parquet")
+
+
+def write_month(con, out_dir, taxi_type, year, month, rows, seed=0):
+    """Write one synthetic monthly file and return its path.
+
+    Clean rows have pickups spread over the month, a 1-60 minute duration and a
+    skewed trip distance. DIRTY_FRACTION of the rows break one of the cleaning
+    rules (zero or NULL passengers, zero or >100 miles, negative or >24 hour
+    duration, pickup outside 2015-2024), DUPLICATE_FRACTION are repeated verbatim.
+    Output is deterministic for a given seed.
+    """
+    columns = ",\n                ".join(
+        f"{expression} AS {name}" for name, expression in SCHEMAS[taxi_type](year)
+    )
+    dirty_every = max(int(1 / DIRTY_FRACTION), 1)
+    # which rule a dirty row breaks, NULL for clean rows
+    rule = f"CASE WHEN i % {dirty_every} = 0 THEN (i // {dirty_every}) % 7 END"
+    path = month_file(out_dir, taxi_type, year, month)
+
+    def uniform(k):
+        # hash-based uniform [0, 1], unlike random() stable across threads and re-runs
+        return f"(hash(i, {seed}, {year * 100 + month}, {k}) / 18446744073709551615.0)"
+
+    con.execute(f"""
+        COPY (
+            WITH base AS (
+                SELECT
+                    i,
+                    {rule} AS rule,
+                    TIMESTAMP '{year}-{month:02d}-01'
+                        + to_seconds(CAST({uniform(1)} * 86400 * 28 AS BIGINT)) AS clean_pickup,
+                    to_seconds(60 + CAST({uniform(2)} * 3540 AS BIGINT)) AS trip_time,
+                    round(0.3 + 20 * pow({uniform(3)}, 3), 2) AS clean_distance,
+                    round(3 + 60 * {uniform(4)}, 2) AS fare,
+                    round(10 * {uniform(5)}, 2) AS tip
+                FROM range({rows}) t(i)
+            ),
+            dirty AS (
+                SELECT *,
+                    CASE rule WHEN 0 THEN 0 WHEN 1 THEN NULL ELSE 1 + i % 4 END AS passengers,
+                    CASE rule WHEN 2 THEN 0 WHEN 3 THEN 250.0 ELSE clean_distance END AS distance,
+                    CASE rule WHEN 4 THEN clean_pickup - INTERVAL 13 YEAR ELSE clean_pickup END AS pickup,
+                    CASE rule WHEN 5 THEN clean_pickup - INTERVAL 5 MINUTE
+                        WHEN 6 THEN clean_pickup + INTERVAL 30 HOUR
+                        ELSE clean_pickup + trip_time END AS dropoff
+                FROM base
+            ),
+            trips AS (
+                SELECT
+                i,
+                {columns}
+                FROM dirty
+            )
+            SELECT * EXCLUDE (i) FROM trips
+            UNION ALL
+            SELECT * EXCLUDE (i) FROM trips WHERE {uniform(6)} < {DUPLICATE_FRACTION}
+        ) TO '{path}' (FORMAT parquet)
+    """)
+    return path
+
+
+def generate(out_dir, scale=1.0, start_year=2023, end_year=2024, taxi_types=("yellow", "green"), seed=0):
+    """Write every monthly file for start_year..end_year, returns the paths written."""
+    os.makedirs(out_dir, exist_ok=True)
+    con = duckdb.connect()
+    paths = []
+    try:
+        for taxi_type in taxi_types:
+            rows = max(int(SCALE_ROWS[taxi_type] * scale), 1)
+            for year in range(start_year, end_year + 1):
+                for month in range(1, 13):
+                    paths.append(write_month(con, out_dir, taxi_type, year, month, rows, seed))
+    finally:
+        con.close()
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic yellow/green TLC monthly parquet files")
+    parser.add_argument("out_dir", help="directory for the *_tripdata_YYYY-MM.parquet files")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help=f"scale factor, 1 = {SCALE_ROWS['yellow']:,} yellow / {SCALE_ROWS['green']:,} green rows per month")
+    parser.add_argument("--start-year", type=int, default=2023)
+    parser.add_argument("--end-year", type=int, default=2024)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate(args.out_dir, args.scale, args.start_year, args.end_year, seed=args.seed)
+    print(f"Wrote {len(paths)} files to {args.out_dir}")
@@ -0,0 +1,123 @@
+# shared definitions for the taxi feeds, so load.py and clean.py apply exactly the same rules
+
+# pickup/dropoff column names differ per feed (tpep_* for yellow, lpep_* for green)
+TAXI_TYPES = {
+    "yellow": {
+        "pickup": "tpep_pickup_datetime",
+        "dropoff": "tpep_dropoff_datetime",
+    },
+    "green": {
+        "pickup": "lpep_pickup_datetime",
+        "dropoff": "lpep_dropoff_datetime",
+    },
+}
+
+# years kept by the cleaning step
+CLEAN_START_YEAR, CLEAN_END_YEAR = 2015, 2024
+
+
+def ensure_taxi_type_enum(con):
+    """Create the taxi_type ENUM from TAXI_TYPES, recreating it when a feed was added.
+
+    The unified trips views store taxi_type as this ENUM, one byte per row
+    instead of a repeated string.
+    """
+    values = list(TAXI_TYPES)
+    (exists,) = con.execute(
+        "SELECT COUNT(*) FROM duckdb_types() WHERE type_name = 'taxi_type'"
+    ).fetchone()
+    if exists:
+        (current,) = con.execute("SELECT enum_range(NULL::taxi_type)").fetchone()
+        if list(current) == values:
+            return
+        # only the trips views depend on the type, they are recreated by their stage
+        con.execute("DROP VIEW IF EXISTS trips")
+        con.execute("DROP VIEW IF EXISTS trips_clean")
+        con.execute("DROP TYPE taxi_type")
+    con.execute("CREATE TYPE taxi_type AS ENUM (" + ", ".join(f"'{v}'" for v in values) + ")")
+
+
+def trips_select(sources):
+    """UNION ALL of the per-feed relations in sources ({taxi_type: relation}).
+
+    Every feed's pickup/dropoff columns come out as pickup_ts/dropoff_ts next to
+    a taxi_type ENUM column, so one grouped scan answers for all feeds at once.
+    """
+    selects = []
+    for taxi_type, source in sources.items():
+        t = TAXI_TYPES[taxi_type]
+        selects.append(f"""
+            SELECT
+                CAST('{taxi_type}' AS taxi_type) AS taxi_type,
+                {t["pickup"]} AS pickup_ts,
+                {t["dropoff"]} AS dropoff_ts,
+                * EXCLUDE ({t["pickup"]}, {t["dropoff"]})
+            FROM {source}
+        """)
+    return "UNION ALL BY NAME".join(selects)
+
+
+def create_trips_view(con, name, sources):
+    # (re)create a unified view over the per-feed relations, see trips_select()
+    ensure_taxi_type_enum(con)
+    con.execute(f"CREATE OR REPLACE VIEW {name} AS {trips_select(sources)}")
+
+
+def clean_columns(taxi_type):
+    # the only columns kept after cleaning
+    t = TAXI_TYPES[taxi_type]
+    return [t["pickup"], t["dropoff"], "passenger_count", "trip_distance"]
+
+
+def clean_rules(taxi_type):
+    """Row filters of the cleaning step as (reason bit, name, SQL predicate).
+
+    A row is kept when every predicate is true. Rejected rows record the bits of
+    the predicates they failed (NULL counts as failed, like in a WHERE clause).
+    The year range is written as plain timestamp comparisons (same result as
+    EXTRACT(year ...) BETWEEN) so DuckDB can push it into parquet scans.
+    """
+    t = TAXI_TYPES[taxi_type]
+    pickup, dropoff = t["pickup"], t["dropoff"]
+    start = f"TIMESTAMP '{CLEAN_START_YEAR}-01-01'"
+    end = f"TIMESTAMP '{CLEAN_END_YEAR + 1}-01-01'"
+    return [
+        (1, "zero_passengers", "passenger_count > 0"),
+        (2, "zero_distance", "trip_distance > 0"),
+        (4, "long_distance", "trip_distance <= 100"),
+        (8, "non_positive_duration", f"({dropoff} - {pickup}) > INTERVAL '0' SECOND"),
+        (16, "long_duration", f"({dropoff} - {pickup}) <= INTERVAL '24' HOUR"),
+        (32, "pickup_year", f"{pickup} >= {start} AND {pickup} < {end}"),
+        (64, "dropoff_year", f"{dropoff} >= {start} AND {dropoff} < {end}"),
+    ]
+
+
+def clean_predicates(taxi_type):
+    return [predicate for _, _, predicate in clean_rules(taxi_type)]
+
+
+def reason_code(taxi_type):
+    # bitmask of the failed cleaning rules, 0 for rows that are kept
+    failed = " + ".join(
+        f"CASE WHEN ({predicate}) IS TRUE THEN 0 ELSE {bit} END"
+        for bit, _, predicate in clean_rules(taxi_type)
+    )
+    return f"CAST({failed} AS UTINYINT)"
+
+
+def month_predicate(column, month_start):
+    # half-open [month_start, next month) range on a timestamp column
+    return (f"{column} >= TIMESTAMP '{month_start}' "
+            f"AND {column} < TIMESTAMP '{month_start}' + INTERVAL 1 MONTH")
+
+
+def clean_select(taxi_type, source, extra_predicates=()):
+    """SELECT DISTINCT of the kept columns from source with all cleaning filters applied."""
+    columns = ",\n            ".join(clean_columns(taxi_type))
+    where = "\n            AND ".join(clean_predicates(taxi_type) + list(extra_predicates))
+    return f"""
+            SELECT DISTINCT
+            {columns}
+            FROM {source}
+            WHERE {where}
+    """
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# the pipeline scripts are top-level modules of the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tripdata(tmp_path_factory):
+    """Directory of small synthetic yellow and green monthly files for 2024."""
+    out_dir = tmp_path_factory.mktemp("tripdata")
+    generate(str(out_dir), scale=0.01, start_year=2024, end_year=2024)
+    return str(out_dir)
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # the scripts write their logs and databases to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,67 @@
+import duckdb
+import pytest
+
+import clean
+from clean import build_clean_table
+from load import ensure_load_manifest, load_month
+from synthetic import SCALE_ROWS, month_file, write_month
+from taxi_config import clean_select
+
+
+def clean_differs(con, taxi_type):
+    # rows of {taxi_type}_clean and of one whole-table DISTINCT over the raw table that the other lacks
+    expected = clean_select(taxi_type, f"{taxi_type}_taxi")
+    table = f"SELECT * FROM {taxi_type}_clean"
+    return [con.execute(f"SELECT COUNT(*) FROM ({a} EXCEPT ALL {b})").fetchone()[0]
+            for a, b in [(table, expected), (expected, table)]]
+
+
+@pytest.fixture
+def loaded(tripdata):
+    # yellow 2024-01..06 loaded and fully cleaned
+    con = duckdb.connect("clean.duckdb")
+    ensure_load_manifest(con)
+    for month in range(1, 7):
+        load_month(con, "yellow", 2024, month, month_file(tripdata, "yellow", 2024, month), f"2024-{month:02d}")
+    build_clean_table(con, "yellow")
+    yield con
+    con.close()
+
+
+def republish(con, tmp_path, tripdata):
+    # 2024-03 republished with other rows, 2024-07 new, 2024-02 dropped from the load
+    writer = duckdb.connect()
+    path = write_month(writer, str(tmp_path), "yellow", 2024, 3, int(SCALE_ROWS["yellow"] * 0.005), seed=7)
+    writer.close()
+    load_month(con, "yellow", 2024, 3, path, "2024-03-republished")
+    load_month(con, "yellow", 2024, 7, month_file(tripdata, "yellow", 2024, 7), "2024-07")
+    con.execute("DELETE FROM yellow_taxi WHERE source_month = DATE '2024-02-01'")
+    con.execute("DELETE FROM load_manifest WHERE taxi_type = 'yellow' AND year = 2024 AND month = 2")
+
+
+def test_incremental_clean_matches_full_distinct(loaded, tmp_path, tripdata):
+    republish(loaded, tmp_path, tripdata)
+    changed = build_clean_table(loaded, "yellow", incremental=True)
+    assert sorted(str(m) for m in changed) == ["2024-02-01", "2024-03-01", "2024-07-01"]
+    assert clean_differs(loaded, "yellow") == [0, 0]
+    months = loaded.execute("SELECT source_month FROM clean_manifest ORDER BY ALL").fetchall()
+    assert [str(m) for (m,) in months] == ["2024-01-01", "2024-03-01", "2024-04-01", "2024-05-01",
+                                           "2024-06-01", "2024-07-01"]
+    assert build_clean_table(loaded, "yellow", incremental=True) == []
+
+
+def test_failed_incremental_clean_keeps_manifest(loaded, tmp_path, tripdata, monkeypatch):
+    before = loaded.execute("SELECT * FROM clean_manifest ORDER BY ALL").fetchall()
+    republish(loaded, tmp_path, tripdata)
+
+    def fail(cur, taxi_type, month_start, target):
+        raise RuntimeError("partition failed")
+
+    with monkeypatch.context() as m:
+        m.setattr(clean, "rebuild_partition", fail)
+        with pytest.raises(RuntimeError):
+            build_clean_table(loaded, "yellow", incremental=True)
+    assert loaded.execute("SELECT * FROM clean_manifest ORDER BY ALL").fetchall() == before
+
+    build_clean_table(loaded, "yellow", incremental=True)
+    assert clean_differs(loaded, "yellow") == [0, 0]
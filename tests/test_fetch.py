@@ -0,0 +1,118 @@
+import threading
+import urllib.error
+
+import duckdb
+import pytest
+
+import fetch
+import load
+from benchmark import serve
+from fetch import RateLimiter, open_url
+from load import ensure_load_manifest, load_taxi_type, month_url
+
+MONTHS = [(2024, m) for m in range(1, 13)]
+
+
+@pytest.fixture
+def short_jitter(monkeypatch):
+    # keep open_url's per-worker jittered sleep to 2**attempt * 10 ms
+    monkeypatch.setattr(fetch.random, "uniform", lambda a, b: 0.01)
+
+
+@pytest.fixture
+def stand_in(tripdata):
+    servers = []
+
+    def start(**throttling):
+        server, base_url = serve(tripdata, **throttling)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def gaps(server):
+    times = [t for t, _, _ in server.requests]
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def test_throttled_requests_back_off(stand_in, short_jitter):
+    server, base_url = stand_in(throttle_first=2, throttle_status=403)
+    limiter = RateLimiter(rate=8.0, burst=1, min_rate=0.5)
+
+    with open_url(month_url(base_url, "yellow", 2024, 1), limiter) as resp:
+        assert resp.status == 200
+
+    assert [status for _, _, status in server.requests] == [403, 403, 200]
+    # halved on every throttled answer, one additive step back up on success
+    assert limiter.rate == pytest.approx(8.0 / 4 + 0.1)
+    # the waits follow the lowered rate: about 1/4 s, then 1/2 s
+    first, second = gaps(server)
+    assert first >= 0.2
+    assert second >= 0.45
+    assert second > first
+
+
+def test_retry_after_is_honoured(stand_in, short_jitter):
+    server, base_url = stand_in(throttle_first=1, retry_after=2)
+    limiter = RateLimiter(rate=50.0, burst=4)
+
+    with open_url(month_url(base_url, "yellow", 2024, 1), limiter) as resp:
+        assert resp.status == 200
+
+    assert [status for _, _, status in server.requests] == [429, 200]
+    assert gaps(server)[0] >= 2.0
+
+
+def test_retries_give_up(stand_in, short_jitter):
+    server, base_url = stand_in(throttle_first=100)
+    limiter = RateLimiter(rate=50.0, burst=4)
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        open_url(month_url(base_url, "yellow", 2024, 1), limiter, max_retries=2)
+    assert e.value.code == 429
+    assert len(server.requests) == 3
+
+
+def test_missing_month_is_not_retried(stand_in):
+    server, base_url = stand_in()
+    limiter = RateLimiter(rate=50.0, burst=4)
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        open_url(month_url(base_url, "yellow", 2031, 1), limiter)
+    assert e.value.code == 404
+    assert len(server.requests) == 1
+
+
+def test_concurrent_fetch_has_one_writer(stand_in, short_jitter, monkeypatch, tripdata):
+    server, base_url = stand_in(latency=0.05, throttle_every=3)
+    writes = []
+    load_month = load.load_month
+
+    def recording_load_month(con, taxi_type, year, month, source, checksum):
+        writes.append((threading.get_ident(), year, month))
+        return load_month(con, taxi_type, year, month, source, checksum)
+
+    monkeypatch.setattr(load, "load_month", recording_load_month)
+    con = duckdb.connect("emissions.duckdb")
+    ensure_load_manifest(con)
+    limiter = RateLimiter(rate=50.0, burst=8, min_rate=5.0, max_rate=100.0)
+
+    load_taxi_type(con, "yellow", base_url, MONTHS, 4, limiter)
+
+    # the throttling was hit and every month was still loaded exactly once, all on this thread
+    assert any(status == 429 for _, _, status in server.requests)
+    assert {ident for ident, _, _ in writes} == {threading.get_ident()}
+    assert sorted((year, month) for _, year, month in writes) == MONTHS
+    manifest = con.execute("SELECT year, month, row_count FROM load_manifest ORDER BY ALL").fetchall()
+    assert [(year, month) for year, month, _ in manifest] == MONTHS
+    loaded = dict(con.execute("""
+        SELECT month(source_month), COUNT(*) FROM yellow_taxi GROUP BY ALL
+    """).fetchall())
+    for year, month, row_count in manifest:
+        (file_rows,) = con.execute("SELECT COUNT(*) FROM read_parquet(?)",
+                                   [f"{tripdata}/yellow_tripdata_{year}-{month:02d}.parquet"]).fetchone()
+        assert loaded[month] == row_count == file_rows
+    con.close()
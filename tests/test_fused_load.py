@@ -0,0 +1,50 @@
+import duckdb
+import pytest
+
+from clean import build_clean_table
+from load import ensure_load_manifest, fused_load, load_month
+from synthetic import SCALE_ROWS, month_file, write_month
+
+# 2024 plus older months whose column sets and types differ (see synthetic.yellow_columns)
+OLDER_MONTHS = [(2018, 12), (2022, 6)]
+
+
+@pytest.fixture
+def month_files(tripdata, tmp_path):
+    def files(taxi_type):
+        con = duckdb.connect()
+        older = [(year, month, write_month(con, str(tmp_path), taxi_type, year, month,
+                                           int(SCALE_ROWS[taxi_type] * 0.01)))
+                 for year, month in OLDER_MONTHS]
+        con.close()
+        current = [(2024, m, month_file(tripdata, taxi_type, 2024, m)) for m in range(1, 13)]
+        return [(year, month, path, f"{year}-{month:02d}") for year, month, path in older + current]
+    return files
+
+
+def except_all(con, left, right):
+    return con.execute(f"SELECT COUNT(*) FROM (SELECT * FROM {left} EXCEPT ALL SELECT * FROM {right})").fetchone()[0]
+
+
+@pytest.mark.parametrize("taxi_type", ["yellow", "green"])
+@pytest.mark.parametrize("strategy", ["partitioned", "distinct"])
+def test_fused_load_matches_load_then_clean(month_files, taxi_type, strategy):
+    files = month_files(taxi_type)
+
+    fused = duckdb.connect("fused.duckdb")
+    ensure_load_manifest(fused)
+    fused_load(fused, taxi_type, files)
+    fused.close()
+
+    con = duckdb.connect("staged.duckdb")
+    ensure_load_manifest(con)
+    for year, month, path, checksum in files:
+        load_month(con, taxi_type, year, month, path, checksum)
+    build_clean_table(con, taxi_type, strategy)
+
+    con.execute("ATTACH 'fused.duckdb' AS fused (READ_ONLY)")
+    staged, fused_clean = f"main.{taxi_type}_clean", f"fused.main.{taxi_type}_clean"
+    assert con.execute(f"SELECT COUNT(*) FROM {staged}").fetchone()[0] > 0
+    assert except_all(con, staged, fused_clean) == 0
+    assert except_all(con, fused_clean, staged) == 0
+    con.close()
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+import duckdb
+import pytest
+
+import service
+
+
+def slow_query(cur, params):
+    # stands in for an endpoint, long enough that requests queue up behind the single worker
+    return cur.execute("SELECT COUNT(*) FROM range(200000)").fetchone()[0] + int(params["n"])
+
+
+def test_snapshot_switch_under_load(monkeypatch, work_dir):
+    snapshots = [str(work_dir / f"snapshot_{i}.duckdb") for i in range(3)]
+    for path in snapshots:
+        duckdb.connect(path).close()
+    current = [snapshots[0]]
+    monkeypatch.setattr(service, "reader_database", lambda database=None: database or current[0])
+    monkeypatch.setattr(service, "REFRESH_SECONDS", 0)
+    monkeypatch.setitem(service.ENDPOINTS, "/max", slow_query)
+
+    async def run():
+        svc = service.EmissionsService(workers=1)
+        try:
+            async def request(n):
+                # publish a new snapshot twice while earlier requests are still queued
+                if n in (100, 250):
+                    current[0] = snapshots[1 if n == 100 else 2]
+                return await svc.query("/max", {"n": str(n)})
+
+            tasks = []
+            for n in range(400):
+                tasks.append(asyncio.ensure_future(request(n)))
+                await asyncio.sleep(0)
+            return svc, await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+        finally:
+            svc.close()
+
+    svc, results = asyncio.run(run())
+    assert results == [200000 + n for n in range(400)]
+    assert svc.pool.database == snapshots[2]
+    assert not [t for t in threading.enumerate() if t.name.startswith("query")]
+
+
+def test_closed_pool_raises(work_dir):
+    path = str(work_dir / "snapshot.duckdb")
+    duckdb.connect(path).close()
+    pool = service.CursorPool(path, 1)
+    pool.borrow()
+    pool.retire()
+    assert not pool.closed
+    assert pool.run(lambda cur: cur.execute("SELECT 1").fetchone()[0]) == 1
+    assert pool.closed
+    with pytest.raises(RuntimeError):
+        pool.borrow()
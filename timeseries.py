@@ -0,0 +1,235 @@
+import argparse
+import logging
+
+from profiling import connect
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from rollup import transformed_source
+from taxi_config import TAXI_TYPES, trips_select
+
+logger = logging.getLogger(__name__)
+
+# Continuous aggregates: trips_hourly and trips_daily hold trip count, distance,
+# CO2 and the parts of mean mph (sum and count, so buckets can be merged) per
+# taxi type and hour / day. They are refreshed one pickup month at a time from
+# the transformed trips: transform.py records a version per pickup month it
+# produced in transform_manifest, timeseries_manifest keeps the versions the
+# aggregates were built from, and only the months whose version differs or that
+# are in only one of the two are recomputed. Keying on what transform produced
+# (not on clean_manifest) means a refresh between clean.py and transform.py
+# doesn't mark months up to date that the transformed trips don't have yet.
+AGGREGATES = ["trips_hourly", "trips_daily"]
+
+
+def table_exists(con, table):
+    return con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [table]).fetchone()[0] > 0
+
+
+def ensure_timeseries(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS trips_hourly (
+            taxi_type VARCHAR,
+            hour TIMESTAMP,
+            trips BIGINT,
+            distance DOUBLE,
+            co2_kgs DOUBLE,
+            mph_sum DOUBLE,
+            mph_count BIGINT,
+            PRIMARY KEY (taxi_type, hour)
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS trips_daily (
+            taxi_type VARCHAR,
+            day DATE,
+            trips BIGINT,
+            distance DOUBLE,
+            co2_kgs DOUBLE,
+            mph_sum DOUBLE,
+            mph_count BIGINT,
+            PRIMARY KEY (taxi_type, day)
+        )
+    """)
+    # the transform_manifest rows the aggregates reflect
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS timeseries_manifest (
+            taxi_type VARCHAR,
+            pickup_month DATE,
+            version VARCHAR,
+            PRIMARY KEY (taxi_type, pickup_month)
+        )
+    """)
+
+
+def changed_months(con, taxi_type):
+    """Pickup months of taxi_type to recompute, None when everything has to be.
+
+    A pickup month is changed when its transform_manifest version differs from
+    the recorded one, or it is in only one of the two manifests. Without any
+    transform_manifest rows (transform.py not run since, or interrupted) nothing
+    is known about the transformed trips and everything is recomputed.
+    """
+    if not table_exists(con, "transform_manifest"):
+        return None
+    for manifest in ("transform_manifest", "timeseries_manifest"):
+        if not con.execute(f"SELECT COUNT(*) FROM {manifest} WHERE taxi_type = ?", [taxi_type]).fetchone()[0]:
+            return None
+    rows = con.execute("""
+        SELECT pickup_month
+        FROM (SELECT * FROM transform_manifest WHERE taxi_type = ?) t
+        FULL OUTER JOIN (SELECT * FROM timeseries_manifest WHERE taxi_type = ?) s
+            USING (taxi_type, pickup_month)
+        WHERE t.version IS DISTINCT FROM s.version
+    """, [taxi_type, taxi_type]).fetchall()
+    return sorted(m for (m,) in rows if m is not None)
+
+
+def hourly_select(taxi_type, parquet_dir=None, where=""):
+    # hourly buckets of one taxi type's transformed trips
+    source = trips_select({taxi_type: transformed_source(taxi_type, parquet_dir)})
+    return f"""
+        SELECT
+            CAST(taxi_type AS VARCHAR) AS taxi_type,
+            date_trunc('hour', pickup_ts) AS hour,
+            COUNT(*) AS trips,
+            SUM(trip_distance) AS distance,
+            SUM(trip_co2_kgs) AS co2_kgs,
+            SUM(avg_mph) AS mph_sum,
+            COUNT(avg_mph) AS mph_count
+        FROM ({source})
+        WHERE pickup_ts IS NOT NULL {where}
+        GROUP BY ALL
+    """
+
+
+def daily_select(taxi_type, where=""):
+    # days are merged from the hours, never from the trips
+    return f"""
+        SELECT taxi_type, CAST(hour AS DATE) AS day,
+            SUM(trips), SUM(distance), SUM(co2_kgs), SUM(mph_sum), SUM(mph_count)
+        FROM trips_hourly
+        WHERE taxi_type = '{taxi_type}' {where}
+        GROUP BY ALL
+    """
+
+
+def refresh_taxi_type(con, taxi_type, parquet_dir=None, full=False):
+    """Bring taxi_type's hourly and daily buckets up to date. Returns the pickup months recomputed (None: all)."""
+    months = None if full else changed_months(con, taxi_type)
+    if months == []:
+        logger.info(f"{taxi_type} time series are up to date")
+        print(f"{taxi_type} time series are up to date")
+        return []
+
+    if months is None:
+        hour_where = day_where = pickup_where = ""
+    else:
+        listed = ", ".join(f"DATE '{m}'" for m in months)
+        hour_where = f"AND CAST(date_trunc('month', hour) AS DATE) IN ({listed})"
+        day_where = f"AND CAST(date_trunc('month', day) AS DATE) IN ({listed})"
+        if parquet_dir:
+            # the year=/month= partition keys, so files of other months are never opened
+            pickup_where = "AND (" + " OR ".join(f"(year = {m.year} AND month = {m.month})" for m in months) + ")"
+        else:
+            pickup_where = f"AND CAST(date_trunc('month', pickup_ts) AS DATE) IN ({listed})"
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM trips_hourly WHERE taxi_type = ? {hour_where}", [taxi_type])
+        con.execute(f"DELETE FROM trips_daily WHERE taxi_type = ? {day_where}", [taxi_type])
+        con.execute(f"INSERT INTO trips_hourly {hourly_select(taxi_type, parquet_dir, pickup_where)}")
+        con.execute(f"INSERT INTO trips_daily {daily_select(taxi_type, hour_where)}")
+        con.execute("DELETE FROM timeseries_manifest WHERE taxi_type = ?", [taxi_type])
+        if table_exists(con, "transform_manifest"):
+            con.execute("INSERT INTO timeseries_manifest SELECT * FROM transform_manifest WHERE taxi_type = ?",
+                        [taxi_type])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    what = "all months" if months is None else f"{len(months)} months"
+    logger.info(f"Refreshed {taxi_type} hourly and daily aggregates for {what}")
+    print(f"Refreshed {taxi_type} hourly and daily aggregates for {what}")
+    return months
+
+
+def refresh_timeseries(con, parquet_dir=None, full=False):
+    ensure_timeseries(con)
+    return {t: refresh_taxi_type(con, t, parquet_dir, full) for t in TAXI_TYPES}
+
+
+def rolling_7day(con, taxi_type, start=None, end=None):
+    """Daily trips, distance, CO2 and mean mph with their trailing 7-day sums (mean mph over 7 days).
+
+    Returns rows of (day, trips, co2_kgs, mean_mph, trips_7d, distance_7d, co2_kgs_7d, mean_mph_7d).
+    Missing days count as zero trips, the window is calendar days not rows.
+    """
+    where = "".join([
+        "" if start is None else f" AND day >= DATE '{start}'",
+        "" if end is None else f" AND day <= DATE '{end}'",
+    ])
+    return con.execute(f"""
+        WITH w AS (
+            SELECT day, trips, co2_kgs, mph_sum / NULLIF(mph_count, 0) AS mean_mph,
+                SUM(trips) OVER seven AS trips_7d,
+                SUM(distance) OVER seven AS distance_7d,
+                SUM(co2_kgs) OVER seven AS co2_kgs_7d,
+                SUM(mph_sum) OVER seven / NULLIF(SUM(mph_count) OVER seven, 0) AS mean_mph_7d
+            FROM trips_daily
+            WHERE taxi_type = ?
+            WINDOW seven AS (ORDER BY day RANGE BETWEEN INTERVAL 6 DAYS PRECEDING AND CURRENT ROW)
+        )
+        SELECT * FROM w WHERE true {where} ORDER BY day
+    """, [taxi_type]).fetchall()
+
+
+def year_over_year(con, taxi_type, by="month"):
+    """CO2 and trips per month (or day) against the same period a year earlier.
+
+    Returns rows of (period, trips, co2_kgs, co2_kgs_prev_year, pct_change).
+    """
+    period = {"month": "CAST(date_trunc('month', day) AS DATE)", "day": "day"}[by]
+    return con.execute(f"""
+        WITH p AS (
+            SELECT {period} AS period, SUM(trips) AS trips, SUM(co2_kgs) AS co2_kgs
+            FROM trips_daily
+            WHERE taxi_type = ?
+            GROUP BY ALL
+        )
+        SELECT cur.period, cur.trips, cur.co2_kgs, prev.co2_kgs,
+            100.0 * (cur.co2_kgs - prev.co2_kgs) / NULLIF(prev.co2_kgs, 0)
+        FROM p cur
+        LEFT JOIN p prev ON prev.period = CAST(cur.period - INTERVAL 1 YEAR AS DATE)
+        ORDER BY cur.period
+    """, [taxi_type]).fetchall()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='timeseries.log'
+    )
+    parser = argparse.ArgumentParser(description="Refresh the hourly and daily trip aggregates incrementally")
+    parser.add_argument("--parquet-dir", default=None,
+                        help="read transform.py's hive-partitioned parquet output instead of the tables")
+    parser.add_argument("--full", action="store_true", help="recompute every bucket")
+    parser.add_argument("--yoy", choices=list(TAXI_TYPES), default=None,
+                        help="print the monthly year-over-year series of a taxi type")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    con = None
+    try:
+        con = connect('emissions.duckdb')
+        logger.info("Connected to emissions database")
+        apply_resources(con, "rollup", **resource_overrides(args))
+        refresh_timeseries(con, args.parquet_dir, args.full)
+        if args.yoy:
+            for period, trips, co2, prev, pct in year_over_year(con, args.yoy):
+                change = "" if pct is None else f" ({pct:+.1f}% vs {period.year - 1})"
+                print(f"{args.yoy.upper()} {period:%Y-%m}: {trips:,} trips, {co2:,.3f} kg{change}")
+    except Exception as e:
+        logger.error(f"Error refreshing time series: {e}")
+        print(f"Error refreshing time series: {e}")
+    finally:
+        if con is not None:
+            con.close()
@@ -1,5 +1,12 @@
-import duckdb
+import argparse
 import logging
+import os
+
+from profiling import connect
+from query_cache import bump_table_version
+from resources import add_resource_arguments, apply_resources, resource_overrides
+from rollup import transformed_source
+from taxi_config import TAXI_TYPES, create_trips_view
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,94 +20,187 @@ log = logging.getLogger(__name__)
 # PLEASE REFER TO THE DBT DIRECTORY FOR TRANSFORMATION LOGIC
 # -----------------------------------------------------------------------------------------------------
 
-def transform_parquet():
-    try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        log.info("Connected to emissions.duckdb database")
-        print("Connected to emissions.duckdb database")
-        con.execute("PRAGMA memory_limit='4GB'")
+# parquet output settings: large row groups keep min/max stats useful, zstd keeps files small
+PARQUET_ROW_GROUP_SIZE = 1_000_000
+PARQUET_COMPRESSION = "zstd"
+
 
-        # Transform yellow taxi data
-        con.execute("""
-            CREATE OR REPLACE TABLE yellow_transformed AS
+def transform_select(taxi_type):
+    t = TAXI_TYPES[taxi_type]
+    pickup, dropoff = t["pickup"], t["dropoff"]
+    return f"""
             WITH base AS (
                 SELECT
-                    y.*,
+                    c.*,
 
                     -- calculate trip duration in seconds for each trip
-                    DATEDIFF('second', y.tpep_pickup_datetime, y.tpep_dropoff_datetime) AS duration,
+                    DATEDIFF('second', c.{pickup}, c.{dropoff}) AS duration,
 
-                    -- get the grams per mile for yellow taxis from vehicle_emissions table
+                    -- get the grams per mile for this taxi type from vehicle_emissions table
                     (SELECT co2_grams_per_mile
                     FROM vehicle_emissions
-                    WHERE vehicle_type = 'yellow_taxi') AS gpm
-                FROM yellow_taxi y
+                    WHERE vehicle_type = '{taxi_type}_taxi') AS gpm
+                FROM {taxi_type}_clean c
             )
         SELECT
             *,
             -- add column to calculate CO2 emissions per trip in kilograms
             (trip_distance * gpm) / 1000.0 AS trip_co2_kgs,
-          
+
             -- add column to calculate average speed in miles per hour, with guard against division by zero
             CASE WHEN duration > 0 THEN trip_distance / (duration / 3600.0) END AS avg_mph,
-                    
+
             -- add column to calculate hour of the day
-            CAST(strftime(tpep_pickup_datetime, '%H') AS INTEGER) AS hour_of_day,
-                    
+            CAST(strftime({pickup}, '%H') AS INTEGER) AS hour_of_day,
+
             -- add column to calculate day of the week (1=Monday, 7=Sunday)
-            CAST(strftime(tpep_pickup_datetime, '%u') AS INTEGER) AS day_of_week, 
+            CAST(strftime({pickup}, '%u') AS INTEGER) AS day_of_week,
 
             -- add column to calculate week of the year
-            CAST(strftime(tpep_pickup_datetime, '%V') AS INTEGER) AS week_of_year,  
-                    
+            CAST(strftime({pickup}, '%V') AS INTEGER) AS week_of_year,
+
             -- add column to calculate month of the year
-            CAST(strftime(tpep_pickup_datetime, '%m') AS INTEGER) AS month_of_year
-        FROM base;
-        """)
-        print("Built yellow_transformed")
-        log.info("Built yellow_transformed")
-    
-        # Transform green taxi data
-        con.execute("""
-            CREATE OR REPLACE TABLE green_transformed AS
-            WITH base AS (
-                SELECT
-                    g.*,
+            CAST(strftime({pickup}, '%m') AS INTEGER) AS month_of_year,
 
-                    -- calculate trip duration in seconds for each trip
-                    DATEDIFF('second', g.lpep_pickup_datetime, g.lpep_dropoff_datetime) AS duration,
+            -- pickup month, the unit the incremental dbt models delete and re-insert
+            CAST(date_trunc('month', {pickup}) AS DATE) AS pickup_month
+        FROM base
+    """
 
-                    -- get the grams per mile for green taxis from vehicle_emissions table
-                    (SELECT co2_grams_per_mile
-                    FROM vehicle_emissions
-                    WHERE vehicle_type = 'green_taxi') AS gpm
-                FROM green_taxi g
-            )
-        SELECT
-            *,
-            -- add column to calculate CO2 emissions per trip in kilograms
-            (trip_distance * gpm) / 1000.0 AS trip_co2_kgs,
-                    
-            -- add column to calculate average speed in miles per hour, with guard against division by zero
-            CASE WHEN duration > 0 THEN trip_distance / (duration / 3600.0) END AS avg_mph,
-            
-            -- add column to calculate hour of the day
-            CAST(strftime(lpep_pickup_datetime, '%H') AS INTEGER) AS hour_of_day,
-                    
-            -- add column to calculate day of the week (1=Monday, 7=Sunday)
-            CAST(strftime(lpep_pickup_datetime, '%u') AS INTEGER) AS day_of_week,
 
-            -- add column to calculate week of the year
-            CAST(strftime(lpep_pickup_datetime, '%V') AS INTEGER) AS week_of_year,
-
-            -- add column to calculate month of the year  
-            CAST(strftime(lpep_pickup_datetime, '%m') AS INTEGER) AS month_of_year
-        FROM base;
-        """)
-        print("Built green_transformed")
-        log.info("Built green_transformed")
+def export_parquet(con, taxi_type, parquet_dir):
+    """Write the transformed trips of taxi_type as taxi_type=/year=/month= partitioned parquet.
+
+    Readers using hive_partitioning=true can then skip every file outside the
+    years/months they filter on.
+    """
+    pickup = TAXI_TYPES[taxi_type]["pickup"]
+    target = os.path.join(parquet_dir, f"taxi_type={taxi_type}")
+    os.makedirs(parquet_dir, exist_ok=True)
+    con.execute(f"""
+        COPY (
+            SELECT *,
+                CAST(EXTRACT(year FROM {pickup}) AS INTEGER) AS year,
+                month_of_year AS month
+            FROM ({transform_select(taxi_type)})
+        ) TO '{target}' (
+            FORMAT parquet,
+            PARTITION_BY (year, month),
+            ROW_GROUP_SIZE {PARQUET_ROW_GROUP_SIZE},
+            COMPRESSION {PARQUET_COMPRESSION},
+            OVERWRITE
+        )
+    """)
+
+
+def ensure_transform_manifest(con):
+    # one version per pickup month of the transformed trips, changed whenever
+    # that month's rows can have; timeseries.py refreshes the months whose version moved
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS transform_manifest (
+            taxi_type VARCHAR,
+            pickup_month DATE,
+            version VARCHAR,
+            PRIMARY KEY (taxi_type, pickup_month)
+        )
+    """)
+
+
+def record_transform_manifest(con, taxi_type, parquet_dir=None):
+    """Version every pickup month transform just produced for taxi_type.
+
+    A month's version hashes the emission factor and the clean_manifest checksums
+    of the source months whose rows fall into it, so an unchanged month keeps
+    its version across rebuilds. Without a clean_manifest (fused load) every
+    month gets a new random version.
+    """
+    ensure_transform_manifest(con)
+    months = f"(SELECT DISTINCT pickup_month FROM {transformed_source(taxi_type, parquet_dir)})"
+    has_manifest = con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'clean_manifest'"
+    ).fetchone()[0] and con.execute(
+        "SELECT COUNT(*) FROM clean_manifest WHERE taxi_type = ?", [taxi_type]
+    ).fetchone()[0]
+    con.execute("DELETE FROM transform_manifest WHERE taxi_type = ?", [taxi_type])
+    if not has_manifest:
+        con.execute(f"""
+            INSERT INTO transform_manifest
+            SELECT ?, pickup_month, CAST(gen_random_uuid() AS VARCHAR) FROM {months}
+            WHERE pickup_month IS NOT NULL
+        """, [taxi_type])
+        return
+    con.execute(f"""
+        INSERT INTO transform_manifest
+        SELECT ?, p.pickup_month, md5(concat_ws(':',
+            (SELECT co2_grams_per_mile FROM vehicle_emissions WHERE vehicle_type = ?),
+            string_agg(c.source_month || '=' || c.checksum, ',' ORDER BY c.source_month)))
+        FROM {months} p
+        LEFT JOIN clean_manifest c ON c.taxi_type = ? AND list_contains(c.pickup_months, p.pickup_month)
+        WHERE p.pickup_month IS NOT NULL
+        GROUP BY p.pickup_month
+    """, [taxi_type, f"{taxi_type}_taxi", taxi_type])
+
+
+def transform_taxi_type(con, taxi_type, parquet_dir=None):
+    if parquet_dir:
+        # no versions while the files are rewritten, an interrupted export then refreshes every month
+        ensure_transform_manifest(con)
+        con.execute("DELETE FROM transform_manifest WHERE taxi_type = ?", [taxi_type])
+        export_parquet(con, taxi_type, parquet_dir)
+        # a table left by an earlier table-mode run would now be stale next to the parquet
+        con.execute(f"DROP TABLE IF EXISTS {taxi_type}_transformed")
+        record_transform_manifest(con, taxi_type, parquet_dir)
+        print(f"Wrote {taxi_type} transformed trips to {parquet_dir}")
+        log.info(f"Wrote {taxi_type} transformed trips to {parquet_dir}")
+    else:
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(f"""
+                CREATE OR REPLACE TABLE {taxi_type}_transformed AS
+                {transform_select(taxi_type)}
+            """)
+            record_transform_manifest(con, taxi_type)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        print(f"Built {taxi_type}_transformed")
+        log.info(f"Built {taxi_type}_transformed")
+    bump_table_version(con, f"{taxi_type}_transformed")
+
+
+def create_trips(con, parquet_dir=None):
+    # unified view over both feeds (pickup_ts/dropoff_ts, ENUM taxi_type), the
+    # cube and any cross-feed query scan this once instead of once per feed
+    create_trips_view(con, "trips", {t: transformed_source(t, parquet_dir) for t in TAXI_TYPES})
+    print("Created trips view")
+    log.info("Created trips view")
+
+
+def transform_parquet(parquet_dir=None, resources=None):
+    try:
+        con = connect('emissions.duckdb')
+        log.info("Connected to emissions.duckdb database")
+        print("Connected to emissions.duckdb database")
+        apply_resources(con, "transform", **(resources or {}))
+
+        for taxi_type in TAXI_TYPES:
+            transform_taxi_type(con, taxi_type, parquet_dir)
+        create_trips(con, parquet_dir)
+
+        # the aggregate cube is built from the tables above, drop it so analysis.py
+        # never answers from a stale one (rollup.py or analysis.py rebuild it)
+        con.execute("DROP TABLE IF EXISTS emissions_cube")
+        bump_table_version(con, "emissions_cube")
     except Exception as e:
         print(f"An error occurred during transformation: {e}")
         log.error(f"An error occurred during transformation: {e}")
+
+
 if __name__ == "__main__":
-    transform_parquet()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the transformed trip tables")
+    parser.add_argument("--parquet-dir", default=None,
+                        help="write hive-partitioned parquet (taxi_type=/year=/month=) here instead of tables")
+    add_resource_arguments(parser)
+    args = parser.parse_args()
+    transform_parquet(parquet_dir=args.parquet_dir, resources=resource_overrides(args))